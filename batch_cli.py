@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from config_manager import ConfigManager
+from logger_manager import LoggerManager
+from history_manager import estimate_tokens
+from request_worker import CancelToken, RequestCancelled
+from resilience import configure_resilience, get_rate_limiter
+from proxy_resolver import configure_resolver
+from role_session import RoleSession
+
+
+def read_items(source, pattern='*.txt'):
+    """
+    读取待处理的条目
+    :param source: 目录、JSONL 文件或 - 表示标准输入
+    :param pattern: 目录模式下匹配的文件名
+    :return: [(id, text)]，目录模式的 id 为相对路径，JSONL 模式优先使用记录中的 id，否则为行号
+    """
+    if source != '-' and os.path.isdir(source):
+        root = Path(source)
+        return [
+            (path.relative_to(root).as_posix(), path.read_text(encoding='utf-8'))
+            for path in sorted(root.rglob(pattern)) if path.is_file()
+        ]
+
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    items = []
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 标准输入中不是 JSON 的行按纯文本处理
+                record = line
+            if isinstance(record, dict):
+                items.append((str(record.get('id', line_number)), record.get('text', '')))
+            else:
+                items.append((str(line_number), str(record)))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return items
+
+
+def load_checkpoint(path):
+    """读取已有的结果文件，返回成功完成的条目 id，失败的条目会重新处理"""
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次中断时可能写了半行
+                continue
+            if record.get('error') is None and 'id' in record:
+                done.add(str(record['id']))
+    return done
+
+
+class BatchRunner:
+    """
+    批量处理
+    在有限的并发和每秒请求数限制下，用同一个角色处理所有条目，结果按完成顺序逐行写入 JSONL
+    """
+
+    def __init__(self, config, role, concurrency=4, rate=0.0, temperature=None, max_tokens=None, ollama_api=None):
+        """
+        :param config: 配置快照
+        :param role: RoleConfig
+        :param concurrency: 同时进行的请求数
+        :param rate: 每秒最多发送的请求数，0 表示不限制
+        :param ollama_api: Ollama 模式下使用的 OllamaAPI 实例
+        """
+        self.config = config
+        self.role = role
+        self.concurrency = max(1, int(concurrency))
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.ollama_api = ollama_api
+        self.limiter = get_rate_limiter(config.base_url, rate, burst=self.concurrency)
+        self.local = threading.local()
+        self.cancel_token = CancelToken()
+        self.write_lock = threading.Lock()
+        self.logger = LoggerManager.get_logger()
+
+    def get_session(self):
+        """每个线程使用自己的会话，统计信息互不干扰；连接池仍然共享"""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = RoleSession(self.config, self.role, keep_history=False, ollama_api=self.ollama_api)
+            self.local.session = session
+        return session
+
+    def process(self, item_id, text):
+        """处理一个条目，返回结果记录"""
+        self.limiter.acquire(self.cancel_token)
+        session = self.get_session()
+        start = time.perf_counter()
+        record = {"id": item_id, "role": session.role_name, "model": session.model}
+        try:
+            output = session.complete(text, self.temperature, self.max_tokens, cancel_token=self.cancel_token)
+            stats = session.last_stats or {}
+            record.update({
+                "output": output,
+                "completion_tokens": stats.get("completion_tokens") or estimate_tokens(output),
+                "error": None
+            })
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            record.update({"output": None, "completion_tokens": 0, "error": str(e)})
+        record["elapsed"] = round(time.perf_counter() - start, 3)
+        return record
+
+    def run(self, items, output_path=None):
+        """
+        并发处理全部条目
+        :param items: [(id, text)]
+        :param output_path: 结果 JSONL 文件，追加写入；为空时写到标准输出
+        :return: 汇总统计
+        """
+        summary = {"items": len(items), "succeeded": 0, "failed": 0, "completion_tokens": 0}
+        out = open(output_path, 'a', encoding='utf-8') if output_path else sys.stdout
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="Batch")
+        try:
+            futures = [executor.submit(self.process, item_id, text) for item_id, text in items]
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except RequestCancelled:
+                    continue
+                with self.write_lock:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    # 每条结果立即落盘，中断后重新运行会跳过已完成的条目
+                    out.flush()
+                if record["error"] is None:
+                    summary["succeeded"] += 1
+                    summary["completion_tokens"] += record["completion_tokens"]
+                else:
+                    summary["failed"] += 1
+                    self.logger.warning(f"条目处理失败 - {record['id']}: {record['error']}")
+                done = summary["succeeded"] + summary["failed"]
+                print(f"\r进度: {done}/{len(items)}，失败 {summary['failed']}", end='', file=sys.stderr, flush=True)
+        except KeyboardInterrupt:
+            self.cancel_token.cancel()
+            print("\n已中断，已完成的结果已保存，重新运行会从断点继续", file=sys.stderr)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if out is not sys.stdout:
+                out.close()
+
+        elapsed = time.perf_counter() - start
+        summary["elapsed"] = round(elapsed, 3)
+        summary["items_per_second"] = round((summary["succeeded"] + summary["failed"]) / elapsed, 2) if elapsed else 0.0
+        summary["tokens_per_second"] = round(summary["completion_tokens"] / elapsed, 1) if elapsed else 0.0
+        return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用指定角色批量处理文档")
+    parser.add_argument('source', help="输入：目录、JSONL 文件（每行 {\"id\": ..., \"text\": ...}），或 - 表示标准输入")
+    parser.add_argument('-o', '--output', help="结果 JSONL 文件，同时作为断点记录；为空时输出到标准输出")
+    parser.add_argument('--role', help="角色名称，默认使用当前角色")
+    parser.add_argument('--config', default='config.json', help="配置文件路径")
+    parser.add_argument('--pattern', default='*.txt', help="目录模式下匹配的文件名")
+    parser.add_argument('--concurrency', type=int, default=4, help="同时进行的请求数")
+    parser.add_argument('--rate', type=float, default=0.0, help="每秒最多发送的请求数，0 表示不限制")
+    parser.add_argument('--temperature', type=float, help="覆盖角色的 temperature")
+    parser.add_argument('--max-tokens', type=int, help="覆盖角色的最大输出 token 数")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger = LoggerManager.get_logger()
+    config_manager = ConfigManager(args.config)
+    config = config_manager.get_snapshot()
+    configure_resolver(config)
+    configure_resilience(config)
+    LoggerManager.configure(config)
+    # 控制台只显示进度和警告，详细日志仍写入日志文件
+    LoggerManager.console_handler.setLevel('WARNING')
+
+    role = config.get_role(args.role)
+    if role is None:
+        print(f"未找到角色: {args.role or config.current_role}", file=sys.stderr)
+        return 2
+
+    ollama_api = None
+    if config.api_type == 'Ollama':
+        from ollama_api import OllamaAPI
+
+        ollama_api = OllamaAPI(config_manager)
+    else:
+        from http_transport import set_pool_size
+
+        # 每个并发请求占用一个连接，连接池小于并发数时多出的连接用完即被丢弃
+        set_pool_size(max(4, args.concurrency))
+
+    items = read_items(args.source, args.pattern)
+    done = load_checkpoint(args.output)
+    pending = [(item_id, text) for item_id, text in items if item_id not in done]
+    if done:
+        print(f"从断点继续，跳过已完成的 {len(items) - len(pending)} 个条目", file=sys.stderr)
+    logger.info(f"批量处理 - 角色: {role.name}, 条目: {len(pending)}, 并发: {args.concurrency}, 限流: {args.rate or '不限'}/s")
+
+    runner = BatchRunner(config, role, args.concurrency, args.rate, args.temperature, args.max_tokens, ollama_api)
+    summary = runner.run(pending, args.output)
+    summary["skipped"] = len(items) - len(pending)
+    print(file=sys.stderr)
+    print(
+        f"完成 {summary['succeeded']} 个，失败 {summary['failed']} 个，跳过 {summary['skipped']} 个，"
+        f"耗时 {summary['elapsed']:.1f}s，{summary['items_per_second']} 条/s，{summary['tokens_per_second']} tokens/s",
+        file=sys.stderr
+    )
+    config_manager.flush()
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
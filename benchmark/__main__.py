@@ -0,0 +1,58 @@
+import argparse
+import json
+import sys
+
+from benchmark.runner import SCENARIOS, compare, run_benchmarks
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmark',
+        description='使用本地模拟的 OpenAI / Ollama 服务对智能写作助手进行端到端基准测试'
+    )
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"要运行的场景，逗号分隔，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument('--backend', choices=('openai', 'ollama'), default='openai',
+                        help='延迟和内存场景使用的后端协议')
+    parser.add_argument('--requests', type=int, default=30, help='每个场景的请求次数')
+    parser.add_argument('--concurrency', type=int, default=8, help='吞吐量场景的并发会话数')
+    parser.add_argument('--memory-requests', type=int, default=200, help='内存场景的请求次数')
+    parser.add_argument('--ttft', type=float, default=0.05, help='模拟服务的首字延迟（秒）')
+    parser.add_argument('--token-rate', type=float, default=200.0, help='模拟服务每秒生成的 token 数')
+    parser.add_argument('--tokens', type=int, default=50, help='每次回复的 token 数')
+    parser.add_argument('--slow-rate', type=float, default=0.1, help='对冲场景中主后端慢请求的比例')
+    parser.add_argument('--slow-factor', type=float, default=20.0, help='慢请求的首字延迟倍数')
+    parser.add_argument('--fail-rate', type=float, default=0.2, help='故障场景中返回 503 的比例')
+    parser.add_argument('--seed', type=int, default=42, help='随机数种子')
+    parser.add_argument('--output', help='结果 JSON 文件，默认输出到标准输出')
+    parser.add_argument('--compare', help='基线结果 JSON 文件，输出与基线的差异')
+    options = parser.parse_args(argv)
+    options.scenarios = [name.strip() for name in options.scenarios.split(',') if name.strip()]
+    unknown = [name for name in options.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    results = run_benchmarks(options)
+
+    if options.compare:
+        with open(options.compare, 'r', encoding='utf-8') as f:
+            results["comparison"] = compare(results, json.load(f))
+        for key, item in results["comparison"].items():
+            delta = f"{item['delta_pct']:+.1f}%" if item['delta_pct'] is not None else "n/a"
+            print(f"{key:60s} {item['baseline']:>12} -> {item['current']:>12}  {delta}", file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已写入: {options.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
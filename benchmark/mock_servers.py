@@ -0,0 +1,356 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockBehavior:
+    """
+    模拟服务的响应特性
+    延迟、生成速度和故障注入都可以在运行中修改
+    """
+
+    def __init__(self, ttft=0.05, token_rate=200.0, num_tokens=50, reply_text="这是一个用于基准测试的模拟回复。",
+                 slow_rate=0.0, slow_factor=10.0, fail_rate=0.0, fail_status=503, retry_after=None,
+                 load_latency=0.0, seed=None):
+        """
+        :param ttft: 收到请求到第一个 token 的时间（秒）
+        :param token_rate: 每秒生成的 token 数
+        :param num_tokens: 每次回复的 token 数，每个字符算一个 token
+        :param reply_text: 回复内容，循环截取到 num_tokens 个字符
+        :param slow_rate: 慢请求比例，用于模拟长尾延迟
+        :param slow_factor: 慢请求的首字延迟倍数
+        :param fail_rate: 随机返回错误状态码的比例
+        :param fail_status: 错误状态码
+        :param retry_after: 错误响应的 Retry-After（秒），为空时不返回
+        :param load_latency: Ollama 模型冷启动的加载时间（秒）
+        :param seed: 随机数种子，便于复现
+        """
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.num_tokens = num_tokens
+        self.reply_text = reply_text
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.load_latency = load_latency
+        self.fail_sequence = []
+        # 流式回复发送多少个 token 后不再发送结束标记就断开，为空时正常结束
+        self.abort_after = None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def tokens(self):
+        """本次回复的 token 列表"""
+        text = self.reply_text or "x"
+        repeated = text * (self.num_tokens // len(text) + 1)
+        return list(repeated[:self.num_tokens])
+
+    def next_fault(self):
+        """决定本次请求是否返回错误，返回状态码或 None"""
+        with self.lock:
+            if self.fail_sequence:
+                return self.fail_sequence.pop(0)
+            if self.fail_rate and self.random.random() < self.fail_rate:
+                return self.fail_status
+        return None
+
+    def first_token_delay(self):
+        """本次请求的首字延迟，按比例模拟慢请求"""
+        with self.lock:
+            slow = self.slow_rate and self.random.random() < self.slow_rate
+        return self.ttft * (self.slow_factor if slow else 1.0)
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端取消请求或关闭空闲连接时会断开，不打印异常
+        pass
+
+
+class MockServer:
+    """在后台线程中运行的本地模拟服务"""
+
+    handler_class = None
+
+    def __init__(self, behavior=None, host='127.0.0.1', port=0):
+        self.behavior = behavior or MockBehavior()
+        self.request_count = 0
+        self.stats_lock = threading.Lock()
+        self.httpd = QuietHTTPServer((host, port), self.handler_class)
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self.stats_lock:
+            self.request_count += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body or b'{}')
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_fault(self, status):
+        headers = {}
+        if self.mock.behavior.retry_after is not None:
+            headers['Retry-After'] = str(self.mock.behavior.retry_after)
+        self.send_json(status, {"error": {"message": f"injected fault {status}"}}, headers)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_HEAD(self):
+        # 预连接使用 HEAD 请求
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class OpenAIHandler(MockHandler):
+    """模拟 OpenAI 的 /v1/chat/completions，支持流式和非流式"""
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        request = self.read_json()
+        self.mock.count_request()
+        self.mock.models.append(request.get('model'))
+        behavior = self.mock.behavior
+
+        status = behavior.next_fault()
+        if status is not None:
+            self.send_fault(status)
+            return
+
+        prompt_tokens, cached_tokens = self.mock.count_prompt(request.get('messages', []))
+        tokens = behavior.tokens()[:int(request.get('max_tokens') or behavior.num_tokens)]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+        model = request.get('model', 'mock')
+        time.sleep(behavior.first_token_delay())
+        interval = 1.0 / behavior.token_rate if behavior.token_rate else 0.0
+
+        if not request.get('stream'):
+            time.sleep(interval * len(tokens))
+            self.send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ''.join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+
+        self.start_chunked('text/event-stream')
+        try:
+            for i, token in enumerate(tokens):
+                if i == behavior.abort_after:
+                    self.end_chunked()
+                    return
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                time.sleep(interval)
+            final = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if (request.get('stream_options') or {}).get('include_usage'):
+                final["usage"] = usage
+            self.write_chunk(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消或对冲请求的另一路胜出
+            pass
+
+
+class MockOpenAIServer(MockServer):
+    """
+    OpenAI 兼容接口的模拟服务
+    按与上一次请求相同的前缀长度返回 cached_tokens，用于观察提示词缓存命中率
+    """
+
+    handler_class = OpenAIHandler
+
+    def __init__(self, behavior=None, host='127.0.0.1', port=0):
+        super().__init__(behavior, host, port)
+        self.last_prompt = ''
+        self.prompt_lock = threading.Lock()
+        # 每次请求使用的模型，按到达顺序记录，用于检查降级
+        self.models = []
+
+    def count_prompt(self, messages):
+        prompt = json.dumps(messages, ensure_ascii=False)
+        with self.prompt_lock:
+            common = 0
+            for a, b in zip(prompt, self.last_prompt):
+                if a != b:
+                    break
+                common += 1
+            self.last_prompt = prompt
+        return max(1, len(prompt) // 4), common // 4
+
+
+class OllamaHandler(MockHandler):
+    """模拟 Ollama 的 /api/chat 和 /api/generate"""
+
+    def do_GET(self):
+        if self.path.startswith('/api/tags'):
+            self.send_json(200, {"models": []})
+        else:
+            self.send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        request = self.read_json()
+        self.mock.count_request()
+        if self.path.startswith('/api/generate'):
+            self.handle_generate(request)
+        elif self.path.startswith('/api/chat'):
+            self.handle_chat(request)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def handle_generate(self, request):
+        """预热和卸载只发送空提示词"""
+        model = request.get('model', 'mock')
+        load_duration = self.mock.load(model, request.get('keep_alive'))
+        self.send_json(200, {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": "",
+            "done": True,
+            "done_reason": "load" if request.get('keep_alive') != 0 else "unload",
+            "load_duration": int(load_duration * 1e9)
+        })
+
+    def handle_chat(self, request):
+        behavior = self.mock.behavior
+        status = behavior.next_fault()
+        if status is not None:
+            self.send_fault(status)
+            return
+
+        model = request.get('model', 'mock')
+        load_duration = self.mock.load(model, request.get('keep_alive'))
+        options = request.get('options') or {}
+        tokens = behavior.tokens()[:int(options.get('num_predict') or behavior.num_tokens)]
+        prompt_chars = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        time.sleep(behavior.first_token_delay())
+        interval = 1.0 / behavior.token_rate if behavior.token_rate else 0.0
+        created_at = datetime.now(timezone.utc).isoformat()
+        final = {
+            "model": model,
+            "created_at": created_at,
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": 0,
+            "load_duration": int(load_duration * 1e9),
+            "prompt_eval_count": max(1, prompt_chars // 4),
+            "eval_count": len(tokens)
+        }
+
+        if request.get('stream') is False:
+            time.sleep(interval * len(tokens))
+            final["message"]["content"] = ''.join(tokens)
+            self.send_json(200, final)
+            return
+
+        self.start_chunked('application/x-ndjson')
+        try:
+            for token in tokens:
+                chunk = {"model": model, "created_at": created_at,
+                         "message": {"role": "assistant", "content": token}, "done": False}
+                self.write_chunk((json.dumps(chunk, ensure_ascii=False) + "\n").encode('utf-8'))
+                time.sleep(interval)
+            self.write_chunk((json.dumps(final) + "\n").encode('utf-8'))
+            self.end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MockOllamaServer(MockServer):
+    """Ollama 接口的模拟服务，第一次使用某个模型时按 load_latency 模拟加载"""
+
+    handler_class = OllamaHandler
+
+    def __init__(self, behavior=None, host='127.0.0.1', port=0):
+        super().__init__(behavior, host, port)
+        self.loaded_models = set()
+        self.load_lock = threading.Lock()
+
+    def load(self, model, keep_alive=None):
+        """模拟加载或卸载模型，返回加载耗时"""
+        with self.load_lock:
+            if keep_alive == 0:
+                self.loaded_models.discard(model)
+                return 0.0
+            if model in self.loaded_models:
+                return 0.0
+            self.loaded_models.add(model)
+        time.sleep(self.behavior.load_latency)
+        return self.behavior.load_latency
@@ -0,0 +1,364 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from clipboard_manager import ClipboardManager, InMemoryClipboardBackend
+from oai_api import ChatSession as OAIChatSession
+from metrics import Histogram
+from benchmark.mock_servers import MockBehavior, MockOpenAIServer, MockOllamaServer
+
+SCENARIOS = ('latency', 'throughput', 'memory', 'hedge', 'faults')
+
+SELECTION = "请帮我把下面这句话改写得更正式一些：明天的会我可能晚点到。"
+
+
+class TimedClipboardBackend(InMemoryClipboardBackend):
+    """记录每次粘贴时间的内存剪贴板，用于计算热键到粘贴的延迟"""
+
+    def __init__(self, selection=SELECTION, copy_latency=0.0):
+        super().__init__(selection=selection, clipboard='用户原有的剪贴板内容', copy_latency=copy_latency)
+        self.paste_times = []
+
+    def paste(self):
+        self.paste_times.append(time.perf_counter())
+        super().paste()
+
+    def reset(self):
+        self.paste_times = []
+        self.document = []
+
+
+def percentiles(values):
+    """p50 / p95 / p99 以及均值，单位毫秒"""
+    if not values:
+        return {"count": 0}
+    histogram = Histogram()
+    for value in values:
+        histogram.observe(value)
+    summary = histogram.summary()
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        "p50_ms": round(summary["p50"] * 1000, 2),
+        "p95_ms": round(summary["p95"] * 1000, 2),
+        "p99_ms": round(summary["p99"] * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2)
+    }
+
+
+class BenchmarkApp:
+    """
+    以无界面方式运行的 SmartCopilot
+    写入指向模拟服务的临时配置，替换剪贴板后端，通过请求执行器模拟热键触发
+    """
+
+    def __init__(self, workdir, backend='openai', base_url=None, overrides=None, copy_latency=0.0):
+        """
+        :param workdir: 临时目录，存放配置、统计和缓存文件
+        :param backend: openai 或 ollama
+        :param base_url: 模拟服务地址
+        :param overrides: 覆盖的配置项
+        :param copy_latency: 模拟目标程序响应复制快捷键的时间（秒）
+        """
+        from main import SmartCopilot
+
+        config = {
+            "api_type": "Ollama" if backend == 'ollama' else "OpenAI",
+            "api_configs": {
+                "OpenAI": {"apikey": "sk-bench", "base_url": f"{base_url}/v1", "model": "bench-model"},
+                "OpenAI兼容": {"apikey": "", "base_url": "", "model": ""},
+                "Ollama": {"apikey": "", "base_url": base_url, "model": "bench-model"}
+            },
+            "current_role": "通用助手",
+            "keep_history": False,
+            "language": "chinese",
+            "cache_enabled": False,
+            "cache_path": os.path.join(workdir, "responses.sqlite3"),
+            "metrics_path": os.path.join(workdir, "metrics.json"),
+            "metrics_dump_interval": 3600,
+            "metrics_port": 0,
+            "ollama_idle_unload": 0
+        }
+        config.update(overrides or {})
+        self.config_file = os.path.join(workdir, f"config-{backend}-{id(self)}.json")
+        with open(self.config_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+
+        self.clipboard = TimedClipboardBackend(copy_latency=copy_latency)
+        ClipboardManager.set_backend(self.clipboard)
+        self.app = SmartCopilot(self.config_file, headless=True, bind_hotkeys=False)
+        # 基准测试连续触发，不合并请求
+        self.app.request_worker.coalesce_window = 0
+
+    def trigger(self, kind='complete', timeout=120.0):
+        """
+        模拟一次热键触发并等待请求结束
+        :return: (RequestContext, 首次粘贴延迟, 最后一次粘贴延迟)，没有粘贴时延迟为 None
+        """
+        self.clipboard.reset()
+        ctx = self.app.request_worker.submit(kind)
+        deadline = time.perf_counter() + timeout
+        while ctx.finished_at is None:
+            if time.perf_counter() > deadline:
+                ctx.cancel()
+                raise TimeoutError(f"请求超时 - 编号: {ctx.id}")
+            time.sleep(0.001)
+        if not self.clipboard.paste_times:
+            return ctx, None, None
+        return (ctx, self.clipboard.paste_times[0] - ctx.submitted_at,
+                self.clipboard.paste_times[-1] - ctx.submitted_at)
+
+    def close(self):
+        self.app.shutdown()
+
+
+def run_latency(workdir, options):
+    """热键到首次粘贴、最后一次粘贴的延迟分布，以及各阶段耗时"""
+    behavior = MockBehavior(ttft=options.ttft, token_rate=options.token_rate, num_tokens=options.tokens,
+                            seed=options.seed)
+    server_class = MockOllamaServer if options.backend == 'ollama' else MockOpenAIServer
+    with server_class(behavior) as server:
+        bench = BenchmarkApp(workdir, options.backend, server.base_url)
+        try:
+            # 第一次请求包含建立连接和模型加载，单独记录
+            _, cold_first, _ = bench.trigger()
+            first, final, errors = [], [], 0
+            for _ in range(options.requests):
+                ctx, first_paste, final_paste = bench.trigger()
+                if ctx.error is not None or first_paste is None:
+                    errors += 1
+                    continue
+                first.append(first_paste)
+                final.append(final_paste)
+            return {
+                "backend": options.backend,
+                "cold_first_paste_ms": round(cold_first * 1000, 2) if cold_first is not None else None,
+                "first_paste": percentiles(first),
+                "final_paste": percentiles(final),
+                "errors": errors,
+                "startup_ms": {name: round(seconds * 1000, 2) for name, seconds in bench.app.startup_timings.items()},
+                "stages": bench.app.metrics.snapshot()
+            }
+        finally:
+            bench.close()
+
+
+def run_throughput(workdir, options):
+    """多个独立会话并发请求时的吞吐量"""
+    behavior = MockBehavior(ttft=options.ttft, token_rate=options.token_rate, num_tokens=options.tokens,
+                            seed=options.seed)
+    with MockOpenAIServer(behavior) as server:
+        sessions = [
+            OAIChatSession(
+                api_key="sk-bench",
+                base_url=f"{server.base_url}/v1",
+                model="bench-model",
+                system_prompt={"role": "system", "content": "你是一个有用的AI助手。"},
+                keep_history=False
+            )
+            for _ in range(options.concurrency)
+        ]
+        total = options.requests * options.concurrency
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(session):
+            tokens = 0
+            for _ in range(options.requests):
+                start = time.perf_counter()
+                text = ''.join(session.stream_chat(SELECTION, max_tokens=options.tokens))
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                tokens += len(text)
+            return tokens
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+            tokens = sum(executor.map(worker, sessions))
+        elapsed = time.perf_counter() - start
+        return {
+            "concurrency": options.concurrency,
+            "requests": total,
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(total / elapsed, 2),
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "latency": percentiles(latencies)
+        }
+
+
+def run_memory(workdir, options):
+    """长会话中内存和历史记录的增长"""
+    behavior = MockBehavior(ttft=0.0, token_rate=0, num_tokens=options.tokens, seed=options.seed)
+    server_class = MockOllamaServer if options.backend == 'ollama' else MockOpenAIServer
+    with server_class(behavior) as server:
+        bench = BenchmarkApp(workdir, options.backend, server.base_url, overrides={"keep_history": True})
+        try:
+            bench.trigger()
+            tracemalloc.start()
+            baseline, _ = tracemalloc.get_traced_memory()
+            samples = []
+            step = max(1, options.memory_requests // 10)
+            for i in range(1, options.memory_requests + 1):
+                bench.trigger()
+                if i % step == 0 or i == options.memory_requests:
+                    current, peak = tracemalloc.get_traced_memory()
+                    samples.append({
+                        "requests": i,
+                        "current_kb": round((current - baseline) / 1024, 1),
+                        "peak_kb": round((peak - baseline) / 1024, 1),
+                        "history_messages": len(bench.app.chat_session.message_history)
+                    })
+            tracemalloc.stop()
+            growth = samples[-1]["current_kb"] if samples else 0.0
+            return {
+                "backend": options.backend,
+                "requests": options.memory_requests,
+                "growth_kb": growth,
+                "growth_per_request_kb": round(growth / options.memory_requests, 2),
+                "samples": samples
+            }
+        finally:
+            bench.close()
+
+
+def run_hedge(workdir, options):
+    """主后端存在慢请求时，关闭和开启对冲请求的尾延迟对比"""
+    results = {}
+    for enabled in (False, True):
+        primary = MockBehavior(ttft=options.ttft, token_rate=options.token_rate, num_tokens=options.tokens,
+                               slow_rate=options.slow_rate, slow_factor=options.slow_factor, seed=options.seed)
+        secondary = MockBehavior(ttft=options.ttft * 1.5, token_rate=options.token_rate, num_tokens=options.tokens,
+                                 seed=options.seed)
+        with MockOpenAIServer(primary) as primary_server, MockOpenAIServer(secondary) as secondary_server:
+            bench = BenchmarkApp(workdir, 'openai', primary_server.base_url, overrides={
+                "hedge_enabled": enabled,
+                "hedge_backend": "OpenAI兼容",
+                "hedge_default_delay": options.ttft * 3,
+                "hedge_min_delay": options.ttft,
+                "api_configs": {
+                    "OpenAI": {"apikey": "sk-bench", "base_url": f"{primary_server.base_url}/v1", "model": "bench-model"},
+                    "OpenAI兼容": {"apikey": "sk-bench", "base_url": f"{secondary_server.base_url}/v1",
+                                 "model": "bench-model"},
+                    "Ollama": {"apikey": "", "base_url": "", "model": ""}
+                }
+            })
+            try:
+                bench.trigger()
+                first = []
+                for _ in range(options.requests):
+                    ctx, first_paste, _ = bench.trigger()
+                    if ctx.error is None and first_paste is not None:
+                        first.append(first_paste)
+                results["enabled" if enabled else "disabled"] = {
+                    "first_paste": percentiles(first),
+                    "primary_requests": primary_server.request_count,
+                    "secondary_requests": secondary_server.request_count
+                }
+            finally:
+                bench.close()
+    return results
+
+
+def run_faults(workdir, options):
+    """后端随机返回 503 时，重试后的成功率和延迟"""
+    behavior = MockBehavior(ttft=options.ttft, token_rate=options.token_rate, num_tokens=options.tokens,
+                            fail_rate=options.fail_rate, fail_status=503, seed=options.seed)
+    with MockOpenAIServer(behavior) as server:
+        bench = BenchmarkApp(workdir, 'openai', server.base_url, overrides={
+            "retry_base_delay": 0.05,
+            "retry_max_delay": 0.5
+        })
+        try:
+            final, succeeded = [], 0
+            for _ in range(options.requests):
+                ctx, _, final_paste = bench.trigger()
+                if ctx.error is None:
+                    succeeded += 1
+                    final.append(final_paste)
+            return {
+                "fail_rate": options.fail_rate,
+                "requests": options.requests,
+                "success_rate": round(succeeded / options.requests, 3),
+                "upstream_requests": server.request_count,
+                "final_paste": percentiles(final)
+            }
+        finally:
+            bench.close()
+
+
+RUNNERS = {
+    'latency': run_latency,
+    'throughput': run_throughput,
+    'memory': run_memory,
+    'hedge': run_hedge,
+    'faults': run_faults
+}
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(options):
+    """按顺序运行选中的场景，返回结果字典"""
+    workdir = tempfile.mkdtemp(prefix='smartanychat-bench-')
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "git_commit": get_git_commit(),
+            "params": {key: value for key, value in vars(options).items() if key not in ('output', 'compare')}
+        },
+        "results": {}
+    }
+    try:
+        for name in options.scenarios:
+            print(f"运行场景: {name} ...", file=sys.stderr)
+            start = time.perf_counter()
+            results["results"][name] = RUNNERS[name](workdir, options)
+            print(f"  完成，耗时 {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    finally:
+        ClipboardManager.set_backend(None)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def flatten(value, prefix=''):
+    """把嵌套结果展开为 {路径: 数值}，用于与基线对比；列表（如各阶段耗时）不参与对比"""
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        items[prefix] = value
+    return items
+
+
+def compare(results, baseline):
+    """
+    与基线结果对比
+    :return: {路径: {baseline, current, delta_pct}}，只包含两边都有的数值项
+    """
+    current = flatten(results.get("results", {}))
+    previous = flatten(baseline.get("results", {}))
+    diff = {}
+    for key in sorted(current.keys() & previous.keys()):
+        before, after = previous[key], current[key]
+        delta_pct = round((after - before) / before * 100, 1) if before else None
+        diff[key] = {"baseline": before, "current": after, "delta_pct": delta_pct}
+    return diff
@@ -0,0 +1,148 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from history_manager import estimate_tokens, get_context_window, MESSAGE_OVERHEAD_TOKENS
+from logger_manager import LoggerManager
+
+# 句子结尾：中文和全角标点后可以紧跟引号、括号；英文句点后需要有空白，避免拆开小数和缩写
+SENTENCE_PATTERN = re.compile(
+    r'.*?(?:[。！？；!?;…]+[”’"\'」』）)\]]*|\.+[”’"\')\]]*(?=\s)|$)\s*',
+    re.S
+)
+
+# 合并各段结果时使用的提示
+DEFAULT_REDUCE_PROMPT = "以下是一篇长文分段处理后的结果，请把它们整合为一篇连贯完整的文本，去掉重复的内容，直接输出结果：\n\n"
+
+
+def split_sentences(text):
+    """按句子拆分，拼接后与原文相同"""
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+
+
+def split_hard(text, max_tokens):
+    """没有标点可用时按字符数拆分，每个字符最多算一个 token，因此每段一定放得下"""
+    step = max(1, max_tokens)
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def split_text(text, max_tokens):
+    """
+    把长文本拆成不超过 max_tokens 的若干段
+    优先在段落之间拆分，段落放不下时在句子之间拆分，句子仍放不下时按字符拆分；
+    各段拼接后与原文完全相同，段落之间的换行保留在前一段的末尾
+    :param max_tokens: 每段的 token 上限，按 estimate_tokens 估算
+    :return: 文本段列表
+    """
+    units = []
+    for paragraph in text.splitlines(keepends=True):
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in split_sentences(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+            else:
+                units.extend(split_hard(sentence, max_tokens))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(''.join(current))
+            current = []
+            current_tokens = 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def stitch_stream(chunks, outputs):
+    """
+    按原文顺序逐段产出拼接用的文本
+    每段结果去掉首尾空白后，接上原文中该段末尾的换行或空格，保持原有的段落结构
+    :param outputs: 各段的结果，可以是按顺序产出结果的迭代器
+    """
+    last = len(chunks) - 1
+    for i, (chunk, output) in enumerate(zip(chunks, outputs)):
+        separator = chunk[len(chunk.rstrip()):] if i < last else ''
+        yield (output or '').strip() + separator
+
+
+def stitch(chunks, outputs):
+    """按原文顺序拼接各段的结果"""
+    return ''.join(stitch_stream(chunks, outputs))
+
+
+def get_role_setting(config, role, key, default=None):
+    """读取分段相关的配置，角色中设置的值优先于全局配置"""
+    value = role.get(key) if role else None
+    return config.get(key, default) if value is None else value
+
+
+def get_input_budget(config, role, model, system_prompt=''):
+    """
+    单次请求最多能放下的输入 token 数
+    上下文长度减去系统提示词、角色的输出长度和消息开销
+    :param config: 配置快照
+    :param role: RoleConfig
+    :param model: 模型名称，用于确定上下文长度
+    :param system_prompt: 系统提示词
+    """
+    context_window = int(config.get('context_budget') or 0) or get_context_window(model)
+    max_output = role.max_tokens if role else config.text_complete_number
+    return context_window - estimate_tokens(system_prompt) - int(max_output) - 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def get_chunk_budget(config, role, model, system_prompt=''):
+    """每段输入的 token 上限，取 chunk_max_tokens 和上下文能放下的输入中较小的一个"""
+    limit = int(get_role_setting(config, role, 'chunk_max_tokens', 1500))
+    return max(1, min(limit, get_input_budget(config, role, model, system_prompt)))
+
+
+def should_chunk(config, role, text, model, system_prompt=''):
+    """
+    选中文本超过 chunk_threshold_tokens 或上下文放不下时分段处理
+    分段后的每段都不超过 chunk_max_tokens，因此阈值应大于它
+    """
+    if not get_role_setting(config, role, 'chunk_enabled', True):
+        return False
+    threshold = int(get_role_setting(config, role, 'chunk_threshold_tokens', 3000))
+    return estimate_tokens(text) > min(threshold, get_input_budget(config, role, model, system_prompt))
+
+
+class ChunkedRunner:
+    """
+    分段处理长文本
+    各段在有限的并发下同时请求，结果按原文顺序依次产出，前面的段完成后即可开始输出，
+    总耗时随并发数而不是文本长度增长
+    """
+
+    def __init__(self, complete, concurrency=4):
+        """
+        :param complete: 处理一段文本的函数，接收 (text, cancel_token)，返回完整结果
+        :param concurrency: 同时进行的请求数
+        """
+        self.complete = complete
+        self.concurrency = max(1, int(concurrency))
+        self.logger = LoggerManager.get_logger()
+
+    def map(self, chunks, cancel_token=None):
+        """
+        并发处理各段，按原文顺序逐段产出结果
+        某一段失败时抛出异常，已发出的其他段继续执行到结束；取消令牌被所有段共用，取消时一起中断
+        """
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks)) or 1, thread_name_prefix="Chunk")
+        try:
+            futures = [executor.submit(self.complete, chunk, cancel_token) for chunk in chunks]
+            for i, future in enumerate(futures):
+                output = future.result()
+                self.logger.info(f"分段完成 - {i + 1}/{len(chunks)}, 耗时: {time.perf_counter() - start:.2f}s")
+                yield output
+        finally:
+            # 中途失败或取消时不再启动排队中的段
+            executor.shutdown(wait=False, cancel_futures=True)
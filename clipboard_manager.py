@@ -1,77 +1,456 @@
-import win32clipboard
+try:
+    import win32clipboard
+    import win32api
+    import win32con
+    import win32gui
+    import win32process
+except ImportError:  # 非 Windows 环境下只能使用内存剪贴板后端
+    win32clipboard = None
+import os
+import threading
 import keyboard
 import time
 from logger_manager import LoggerManager
 
-class ClipboardManager:
-    @staticmethod
-    def get_selected_text():
-        """获取选中的文本"""
-        logger = LoggerManager.get_logger()
-        
-        # 保存当前剪贴板内容
+
+class Win32ClipboardBackend:
+    """基于 win32clipboard 和 keyboard 的系统剪贴板后端"""
+
+    def get_text(self):
+        """读取剪贴板中的文本"""
+        win32clipboard.OpenClipboard()
         try:
-            win32clipboard.OpenClipboard()
             try:
-                old_clipboard = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
+                return win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
             except:
-                old_clipboard = ''
+                return ''
+        finally:
             win32clipboard.CloseClipboard()
-        except Exception as e:
-            logger.error(f"保存剪贴板内容失败: {e}")
-            return ''
 
-        # 等待热键释放
-        while keyboard.is_pressed('alt') or keyboard.is_pressed('\\') or keyboard.is_pressed('ctrl'):
-            time.sleep(0.1)
+    def set_text(self, text):
+        """写入文本到剪贴板"""
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardText(text, win32clipboard.CF_UNICODETEXT)
+        finally:
+            win32clipboard.CloseClipboard()
 
-        # 清空剪贴板
+    def clear(self):
+        """清空剪贴板"""
+        win32clipboard.OpenClipboard()
         try:
-            win32clipboard.OpenClipboard()
             win32clipboard.EmptyClipboard()
+        finally:
             win32clipboard.CloseClipboard()
+
+    def copy(self):
+        """向当前窗口发送复制快捷键"""
+        keyboard.press_and_release('ctrl+c')
+
+    def paste(self):
+        """向当前窗口发送粘贴快捷键"""
+        keyboard.press_and_release('ctrl+v')
+
+    def is_pressed(self, key):
+        """判断按键是否处于按下状态"""
+        return keyboard.is_pressed(key)
+
+    def get_sequence_number(self):
+        """获取剪贴板序列号，剪贴板内容每次变化都会递增"""
+        return win32clipboard.GetClipboardSequenceNumber()
+
+    def wait_keys_released(self, keys, timeout):
+        """
+        等待按键全部释放，通过键盘钩子的释放事件唤醒而不是固定间隔轮询
+        :return: 超时前是否已全部释放
+        """
+        if not any(keyboard.is_pressed(key) for key in keys):
+            return True
+
+        released = threading.Event()
+
+        def on_key_event(event):
+            if event.event_type == keyboard.KEY_UP and not any(keyboard.is_pressed(key) for key in keys):
+                released.set()
+
+        hook = keyboard.hook(on_key_event)
+        try:
+            # 注册钩子前可能已经释放
+            if not any(keyboard.is_pressed(key) for key in keys):
+                return True
+            return released.wait(timeout)
+        finally:
+            keyboard.unhook(hook)
+
+    def get_foreground_app(self):
+        """获取前台窗口所属程序的名称"""
+        try:
+            hwnd = win32gui.GetForegroundWindow()
+            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            handle = win32api.OpenProcess(
+                win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, pid
+            )
+            try:
+                return os.path.basename(win32process.GetModuleFileNameEx(handle, 0)).lower()
+            finally:
+                win32api.CloseHandle(handle)
+        except Exception:
+            return 'unknown'
+
+    def get_foreground_window(self):
+        """获取前台窗口句柄，供弹出窗口关闭后切换回原窗口"""
+        try:
+            return win32gui.GetForegroundWindow()
+        except Exception:
+            return None
+
+    def activate_window(self, handle):
+        """把窗口切换到前台"""
+        if not handle:
+            return
+        try:
+            win32gui.SetForegroundWindow(handle)
         except Exception as e:
-            logger.error(f"清空剪贴板失败: {e}")
+            LoggerManager.get_logger().warning(f"切换前台窗口失败: {e}")
+
+
+class InMemoryClipboardBackend:
+    """内存剪贴板和键盘，用于在没有 Windows 剪贴板的环境下测试和基准测试"""
+
+    def __init__(self, selection='', clipboard='', copy_latency=0.0, app_name='fake.exe'):
+        """
+        :param selection: 模拟目标窗口中选中的文本
+        :param clipboard: 剪贴板初始内容
+        :param copy_latency: 模拟目标程序响应复制快捷键所需的时间（秒）
+        :param app_name: 模拟的前台程序名称
+        """
+        self.selection = selection
+        self.clipboard = clipboard
+        self.copy_latency = copy_latency
+        self.app_name = app_name
+        self.document = []
+        self.copy_count = 0
+        self.paste_count = 0
+        self.pressed_keys = set()
+        self.sequence_number = 0
+        self.pending_copy_at = None
+
+    def _apply_pending_copy(self):
+        """模拟目标程序在延迟之后才写入剪贴板"""
+        if self.pending_copy_at is not None and time.perf_counter() >= self.pending_copy_at:
+            self.pending_copy_at = None
+            self.clipboard = self.selection
+            self.sequence_number += 1
+
+    def get_text(self):
+        self._apply_pending_copy()
+        return self.clipboard
+
+    def set_text(self, text):
+        self.clipboard = text
+        self.sequence_number += 1
+
+    def clear(self):
+        self.clipboard = ''
+        self.sequence_number += 1
+
+    def copy(self):
+        self.copy_count += 1
+        if not self.selection:
+            return
+        self.pending_copy_at = time.perf_counter() + self.copy_latency
+        self._apply_pending_copy()
+
+    def paste(self):
+        self.paste_count += 1
+        self.document.append(self.clipboard)
+
+    def is_pressed(self, key):
+        return key in self.pressed_keys
+
+    def get_sequence_number(self):
+        self._apply_pending_copy()
+        return self.sequence_number
+
+    def wait_keys_released(self, keys, timeout):
+        return not any(key in self.pressed_keys for key in keys)
+
+    def get_foreground_app(self):
+        return self.app_name
+
+    def get_foreground_window(self):
+        return None
+
+    def activate_window(self, handle):
+        pass
+
+    @property
+    def document_text(self):
+        """目标窗口中已粘贴的全部文本"""
+        return ''.join(self.document)
+
+
+class CaptureTimeoutEstimator:
+    """
+    按前台程序学习复制选中文本所需的等待时间
+    记录每个程序响应复制快捷键的耗时，超时时间取平滑均值的倍数并限制在上下限之间
+    """
+
+    def __init__(self, default_timeout=0.8, min_timeout=0.1, max_timeout=2.0, factor=3.0, alpha=0.3):
+        """
+        :param default_timeout: 未知程序的初始超时时间（秒）
+        :param min_timeout: 超时时间下限
+        :param max_timeout: 超时时间上限
+        :param factor: 超时时间相对平滑耗时的倍数
+        :param alpha: 指数平滑系数
+        """
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        self.alpha = alpha
+        self.latencies = {}
+        self.timeouts = {}
+        self.lock = threading.Lock()
+
+    def get_timeout(self, app):
+        """获取指定程序的复制超时时间"""
+        with self.lock:
+            return self.timeouts.get(app, self.default_timeout)
+
+    def record(self, app, latency):
+        """记录一次成功复制的耗时"""
+        with self.lock:
+            previous = self.latencies.get(app)
+            smoothed = latency if previous is None else self.alpha * latency + (1 - self.alpha) * previous
+            self.latencies[app] = smoothed
+            timeout = max(smoothed * self.factor, latency * 1.5)
+            self.timeouts[app] = min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def record_timeout(self, app):
+        """记录一次等待超时，适当放宽该程序的超时时间"""
+        with self.lock:
+            timeout = self.timeouts.get(app, self.default_timeout) * 1.5
+            self.timeouts[app] = min(self.max_timeout, timeout)
+
+
+class StreamPasteSink:
+    """
+    流式回复的增量粘贴输出
+    缓冲到达的文本块，达到字数或时间阈值时批量粘贴到光标位置，
+    整个回复只保存和恢复一次用户剪贴板；第一个文本块立即粘贴，
+    缓冲中剩余的文本由定时器在 flush_interval 后粘贴，不必等下一个文本块到达
+    """
+
+    def __init__(self, backend=None, flush_chars=80, flush_interval=0.3, settle_delay=0.05):
+        """
+        :param backend: 剪贴板后端，默认使用 ClipboardManager 当前后端
+        :param flush_chars: 缓冲达到多少字符时粘贴
+        :param flush_interval: 距上次粘贴超过多少秒时粘贴
+        :param settle_delay: 每次写剪贴板或粘贴后等待目标程序处理的时间
+        """
+        self.backend = backend or ClipboardManager.get_backend()
+        self.flush_chars = flush_chars
+        self.flush_interval = flush_interval
+        self.settle_delay = settle_delay
+        self.logger = LoggerManager.get_logger()
+        self.buffer = []
+        self.buffer_size = 0
+        self.parts = []
+        self.old_clipboard = None
+        self.opened = False
+        self.last_flush = 0.0
+        self.paste_time = 0.0
+        self.paste_count = 0
+        self.timer = None
+        # 定时器线程和写入线程都会粘贴，粘贴过程需要互斥
+        self.lock = threading.RLock()
+
+    def open(self):
+        """保存用户剪贴板，开始接收文本块"""
+        try:
+            self.old_clipboard = self.backend.get_text()
+        except Exception as e:
+            self.logger.error(f"保存剪贴板内容失败: {e}")
+            self.old_clipboard = ''
+        self.opened = True
+        self.last_flush = time.perf_counter()
+
+    def write(self, chunk):
+        """写入一个文本块，满足阈值时粘贴"""
+        if not chunk:
+            return
+        if not self.opened:
+            self.open()
+        with self.lock:
+            self.buffer.append(chunk)
+            self.buffer_size += len(chunk)
+            self.parts.append(chunk)
+            elapsed = time.perf_counter() - self.last_flush
+            if self.paste_count == 0 or self.buffer_size >= self.flush_chars or elapsed >= self.flush_interval:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval - elapsed, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def cancel_timer(self):
+        """取消尚未触发的定时粘贴"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def flush(self):
+        """把缓冲的文本粘贴到光标位置"""
+        with self.lock:
+            self.cancel_timer()
+            if self.buffer:
+                self.paste_buffer()
+
+    def paste_buffer(self):
+        """粘贴缓冲区中的文本，调用方需持有锁"""
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        start = time.perf_counter()
+        try:
+            self.backend.set_text(text)
+            time.sleep(self.settle_delay)
+            self.backend.paste()
+            time.sleep(self.settle_delay)
+        except Exception as e:
+            self.logger.error(f"粘贴文本失败: {e}")
+        self.last_flush = time.perf_counter()
+        self.paste_time += self.last_flush - start
+        self.paste_count += 1
+
+    def close(self):
+        """粘贴剩余文本并恢复用户剪贴板"""
+        if not self.opened:
+            return
+        with self.lock:
+            self.flush()
+            self.opened = False
+        if self.old_clipboard:
+            try:
+                self.backend.set_text(self.old_clipboard)
+            except Exception as e:
+                self.logger.error(f"恢复剪贴板内容失败: {e}")
+
+    @property
+    def text(self):
+        """已接收的全部文本"""
+        return ''.join(self.parts)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class ClipboardManager:
+    backend = None
+    capture_estimator = CaptureTimeoutEstimator()
+
+    @classmethod
+    def get_backend(cls):
+        """获取当前剪贴板后端"""
+        if cls.backend is None:
+            cls.backend = Win32ClipboardBackend()
+        return cls.backend
+
+    @classmethod
+    def set_backend(cls, backend):
+        """替换剪贴板后端，例如使用 InMemoryClipboardBackend 进行测试"""
+        cls.backend = backend
+
+    @staticmethod
+    def get_selected_text(hotkeys=('ctrl', 'alt', '\\'), release_timeout=1.0, timings=None):
+        """
+        获取选中的文本
+        等待热键释放后发送复制快捷键，通过剪贴板序列号检测复制完成，
+        等待时间按前台程序自适应，不再使用固定延时
+        :param hotkeys: 触发本次捕获的热键，复制前需等待其释放
+        :param release_timeout: 等待热键释放的最长时间（秒）
+        :param timings: 可选的字典，写入 release_wait 和 capture 两个阶段的耗时
+        """
+        logger = LoggerManager.get_logger()
+        backend = ClipboardManager.get_backend()
+        estimator = ClipboardManager.capture_estimator
+
+        # 保存当前剪贴板内容
+        try:
+            old_clipboard = backend.get_text()
+            old_sequence = backend.get_sequence_number()
+        except Exception as e:
+            logger.error(f"保存剪贴板内容失败: {e}")
             return ''
 
-        # 复制选中文本
-        time.sleep(0.3)
-        keyboard.press_and_release('ctrl+c')
-        time.sleep(0.5)
+        # 等待热键释放
+        release_start = time.perf_counter()
+        if not backend.wait_keys_released(hotkeys, release_timeout):
+            logger.warning("等待热键释放超时")
+        if timings is not None:
+            timings['release_wait'] = time.perf_counter() - release_start
 
-        # 获取选中的文本
-        max_attempts = 3
-        selected_text = ''
-        for _ in range(max_attempts):
+        # 复制选中文本，等待剪贴板序列号变化
+        app = backend.get_foreground_app()
+        timeout = estimator.get_timeout(app)
+        start_time = time.perf_counter()
+        deadline = start_time + timeout
+        backend.copy()
+
+        changed = False
+        while True:
             try:
-                win32clipboard.OpenClipboard()
-                try:
-                    selected_text = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
-                except Exception as e:
-                    logger.error(f"获取剪贴板数据失败: {e}")
-                    selected_text = ''
-                win32clipboard.CloseClipboard()
-                if selected_text and selected_text.strip():
+                if backend.get_sequence_number() != old_sequence:
+                    changed = True
                     break
             except Exception as e:
-                logger.error(f"访问剪贴板失败: {e}")
-                selected_text = ''
-            time.sleep(0.1)
+                logger.error(f"读取剪贴板序列号失败: {e}")
+            if time.perf_counter() >= deadline:
+                break
+            time.sleep(0.005)
+
+        if timings is not None:
+            timings['capture'] = time.perf_counter() - start_time
+
+        if not changed:
+            estimator.record_timeout(app)
+            logger.warning(f"未检测到复制内容 - 应用: {app}, 等待: {timeout:.3f}s")
+            return ''
+
+        # 获取选中的文本，剪贴板可能仍被目标程序占用，在截止时间内重试
+        selected_text = ''
+        while True:
+            try:
+                selected_text = backend.get_text()
+                break
+            except Exception as e:
+                if time.perf_counter() >= deadline:
+                    logger.error(f"访问剪贴板失败: {e}")
+                    break
+            time.sleep(0.005)
+
+        latency = time.perf_counter() - start_time
+        estimator.record(app, latency)
+        logger.info(f"捕获选中文本 - 应用: {app}, 耗时: {latency:.3f}s, 下次超时: {estimator.get_timeout(app):.3f}s")
 
         # 恢复原始剪贴板内容
         if old_clipboard:
             try:
-                win32clipboard.OpenClipboard()
-                win32clipboard.EmptyClipboard()
-                win32clipboard.SetClipboardText(old_clipboard, win32clipboard.CF_UNICODETEXT)
-                win32clipboard.CloseClipboard()
+                backend.set_text(old_clipboard)
             except Exception as e:
                 logger.error(f"恢复剪贴板内容失败: {e}")
 
         # 确保返回的是有效的 Unicode 字符串
         if not selected_text:
             return ''
-            
+
         try:
             # 尝试编码和解码来清理文本
             cleaned_text = selected_text.encode('utf-8', errors='ignore').decode('utf-8')
@@ -83,24 +462,19 @@ class ClipboardManager:
     @staticmethod
     def write_text(text):
         """写入文本到当前光标位置"""
+        logger = LoggerManager.get_logger()
+        backend = ClipboardManager.get_backend()
+
         # 保存当前剪贴板内容
         try:
-            win32clipboard.OpenClipboard()
-            try:
-                old_clipboard = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
-            except:
-                old_clipboard = ''
-            win32clipboard.CloseClipboard()
+            old_clipboard = backend.get_text()
         except Exception as e:
             logger.error(f"保存剪贴板内容失败: {e}")
             return ''
 
         # 将新文本写入剪贴板
         try:
-            win32clipboard.OpenClipboard()
-            win32clipboard.EmptyClipboard()
-            win32clipboard.SetClipboardText(text, win32clipboard.CF_UNICODETEXT)
-            win32clipboard.CloseClipboard()
+            backend.set_text(text)
         except Exception as e:
             logger.error(f"写入剪贴板失败: {e}")
             return ''
@@ -109,7 +483,7 @@ class ClipboardManager:
         time.sleep(0.2)
 
         # 粘贴文本
-        keyboard.press_and_release('ctrl+v')
+        backend.paste()
 
         # 等待粘贴完成
         time.sleep(0.2)
@@ -117,9 +491,26 @@ class ClipboardManager:
         # 恢复原始剪贴板内容
         if old_clipboard:
             try:
-                win32clipboard.OpenClipboard()
-                win32clipboard.EmptyClipboard()
-                win32clipboard.SetClipboardText(old_clipboard, win32clipboard.CF_UNICODETEXT)
-                win32clipboard.CloseClipboard()
+                backend.set_text(old_clipboard)
             except Exception as e:
                 logger.error(f"恢复剪贴板内容失败: {e}")
+
+    @staticmethod
+    def write_stream(chunks, flush_chars=80, flush_interval=0.3, timings=None):
+        """
+        边接收边粘贴流式回复
+        :param chunks: 文本块迭代器
+        :param flush_chars: 缓冲达到多少字符时粘贴
+        :param flush_interval: 距上次粘贴超过多少秒时粘贴
+        :param timings: 可选的字典，写入 paste 阶段的累计耗时
+        :return: 完整的回复文本
+        """
+        sink = StreamPasteSink(flush_chars=flush_chars, flush_interval=flush_interval)
+        try:
+            with sink:
+                for chunk in chunks:
+                    sink.write(chunk)
+        finally:
+            if timings is not None:
+                timings['paste'] = timings.get('paste', 0.0) + sink.paste_time
+        return sink.text
@@ -1,10 +1,136 @@
+import atexit
 import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+
+def freeze(value):
+    """把配置转换为只读结构：dict 转为 MappingProxyType，list 转为 tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """把只读结构还原为可修改的 dict / list"""
+    if isinstance(value, MappingProxyType):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+@dataclass(frozen=True)
+class RoleConfig:
+    """角色配置，temperature 和 max_tokens 已按角色、全局配置的顺序解析"""
+    name: str
+    description: str
+    input_prompt: str
+    output_prompt: str
+    temperature: float
+    max_tokens: int
+    data: MappingProxyType
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """配置文件的只读快照，包含解析后的常用字段和按名称索引的角色"""
+    data: MappingProxyType
+    api_type: str
+    apikey: str
+    base_url: str
+    model: str
+    text_complete_number: int
+    temperature: float
+    keep_history: bool
+    language: str
+    current_role: str
+    roles: tuple
+    role_index: MappingProxyType
+
+    @classmethod
+    def from_dict(cls, config, default_config):
+        """从配置字典构建快照"""
+        api_type = config.get('api_type', 'OpenAI')
+        api_configs = config.get('api_configs', default_config['api_configs'])
+        api_config = api_configs.get(api_type, {})
+        text_complete_number = int(config.get('text_complete_number', 150))
+        temperature = float(config.get('temperature', 0.7))
+
+        roles = []
+        for role in config.get('roles', default_config['roles']):
+            max_tokens = role.get('text_complete_number', role.get('max_tokens', text_complete_number))
+            roles.append(RoleConfig(
+                name=role['name'],
+                description=role.get('description', ''),
+                input_prompt=role.get('input_prompt', ''),
+                output_prompt=role.get('output_prompt', ''),
+                temperature=float(role.get('temperature', temperature)),
+                max_tokens=int(max_tokens),
+                data=freeze(role)
+            ))
+
+        return cls(
+            data=freeze(config),
+            api_type=api_type,
+            apikey=api_config.get('apikey', config.get('apikey', '')),
+            base_url=api_config.get('base_url', config.get('base_url', '')),
+            model=api_config.get('model', config.get('model', '')),
+            text_complete_number=text_complete_number,
+            temperature=temperature,
+            keep_history=config.get('keep_history', True),
+            language=config.get('language', 'chinese'),
+            current_role=config.get('current_role', '通用助手'),
+            roles=tuple(roles),
+            role_index=MappingProxyType({role.name: role for role in roles})
+        )
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def get_role(self, name=None):
+        """按名称获取角色配置，默认返回当前角色"""
+        return self.role_index.get(name or self.current_role)
+
+    @property
+    def current_role_config(self):
+        return self.role_index.get(self.current_role)
+
+    def to_dict(self):
+        """转换为可修改的配置字典"""
+        return thaw(self.data)
+
 
 class ConfigManager:
-    def __init__(self):
-        """初始化配置管理器"""
-        self.config_file = 'config.json'
+    def __init__(self, config_file='config.json', check_interval=1.0, flush_delay=0.5, max_flush_delay=2.0):
+        """
+        初始化配置管理器
+        :param config_file: 配置文件路径
+        :param check_interval: 检查配置文件是否被外部修改的最小间隔（秒）
+        :param flush_delay: 最后一次修改后延迟多久写入文件（秒）
+        :param max_flush_delay: 连续修改时最多延迟多久写入文件（秒）
+        """
+        self.config_file = config_file
+        self.check_interval = check_interval
+        self.flush_delay = flush_delay
+        self.max_flush_delay = max_flush_delay
         self._language = 'chinese'  # 添加私有变量
+        self._snapshot = None
+        self._file_signature = None
+        self._last_check = 0.0
+        self._lock = threading.RLock()
+        self._dirty_since = None
+        self._flush_timer = None
+        atexit.register(self.flush)
         
         # 默认配置
         self.default_config = {
@@ -14,8 +140,54 @@ class ConfigManager:
             "text_complete_number": 150,
             "temperature": 0.7,
             "keep_history": True,
+            "context_budget": 0,
             "api_type": "OpenAI",
             "language": "chinese",
+            "http2": False,
+            "proxy": "",
+            "cache_enabled": True,
+            "cache_temperature_threshold": 0.0,
+            "cache_max_entries": 256,
+            "cache_path": "cache/responses.sqlite3",
+            "ollama_keep_alive": "30m",
+            "ollama_idle_unload": 1800,
+            "connect_timeout": 5,
+            "read_timeout": 30,
+            "retry_max_attempts": 3,
+            "retry_base_delay": 0.5,
+            "retry_max_delay": 8.0,
+            "breaker_failure_threshold": 5,
+            "breaker_recovery_time": 30,
+            "fallback_model": "",
+            "metrics_enabled": True,
+            "metrics_path": "logs/metrics.json",
+            "metrics_dump_interval": 60,
+            "metrics_port": 0,
+            "hedge_enabled": False,
+            "hedge_backend": "",
+            "hedge_percentile": 0.95,
+            "hedge_default_delay": 1.5,
+            "hedge_min_delay": 0.3,
+            "hedge_max_delay": 5.0,
+            "log_level": "INFO",
+            "log_max_bytes": 5242880,
+            "log_backup_count": 14,
+            "log_payload_sample_rate": 1.0,
+            "log_payload_max_chars": 200,
+            "settings_hotkey": "ctrl+alt+s",
+            "show_settings_on_start": False,
+            "ipc_enabled": False,
+            "ipc_host": "127.0.0.1",
+            "ipc_port": 8765,
+            "ipc_token": "",
+            "fanout_hotkey": "ctrl+alt+m",
+            "fanout_roles": [],
+            "chunk_enabled": True,
+            "chunk_threshold_tokens": 3000,
+            "chunk_max_tokens": 1500,
+            "chunk_concurrency": 4,
+            "chunk_reduce": False,
+            "chunk_reduce_prompt": "",
             "roles": [
                 {
                     "name": "通用助手",
@@ -68,35 +240,67 @@ class ConfigManager:
     def load_config(self):
         """加载配置"""
         try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                
-                # 加载基本配置
-                self.api_type_value = config.get('api_type', 'OpenAI')
-                
-                # 从对应的 API 配置中加载详细设置
-                api_configs = config.get('api_configs', self.default_config['api_configs'])
-                api_config = api_configs.get(self.api_type_value, {})
-                
-                self.apikey = api_config.get('apikey', config.get('apikey', ''))
-                self.base_url = api_config.get('base_url', config.get('base_url', ''))
-                self.model = api_config.get('model', config.get('model', ''))
-                
-                # 加载其他配置
-                self.text_complete_number = config.get('text_complete_number', 150)
-                self.temperature = float(config.get('temperature', 0.7))
-                self.keep_history = config.get('keep_history', True)
-                self._language = config.get('language', 'chinese')
-                self.roles = config.get('roles', self.default_config['roles'])
-                self.current_role = config.get('current_role', '通用助手')
+            with self._lock:
+                signature = self._get_file_signature()
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                self._apply_snapshot(ConfigSnapshot.from_dict(config, self.default_config), signature)
                 
         except FileNotFoundError:
             # 如果配置文件不存在，使用默认配置
-            self.save_config(self.default_config)
+            self.save_config(self.default_config, immediate=True)
         except Exception as e:
             print(f"加载配置文件失败: {e}")
             # 使用默认配置
             self.__dict__.update(self.default_config)
+            if self._snapshot is None:
+                self._apply_snapshot(ConfigSnapshot.from_dict(self.default_config, self.default_config), None)
+
+    def _get_file_signature(self):
+        """配置文件的修改时间和大小，用于判断是否需要重新加载"""
+        stat = os.stat(self.config_file)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _apply_snapshot(self, snapshot, signature):
+        """更新快照和兼容旧接口的属性"""
+        self._snapshot = snapshot
+        self._file_signature = signature
+        self._last_check = time.monotonic()
+
+        # 加载基本配置
+        self.api_type_value = snapshot.api_type
+        self.apikey = snapshot.apikey
+        self.base_url = snapshot.base_url
+        self.model = snapshot.model
+        
+        # 加载其他配置
+        self.text_complete_number = snapshot.text_complete_number
+        self.temperature = snapshot.temperature
+        self.keep_history = snapshot.keep_history
+        self._language = snapshot.language
+        self.roles = thaw(snapshot.data.get('roles', freeze(self.default_config['roles'])))
+        self.current_role = snapshot.current_role
+
+    def get_snapshot(self):
+        """
+        获取配置快照
+        快照常驻内存，最多每 check_interval 秒检查一次文件修改时间和大小，变化时才重新加载
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._last_check < self.check_interval:
+                return self._snapshot
+            # 尚未写入文件的修改比文件更新
+            if self._dirty_since is not None:
+                return self._snapshot
+            self._last_check = now
+            try:
+                signature = self._get_file_signature()
+            except OSError:
+                signature = None
+            if self._snapshot is None or signature != self._file_signature:
+                self.load_config()
+            return self._snapshot
 
     def set_default_config(self):
         """设置默认配置"""
@@ -175,46 +379,92 @@ class ConfigManager:
                 return True
         return False
 
-    def save_config(self, config):
-        """保存配置到文件"""
+    def save_config(self, config, immediate=False):
+        """
+        保存配置
+        立即更新内存快照，文件写入合并到一次延迟写入中，连续修改只写一次文件
+        :param config: 配置字典，只包含部分配置项时其余项保持不变
+        :param immediate: 是否立即写入文件
+        """
         try:
-            # 确保 api_configs 存在
-            if 'api_configs' not in config:
-                current_config = self.get_config()
-                config['api_configs'] = current_config.get('api_configs', self.default_config['api_configs'])
-            
-            # 更新当前 API 类型的配置
-            api_type = config['api_type']
-            config['api_configs'][api_type] = {
-                'apikey': config['apikey'],
-                'base_url': config['base_url'],
-                'model': config['model']
-            }
-            
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            with self._lock:
+                # 合并到当前配置，设置窗口只提交它管理的配置项，不能丢掉其他配置
+                if self._snapshot is not None:
+                    config = dict(self._snapshot.to_dict(), **config)
+                
+                # 确保 api_configs 存在
+                if 'api_configs' not in config:
+                    current_config = self.get_config()
+                    config['api_configs'] = current_config.get('api_configs', self.default_config['api_configs'])
                 
-            # 更新内部状态
-            self.load_config()
+                # 更新当前 API 类型的配置
+                api_type = config['api_type']
+                config['api_configs'][api_type] = {
+                    'apikey': config['apikey'],
+                    'base_url': config['base_url'],
+                    'model': config['model']
+                }
+                
+                # 更新内部状态，不再从文件读回
+                self._apply_snapshot(ConfigSnapshot.from_dict(config, self.default_config), self._file_signature)
+                
+                now = time.monotonic()
+                if self._dirty_since is None:
+                    self._dirty_since = now
+                if immediate or now - self._dirty_since >= self.max_flush_delay:
+                    self.flush()
+                else:
+                    self._schedule_flush()
             
         except Exception as e:
             print(f"保存配置文件失败: {e}")
             raise
 
+    def _schedule_flush(self):
+        """重新计时，在最后一次修改 flush_delay 秒后写入文件"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def flush(self):
+        """把内存中的配置原子地写入文件（先写临时文件再替换）"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._dirty_since is None:
+                return
+
+            config_dir = os.path.dirname(os.path.abspath(self.config_file))
+            fd, temp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=config_dir)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._snapshot.to_dict(), f, indent=4, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.config_file)
+            except Exception as e:
+                print(f"写入配置文件失败: {e}")
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                return
+
+            self._dirty_since = None
+            self._file_signature = self._get_file_signature()
+            self._last_check = time.monotonic()
+
     def get_config(self):
-        """获取当前配置"""
-        try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"读取配置文件失败: {e}")
-            return dict(self.default_config)
+        """获取当前配置（可修改的副本）"""
+        return self.get_snapshot().to_dict()
 
     def get_api_config(self, api_type):
         """获取指定API类型的配置"""
-        config = self.get_config()
-        api_configs = config.get('api_configs', self.default_config['api_configs'])
-        return api_configs.get(api_type, {})
+        api_configs = self.get_snapshot().get('api_configs', self.default_config['api_configs'])
+        return thaw(api_configs.get(api_type, {}))
 
     def save_api_config(self, api_type, apikey, base_url, model):
         """保存指定API类型的配置"""
@@ -0,0 +1,92 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logger_manager import LoggerManager
+from request_worker import RequestCancelled
+
+
+class FanOutResult:
+    """一个角色的回复"""
+
+    def __init__(self, index, role_name, model=None):
+        """
+        :param index: 角色在本次请求中的序号
+        :param role_name: 角色名称
+        :param model: 使用的模型
+        """
+        self.index = index
+        self.role_name = role_name
+        self.model = model
+        self.text = None
+        self.error = None
+        self.elapsed = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.text is not None
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "role": self.role_name,
+            "model": self.model,
+            "text": self.text,
+            "error": None if self.error is None else str(self.error),
+            "elapsed": None if self.elapsed is None else round(self.elapsed, 3)
+        }
+
+
+class FanOut:
+    """
+    多角色并发请求
+    把同一段文本同时发给多个角色，每个角色使用自己的会话和参数，
+    总耗时取决于最慢的角色而不是各角色耗时之和；每个角色完成时立即回调
+    """
+
+    def __init__(self, sessions, complete):
+        """
+        :param sessions: RoleSession 列表
+        :param complete: 发送请求的函数，接收 (text, session, cancel_token)，返回完整回复
+        """
+        self.sessions = list(sessions)
+        self.complete = complete
+        self.logger = LoggerManager.get_logger()
+
+    def run(self, text, on_result=None, cancel_token=None):
+        """
+        并发请求所有角色，等待全部完成
+        取消令牌被所有角色共用，取消时所有未完成的请求一起中断
+        :param on_result: 每个角色完成时的回调，接收 FanOutResult，在调用 run 的线程中按完成顺序调用
+        :return: 按角色顺序排列的 FanOutResult 列表
+        """
+        results = [FanOutResult(i, session.role_name, session.model) for i, session in enumerate(self.sessions)]
+        if not self.sessions:
+            return results
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.sessions), thread_name_prefix="FanOut") as executor:
+            futures = {
+                executor.submit(self._run_one, result, session, text, cancel_token, start): result
+                for result, session in zip(results, self.sessions)
+            }
+            for future in as_completed(futures):
+                result = futures[future]
+                if on_result is not None:
+                    try:
+                        on_result(result)
+                    except Exception as e:
+                        self.logger.error(f"多角色结果回调失败: {e}")
+        succeeded = sum(1 for result in results if result.ok)
+        self.logger.info(
+            f"多角色请求完成 - 成功: {succeeded}/{len(results)}, 总耗时: {time.perf_counter() - start:.2f}s, " +
+            ", ".join(f"{result.role_name}: {result.elapsed:.2f}s" for result in results)
+        )
+        return results
+
+    def _run_one(self, result, session, text, cancel_token, start):
+        try:
+            result.text = self.complete(text, session, cancel_token)
+        except RequestCancelled:
+            result.error = "cancelled"
+        except Exception as e:
+            result.error = e
+            self.logger.error(f"多角色请求失败 - 角色: {result.role_name}, {e}")
+        result.elapsed = time.perf_counter() - start
@@ -0,0 +1,218 @@
+import queue
+import threading
+import time
+from collections import deque
+from logger_manager import LoggerManager
+from request_worker import CancelToken, RequestCancelled
+
+
+class LatencyTracker:
+    """记录某个后端最近若干次请求的首字延迟，用于计算对冲等待时间"""
+
+    def __init__(self, max_samples=200):
+        self.samples = deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        """
+        获取首字延迟的分位数
+        :param p: 分位，0 到 1 之间
+        :return: 延迟（秒），没有样本时返回 None
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(p * len(samples)))
+        return samples[index]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(base_url, model):
+    """获取后端的首字延迟记录，按地址和模型区分"""
+    key = (base_url, model)
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            tracker = LatencyTracker()
+            _trackers[key] = tracker
+        return tracker
+
+
+class HedgeLeg:
+    """对冲请求中的一路，在独立线程中读取流式回复，并把数据块放入共享的事件队列"""
+
+    def __init__(self, name, stream_factory, tracker=None, events=None):
+        """
+        :param name: 后端名称，用于日志
+        :param stream_factory: 接收 CancelToken、返回回复数据块迭代器的函数
+        :param tracker: 该后端的首字延迟记录
+        :param events: 共享的事件队列，放入 (leg, 类型, 内容)
+        """
+        self.name = name
+        self.stream_factory = stream_factory
+        self.events = events
+        self.tracker = tracker
+        self.cancel_token = CancelToken()
+        self.started_at = None
+        self.first_chunk_at = None
+        # 每一路只记录一个首字延迟样本
+        self.latency_recorded = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        threading.Thread(target=self._run, name=f"Hedge-{self.name}", daemon=True).start()
+
+    def _run(self):
+        try:
+            for chunk in self.stream_factory(self.cancel_token):
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.perf_counter()
+                    self.record_latency(self.first_chunk_at - self.started_at)
+                self.events.put((self, 'chunk', chunk))
+            self.events.put((self, 'done', None))
+        except RequestCancelled:
+            self.events.put((self, 'cancelled', None))
+        except Exception as e:
+            if self.cancel_token.cancelled:
+                self.events.put((self, 'cancelled', None))
+            else:
+                self.events.put((self, 'error', e))
+
+    def record_latency(self, seconds):
+        """记录首字延迟，已经记录过时忽略"""
+        with self.lock:
+            if self.latency_recorded or self.tracker is None:
+                return
+            self.latency_recorded = True
+        self.tracker.record(seconds)
+
+    def record_censored(self):
+        """
+        落败且尚未收到首字时，把已等待的时间作为首字延迟的下限记录下来；
+        只记录胜出一路的延迟会让分位数偏低，对冲请求发得过早
+        """
+        if self.started_at is not None and self.first_chunk_at is None:
+            self.record_latency(time.perf_counter() - self.started_at)
+
+    def close(self):
+        """取消这一路请求"""
+        self.cancel_token.cancel()
+
+
+class HedgedRequest:
+    """
+    对冲请求
+    先向主后端发送请求，超过等待时间仍未收到首个数据块时，向备用后端发送同样的请求，
+    采用先返回首个数据块的一路并取消另一路。主后端在等待时间内出错时立即切换到备用后端
+    """
+
+    def __init__(self, primary, secondary, delay):
+        """
+        :param primary: (名称, stream_factory, tracker)
+        :param secondary: (名称, stream_factory, tracker)
+        :param delay: 等待主后端首个数据块的时间（秒）
+        """
+        self.events = queue.Queue()
+        self.primary = HedgeLeg(*primary, events=self.events)
+        self.secondary = HedgeLeg(*secondary, events=self.events)
+        self.delay = delay
+        self.legs = []
+        self.winner = None
+        self.logger = LoggerManager.get_logger()
+
+    def close(self):
+        """取消所有请求"""
+        for leg in self.legs:
+            leg.close()
+
+    def _start(self, leg):
+        self.legs.append(leg)
+        leg.start()
+
+    def stream(self, cancel_token=None):
+        """
+        逐块产出胜出一路的回复文本
+        :param cancel_token: 外部取消令牌，取消时两路请求都会被取消
+        """
+        if cancel_token is not None:
+            cancel_token.bind(self)
+        errors = []
+        finished = set()
+        hedge_at = time.perf_counter() + self.delay
+        self._start(self.primary)
+        try:
+            while True:
+                timeout = None
+                if self.winner is None and self.secondary not in self.legs:
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                try:
+                    leg, kind, payload = self.events.get(timeout=timeout)
+                except queue.Empty:
+                    self.logger.info(f"{self.delay:.2f}s 内未收到首字，发送对冲请求 - 备用后端: {self.secondary.name}")
+                    self._start(self.secondary)
+                    continue
+
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+
+                if self.winner is None:
+                    if kind in ('chunk', 'done'):
+                        self.winner = leg
+                        for other in self.legs:
+                            if other is not leg:
+                                other.close()
+                                other.record_censored()
+                        if len(self.legs) > 1:
+                            self.logger.info(f"对冲请求结果 - 采用: {leg.name}, 已取消另一路")
+                    else:
+                        finished.add(leg)
+                        if kind == 'error':
+                            errors.append(leg.name + ': ' + str(payload))
+                            self.logger.warning(f"对冲请求中一路失败 - 后端: {leg.name}, {payload}")
+                        if self.secondary not in self.legs:
+                            self._start(self.secondary)
+                        elif len(finished) == len(self.legs):
+                            raise Exception("所有后端请求均失败\n" + "\n".join(errors))
+                        continue
+
+                if leg is not self.winner:
+                    continue
+                if kind == 'chunk':
+                    yield payload
+                elif kind == 'done':
+                    return
+                elif kind == 'error':
+                    raise payload
+                else:
+                    raise RequestCancelled()
+        finally:
+            if cancel_token is not None:
+                cancel_token.unbind(self)
+            # 胜出的一路结束前已写入历史记录，这里只会中断仍在进行的请求
+            self.close()
+
+
+def get_hedge_delay(tracker, config):
+    """
+    根据主后端的首字延迟分位数计算对冲等待时间
+    样本不足时使用配置的默认等待时间
+    """
+    percentile = float(config.get('hedge_percentile', 0.95))
+    min_delay = float(config.get('hedge_min_delay', 0.3))
+    max_delay = float(config.get('hedge_max_delay', 5.0))
+    delay = tracker.percentile(percentile) if len(tracker) >= int(config.get('hedge_min_samples', 10)) else None
+    if delay is None:
+        delay = float(config.get('hedge_default_delay', 1.5))
+    return min(max_delay, max(min_delay, delay))
@@ -0,0 +1,178 @@
+import re
+from collections import deque
+from itertools import islice
+
+# 中日韩文字、全角标点等通常每个字符对应约一个 token
+CJK_PATTERN = re.compile(
+    r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]'
+)
+
+# 每条消息的角色标记、分隔符等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 常见模型的上下文长度，按前缀匹配，越具体的前缀越靠前
+MODEL_CONTEXT_WINDOWS = [
+    ('gpt-4o', 128000),
+    ('gpt-4.1', 1000000),
+    ('gpt-4-turbo', 128000),
+    ('gpt-4-32k', 32768),
+    ('gpt-4', 8192),
+    ('gpt-3.5-turbo', 16385),
+    ('grok', 131072),
+    ('deepseek', 65536),
+    ('qwen', 32768),
+    ('llama3.2', 131072),
+    ('llama3.1', 131072),
+    ('llama3', 8192),
+    ('llama2', 4096),
+    ('mistral', 32768),
+]
+
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# 历史记录最多保存的消息数，上下文很长的模型也不会无限增长
+DEFAULT_MAX_MESSAGES = 200
+
+
+def estimate_tokens(text):
+    """
+    离线估算文本的 token 数
+    中日韩字符按每字一个 token 计算，其余字符按每 4 个字符一个 token 计算
+    """
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def estimate_message_tokens(message):
+    """估算单条消息的 token 数"""
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_context_window(model, default=DEFAULT_CONTEXT_WINDOW):
+    """获取模型的上下文长度"""
+    name = (model or '').lower()
+    # Ollama 模型名可能带命名空间，如 library/llama3:8b
+    name = name.rsplit('/', 1)[-1]
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if name.startswith(prefix):
+            return window
+    return default
+
+
+class HistoryWindow:
+    """
+    按 token 预算截取的对话历史
+    每条消息的 token 估算在加入时计算一次并缓存，发送时从最早的对话轮次开始丢弃，直到放得下。
+    保存的历史本身也不超过预算和 max_messages 条，超出时最早的轮次直接删除，
+    因此内存占用和每次 select 的耗时都有上限
+    """
+
+    def __init__(self, model=None, context_budget=None, max_messages=DEFAULT_MAX_MESSAGES):
+        """
+        :param model: 模型名称，用于确定默认的上下文长度
+        :param context_budget: 上下文 token 预算，为空时使用模型的上下文长度
+        :param max_messages: 最多保存的消息数
+        """
+        self.model = model
+        self.context_budget = context_budget
+        self.max_messages = max(2, int(max_messages))
+        self.entries = deque()
+        self.total_tokens = 0
+        self.user_messages = 0
+        self.last_sent_tokens = 0
+        self.last_dropped_messages = 0
+
+    @property
+    def budget(self):
+        return self.context_budget or get_context_window(self.model)
+
+    @property
+    def messages(self):
+        """全部历史消息"""
+        return [message for message, _ in self.entries]
+
+    def append(self, message):
+        """添加消息并缓存其 token 估算"""
+        tokens = estimate_message_tokens(message)
+        self.entries.append((message, tokens))
+        self.total_tokens += tokens
+        if message.get('role') == 'user':
+            self.user_messages += 1
+        self.trim()
+
+    def replace_last(self, message):
+        """替换最后一条消息，例如继续生成后更新回复"""
+        if not self.entries:
+            return self.append(message)
+        old_message, old_tokens = self.entries[-1]
+        tokens = estimate_message_tokens(message)
+        self.entries[-1] = (message, tokens)
+        self.total_tokens += tokens - old_tokens
+        self.user_messages += (message.get('role') == 'user') - (old_message.get('role') == 'user')
+        self.trim()
+
+    def trim(self):
+        """
+        删除再也不可能发送的最早轮次
+        保存的历史超过预算或 max_messages 时按轮次删除，最近一轮始终保留，继续生成需要用到
+        """
+        budget = self.budget
+        while self.user_messages > 1 and (self.total_tokens > budget or len(self.entries) > self.max_messages):
+            self.pop_first()
+            # 按轮次删除，避免留下没有提问的回答
+            while self.entries and self.entries[0][0].get('role') != 'user':
+                self.pop_first()
+
+    def pop_first(self):
+        message, tokens = self.entries.popleft()
+        self.total_tokens -= tokens
+        if message.get('role') == 'user':
+            self.user_messages -= 1
+
+    def copy_from(self, other):
+        """用另一份历史的内容替换当前历史，按当前的预算截取"""
+        self.entries = deque(other.entries)
+        self.total_tokens = other.total_tokens
+        self.user_messages = other.user_messages
+        self.trim()
+
+    def clear(self):
+        """清空历史"""
+        self.entries = deque()
+        self.total_tokens = 0
+        self.user_messages = 0
+
+    def select(self, fixed_messages=(), reserve_tokens=0, budget=None):
+        """
+        选出本次请求要发送的历史消息
+        :param fixed_messages: 一定会发送的消息（系统提示词、本次用户消息）
+        :param reserve_tokens: 为回复预留的 token 数
+        :param budget: 本次请求的上下文预算，为空时使用默认预算
+        :return: 放得下的最近历史消息
+        """
+        budget = budget or self.budget
+        fixed_tokens = sum(estimate_message_tokens(message) for message in fixed_messages)
+        available = budget - fixed_tokens - reserve_tokens
+
+        start = 0
+        history_tokens = self.total_tokens
+        while start < len(self.entries) and history_tokens > available:
+            # 按轮次丢弃，避免留下没有提问的回答
+            history_tokens -= self.entries[start][1]
+            start += 1
+            while start < len(self.entries) and self.entries[start][0].get('role') != 'user':
+                history_tokens -= self.entries[start][1]
+                start += 1
+
+        self.last_dropped_messages = start
+        self.last_sent_tokens = fixed_tokens + history_tokens
+        return [message for message, _ in islice(self.entries, start, None)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return bool(self.entries)
@@ -0,0 +1,240 @@
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from logger_manager import LoggerManager
+
+try:
+    import httpx
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+except ImportError:
+    httpx = None
+
+
+# 连接失败、超时等可以重试的网络错误
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout)
+if httpx is not None:
+    TRANSPORT_ERRORS += (httpx.TransportError,)
+
+
+def get_origin(url):
+    """获取URL的协议、主机和端口部分，同一 origin 共享一个连接池"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class TransportResponse:
+    """统一 requests 和 httpx 的响应接口"""
+
+    def __init__(self, response, is_httpx, on_close=None):
+        """
+        :param on_close: 流式响应关闭时的回调，用于释放连接池的引用
+        """
+        self.response = response
+        self.is_httpx = is_httpx
+        self.on_close = on_close
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def text(self):
+        if self.is_httpx:
+            self.response.read()
+        return self.response.text
+
+    def json(self):
+        if self.is_httpx:
+            self.response.read()
+        return self.response.json()
+
+    def iter_lines(self):
+        """逐行读取响应内容，返回字符串"""
+        if self.is_httpx:
+            return self.response.iter_lines()
+        # SSE 响应通常不带 charset，requests 会按 ISO-8859-1 解码导致中文乱码
+        self.response.encoding = 'utf-8'
+        return self.response.iter_lines(decode_unicode=True)
+
+    def close(self):
+        self.response.close()
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class HttpTransport:
+    """
+    同一 origin 共享的长连接 HTTP 客户端，复用 TCP 和 TLS 连接
+    代理、协议或连接池大小变化时被新的实例替换，替换后等正在读取的流式响应全部关闭再关闭连接池
+    """
+
+    def __init__(self, base_url, proxies=None, http2=False, pool_size=4):
+        """
+        :param base_url: API地址
+        :param proxies: 代理设置，格式为 {"http": ..., "https": ...}
+        :param http2: 是否启用 HTTP/2（需要安装 httpx 和 h2）
+        :param pool_size: 连接池大小
+        """
+        self.origin = get_origin(base_url)
+        self.proxies = proxies or {"http": None, "https": None}
+        self.http2 = bool(http2 and httpx is not None)
+        self.pool_size = pool_size
+        self.warmed = False
+        # 尚未关闭的流式响应数，被替换后降为 0 时关闭连接池
+        self.active = 0
+        self.retired = False
+        self.closed = False
+        self.lock = threading.Lock()
+        self.logger = LoggerManager.get_logger()
+
+        if http2 and httpx is None:
+            self.logger.warning("未安装 httpx[http2]，使用 HTTP/1.1 连接池")
+
+        if self.http2:
+            proxy = self.proxies.get("https") or self.proxies.get("http")
+            self.client = httpx.Client(
+                transport=httpx.HTTPTransport(
+                    http2=True,
+                    proxy=proxy,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                ),
+                headers={"Accept-Encoding": "gzip, deflate"}
+            )
+        else:
+            self.client = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.client.mount("http://", adapter)
+            self.client.mount("https://", adapter)
+            self.client.headers["Accept-Encoding"] = "gzip, deflate"
+            self.client.proxies.update({k: v for k, v in self.proxies.items() if v})
+            # 代理完全由 proxies 决定，不再读取环境变量
+            self.client.trust_env = False
+
+    def post(self, url, headers, payload, timeout=30, stream=False):
+        """
+        发送 POST 请求
+        :param url: 请求地址
+        :param headers: 请求头
+        :param payload: JSON 请求体
+        :param timeout: 超时时间（秒），也可以是 (连接超时, 读取超时)
+        :param stream: 是否流式读取响应
+        :return: TransportResponse
+        """
+        with self.lock:
+            closed = self.closed
+            if not closed:
+                self.active += 1
+        if closed:
+            # 取得实例后它已被替换并关闭，改用当前的连接池
+            return get_transport(self.origin, self.proxies, self.http2).post(url, headers, payload, timeout, stream)
+
+        self.warmed = True
+        if stream:
+            # 压缩会让中间代理缓冲 SSE 数据块，流式请求不压缩
+            headers = dict(headers, **{"Accept-Encoding": "identity"})
+
+        try:
+            if self.http2:
+                if isinstance(timeout, tuple):
+                    connect_timeout, read_timeout = timeout
+                    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+                request = self.client.build_request("POST", url, headers=headers, json=payload, timeout=timeout)
+                response = self.client.send(request, stream=stream)
+            else:
+                response = self.client.post(url, headers=headers, json=payload, timeout=timeout, stream=stream,
+                                            verify=True)
+        except BaseException:
+            self.release()
+            raise
+        if not stream:
+            # 非流式响应的内容已经读完，连接已归还连接池
+            self.release()
+            return TransportResponse(response, is_httpx=self.http2)
+        return TransportResponse(response, is_httpx=self.http2, on_close=self.release)
+
+    def release(self):
+        """一个请求结束，已被替换且没有未关闭的响应时关闭连接池"""
+        with self.lock:
+            self.active -= 1
+            idle = self.retired and self.active == 0 and not self.closed
+        if idle:
+            self.close()
+
+    def retire(self):
+        """被新的实例替换，等正在读取的流式响应关闭后再关闭连接池"""
+        with self.lock:
+            self.retired = True
+            idle = self.active == 0 and not self.closed
+        if idle:
+            self.close()
+        else:
+            self.logger.info(f"旧连接池还有 {self.active} 个响应在读取，读完后关闭: {self.origin}")
+
+    def preconnect(self, timeout=10):
+        """预先建立连接，让第一次请求不必等待 TCP 和 TLS 握手"""
+        self.warmed = True
+        try:
+            if self.http2:
+                self.client.head(self.origin, timeout=timeout)
+            else:
+                self.client.head(self.origin, timeout=timeout, verify=True)
+            self.logger.info(f"已预连接: {self.origin}")
+        except Exception as e:
+            self.logger.warning(f"预连接失败: {self.origin}, {e}")
+
+    def close(self):
+        """关闭连接池"""
+        with self.lock:
+            self.closed = True
+        self.client.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+_settings = {"pool_size": 4}
+
+
+def set_pool_size(pool_size):
+    """
+    设置每个 origin 的连接池大小，批处理等并发调用方按并发数调大
+    已有的连接池小于该值时，下一次获取时重建
+    """
+    with _transports_lock:
+        _settings["pool_size"] = max(1, int(pool_size))
+
+
+def get_transport(base_url, proxies=None, http2=False):
+    """
+    获取 base_url 对应的共享连接池
+    同一 origin 的所有会话和角色共用一个连接池，只有代理或协议变化时才重建
+    """
+    origin = get_origin(base_url)
+    proxies = proxies or {"http": None, "https": None}
+    replaced = None
+    with _transports_lock:
+        transport = _transports.get(origin)
+        if (transport is None or transport.proxies != proxies
+                or transport.http2 != bool(http2 and httpx is not None)
+                or transport.pool_size < _settings["pool_size"]):
+            if transport is not None:
+                LoggerManager.get_logger().info(f"连接配置变化，重建连接池: {origin}")
+                replaced = transport
+            transport = HttpTransport(base_url, proxies=proxies, http2=http2, pool_size=_settings["pool_size"])
+            _transports[origin] = transport
+    if replaced is not None:
+        replaced.retire()
+    return transport
+
+
+def preconnect(base_url, proxies=None, http2=False):
+    """在后台线程中预先建立到 base_url 的连接，已有连接的连接池不会重复预连接"""
+    transport = get_transport(base_url, proxies=proxies, http2=http2)
+    if not transport.warmed:
+        threading.Thread(target=transport.preconnect, daemon=True).start()
+    return transport
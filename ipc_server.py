@@ -0,0 +1,348 @@
+import hmac
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger_manager import LoggerManager
+from request_worker import CancelToken, RequestCancelled
+
+
+class CompletionServer:
+    """
+    本地补全接口
+    在 localhost 上以 HTTP 提供补全服务，编辑器和脚本可以复用程序中已建立的连接池、回复缓存和模型预热状态。
+    每个连接在独立线程中处理，不经过热键请求队列，不会阻塞热键
+
+    POST /v1/complete  {"text": "...", "role": "文案写手", "options": {"temperature": 0.7, "max_tokens": 500},
+                        "stream": true, "session": "editor-1"}
+        流式时返回 NDJSON：每行 {"delta": "..."}，最后一行 {"done": true, "text": "..."} 或 {"error": "..."}
+        指定 session 时同名会话保持历史记录，同一会话的请求按顺序执行
+    POST /v1/fanout    {"text": "...", "roles": ["通用助手", "文案写手"], "options": {...}, "stream": true}
+        同时请求多个角色，roles 为空时按配置 fanout_roles；
+        流式时每个角色完成后返回一行 {"index": 0, "role": "...", "text": "...", "error": null, "elapsed": 1.2}，
+        最后一行 {"done": true}
+    GET  /v1/roles     角色列表
+    GET  /health       运行状态
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=8765, token='', max_sessions=32):
+        """
+        :param app: SmartCopilot 实例
+        :param host: 监听地址，默认只监听本机
+        :param port: 端口，0 表示由系统分配
+        :param token: 访问令牌，非空时请求需带 Authorization: Bearer <token>
+        :param max_sessions: 保留的命名会话数，超出时丢弃最久未使用的会话
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.token = token or ''
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.sessions_lock = threading.Lock()
+        # 正在处理的请求的取消令牌，停止服务时一起取消
+        self.cancel_tokens = set()
+        self.cancel_tokens_lock = threading.Lock()
+        self.logger = LoggerManager.get_logger()
+        self.httpd = None
+
+    @classmethod
+    def from_config(cls, app, config, port=None):
+        """根据配置创建补全接口，port 不为空时覆盖配置"""
+        return cls(
+            app,
+            host=config.get('ipc_host', '127.0.0.1'),
+            port=int(config.get('ipc_port', 8765) if port is None else port),
+            token=config.get('ipc_token', '')
+        )
+
+    @property
+    def address(self):
+        if self.httpd is None:
+            return None
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        if self.httpd is not None:
+            return
+        if self.host not in ('127.0.0.1', 'localhost', '::1') and not self.token:
+            self.logger.warning(f"补全接口监听在非本机地址 {self.host} 且未设置 ipc_token")
+        server = self
+
+        class Handler(CompletionHandler):
+            completion_server = server
+
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.httpd.daemon_threads = True
+            threading.Thread(target=self.httpd.serve_forever, name="CompletionServer", daemon=True).start()
+            self.logger.info(f"本地补全接口: {self.address}/v1/complete")
+        except OSError as e:
+            self.logger.error(f"启动本地补全接口失败: {e}")
+            self.httpd = None
+
+    def stop(self):
+        """停止服务，取消正在处理的请求，等待中的客户端会收到取消的响应"""
+        with self.cancel_tokens_lock:
+            tokens = list(self.cancel_tokens)
+        for token in tokens:
+            token.cancel()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def create_cancel_token(self):
+        """创建请求的取消令牌，处理结束后需调用 release_cancel_token"""
+        token = CancelToken()
+        with self.cancel_tokens_lock:
+            self.cancel_tokens.add(token)
+        return token
+
+    def release_cancel_token(self, token):
+        with self.cancel_tokens_lock:
+            self.cancel_tokens.discard(token)
+
+    def check_token(self, header):
+        if not self.token:
+            return True
+        expected = f"Bearer {self.token}"
+        return hmac.compare_digest((header or '').encode('utf-8'), expected.encode('utf-8'))
+
+    def get_session(self, name, role_name):
+        """
+        获取会话和它的锁
+        未指定名称时每次创建不保留历史的新会话；命名会话按 (名称, 角色) 保留，保持历史记录
+        """
+        if not name:
+            return self.app.create_role_session(role_name), None
+        key = (name, role_name or '')
+        with self.sessions_lock:
+            entry = self.sessions.get(key)
+            if entry is not None:
+                self.sessions.move_to_end(key)
+                return entry
+        entry = (self.app.create_role_session(role_name, keep_history=True), threading.Lock())
+        with self.sessions_lock:
+            entry = self.sessions.setdefault(key, entry)
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return entry
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    completion_server = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_line(self, payload):
+        """以 chunked 编码写入一行 NDJSON"""
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def authorized(self):
+        if self.completion_server.check_token(self.headers.get('Authorization')):
+            return True
+        self.send_json(401, {"error": "unauthorized"})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        app = self.completion_server.app
+        path = self.path.split('?')[0]
+        config = app.config_manager.get_snapshot()
+        if path == '/health':
+            self.send_json(200, {
+                "status": "ok",
+                "ready": app.backend_ready.is_set(),
+                "api_type": config.api_type,
+                "model": config.model
+            })
+        elif path == '/v1/roles':
+            self.send_json(200, {
+                "current_role": config.current_role,
+                "roles": [{"name": role.name, "description": role.description} for role in config.roles]
+            })
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def read_request(self):
+        """读取 JSON 请求体并检查 text 字段"""
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        text = request['text']
+        if not isinstance(text, str) or not text:
+            raise ValueError("text 不能为空")
+        return request, text
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path not in ('/v1/complete', '/v1/fanout'):
+            self.send_json(404, {"error": "not found"})
+            return
+        if not self.authorized():
+            return
+        # 只接受 JSON，浏览器中的跨站请求需要预检，无法直接调用
+        if not (self.headers.get('Content-Type') or '').startswith('application/json'):
+            self.send_json(415, {"error": "Content-Type must be application/json"})
+            return
+        if path == '/v1/fanout':
+            self.fanout()
+            return
+        try:
+            request, text = self.read_request()
+            options = request.get('options') or {}
+            temperature = options.get('temperature')
+            max_tokens = options.get('max_tokens')
+            session, lock = self.completion_server.get_session(request.get('session'), request.get('role'))
+        except (KeyError, ValueError, TypeError) as e:
+            self.send_json(400, {"error": f"请求无效: {e}"})
+            return
+        except TimeoutError as e:
+            self.send_json(503, {"error": str(e)})
+            return
+
+        logger = self.completion_server.logger
+        logger.info(f"补全接口请求 - 角色: {session.role_name}, 会话: {request.get('session') or '-'}, 输入: {len(text)} 字")
+        cancel_token = self.completion_server.create_cancel_token()
+        if lock is not None:
+            lock.acquire()
+        try:
+            chunks = self.completion_server.app.stream_completion(
+                text, session, temperature=temperature, max_tokens=max_tokens, cancel_token=cancel_token
+            )
+            if request.get('stream', True):
+                self.stream_reply(chunks, cancel_token)
+            else:
+                try:
+                    reply = ''.join(chunks)
+                except RequestCancelled:
+                    # 服务停止时请求被取消，保持连接的客户端仍在等待响应，需要明确告知
+                    logger.info("补全接口请求已取消")
+                    self.send_json(503, {"error": "cancelled"})
+                    return
+                except Exception as e:
+                    logger.error(f"补全接口请求失败: {e}")
+                    self.send_json(502, {"error": str(e)})
+                    return
+                self.send_json(200, {"text": reply, "role": session.role_name, "model": session.model})
+        finally:
+            if lock is not None:
+                lock.release()
+            self.completion_server.release_cancel_token(cancel_token)
+
+    def fanout(self):
+        """同时请求多个角色，每个角色完成后立即写回"""
+        app = self.completion_server.app
+        try:
+            request, text = self.read_request()
+            roles = request.get('roles') or None
+            if roles is not None and (not isinstance(roles, list) or not all(isinstance(r, str) for r in roles)):
+                raise ValueError("roles 必须是角色名称列表")
+            options = request.get('options') or {}
+            if not app.backend_ready.wait(30):
+                raise TimeoutError("后端尚未初始化完成")
+            config = app.config_manager.get_snapshot()
+            roles = roles or app.get_fanout_roles(config)
+            missing = [name for name in roles if config.get_role(name) is None]
+            if missing:
+                raise KeyError(f"未找到角色: {missing}")
+        except (KeyError, ValueError, TypeError) as e:
+            self.send_json(400, {"error": f"请求无效: {e}"})
+            return
+        except TimeoutError as e:
+            self.send_json(503, {"error": str(e)})
+            return
+
+        logger = self.completion_server.logger
+        logger.info(f"补全接口多角色请求 - 角色: {roles}, 输入: {len(text)} 字")
+        cancel_token = self.completion_server.create_cancel_token()
+        try:
+            stream = request.get('stream', True)
+
+            def write_result(result):
+                if not stream or cancel_token.cancelled:
+                    return
+                try:
+                    self.write_line(result.to_dict())
+                except (BrokenPipeError, ConnectionResetError):
+                    cancel_token.cancel()
+                    logger.info("补全接口客户端已断开，取消请求")
+
+            if stream:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+            try:
+                results = app.fan_out(
+                    text, roles, on_result=write_result, cancel_token=cancel_token,
+                    temperature=options.get('temperature'), max_tokens=options.get('max_tokens')
+                )
+            except Exception as e:
+                logger.error(f"补全接口多角色请求失败: {e}")
+                if stream:
+                    self.finish_stream({"error": str(e)}, cancel_token)
+                else:
+                    self.send_json(502, {"error": str(e)})
+                return
+            if stream:
+                self.finish_stream({"done": True}, cancel_token)
+            else:
+                self.send_json(200, {"results": [result.to_dict() for result in results]})
+        finally:
+            self.completion_server.release_cancel_token(cancel_token)
+
+    def finish_stream(self, payload, cancel_token):
+        """写入最后一行并结束 chunked 响应"""
+        if cancel_token.cancelled:
+            return
+        try:
+            self.write_line(payload)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            cancel_token.cancel()
+
+    def stream_reply(self, chunks, cancel_token):
+        """边生成边写回；客户端断开时取消请求"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        parts = []
+        try:
+            try:
+                for chunk in chunks:
+                    parts.append(chunk)
+                    self.write_line({"delta": chunk})
+                self.write_line({"done": True, "text": ''.join(parts)})
+            except (BrokenPipeError, ConnectionResetError):
+                cancel_token.cancel()
+                chunks.close()
+                self.completion_server.logger.info("补全接口客户端已断开，取消请求")
+                return
+            except RequestCancelled:
+                self.write_line({"error": "cancelled"})
+            except Exception as e:
+                self.completion_server.logger.error(f"补全接口请求失败: {e}")
+                self.write_line({"error": str(e)})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            cancel_token.cancel()
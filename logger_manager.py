@@ -1,10 +1,146 @@
+import atexit
+import gzip
 import logging
 import os
+import queue
+import random
+import shutil
+import threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+
+def compress_log(path):
+    """把轮转出的日志文件压缩为 .gz，先写临时文件再替换，压缩完成后删除原文件"""
+    tmp_path = path + '.gz.tmp'
+    try:
+        with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, path + '.gz')
+        os.remove(path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+class CompressingFileHandler(logging.FileHandler):
+    """
+    按日期和大小轮转的日志文件
+    文件名为 chatanywhere_<日期>.log，跨天或超过 max_bytes 时轮转，
+    轮转出的文件在后台线程中压缩，只保留最近 backup_count 个压缩文件
+    """
+
+    def __init__(self, logs_dir='logs', prefix='chatanywhere', max_bytes=5 * 1024 * 1024, backup_count=14):
+        """
+        :param logs_dir: 日志目录
+        :param prefix: 文件名前缀
+        :param max_bytes: 单个文件的大小上限，0 表示只按日期轮转
+        :param backup_count: 保留的压缩文件数，0 表示不删除
+        """
+        self.logs_dir = logs_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.current_date = datetime.now().strftime("%Y-%m-%d")
+        os.makedirs(logs_dir, exist_ok=True)
+        super().__init__(self.get_filename(self.current_date), encoding='utf-8', delay=True)
+
+    def get_filename(self, date):
+        return os.path.join(self.logs_dir, f"{self.prefix}_{date}.log")
+
+    def should_rollover(self, record):
+        date = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d")
+        if date != self.current_date:
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def do_rollover(self, record):
+        """关闭当前文件，改名后交给后台线程压缩，再打开新的文件"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename):
+            index = 1
+            while True:
+                rotated = self.get_filename(f"{self.current_date}.{index}")
+                if not os.path.exists(rotated) and not os.path.exists(rotated + '.gz'):
+                    break
+                index += 1
+            os.replace(self.baseFilename, rotated)
+            threading.Thread(target=self._compress, args=(rotated,), name="LogCompress", daemon=True).start()
+        self.current_date = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d")
+        self.baseFilename = os.path.abspath(self.get_filename(self.current_date))
+
+    def _compress(self, path):
+        compress_log(path)
+        if not self.backup_count:
+            return
+        archives = sorted(
+            (os.path.join(self.logs_dir, name) for name in os.listdir(self.logs_dir)
+             if name.startswith(self.prefix + '_') and name.endswith('.log.gz')),
+            key=os.path.getmtime
+        )
+        for old in archives[:-self.backup_count]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def emit(self, record):
+        try:
+            if self.should_rollover(record):
+                self.do_rollover(record)
+        except Exception:
+            self.handleError(record)
+            return
+        super().emit(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    把日志记录放入队列，由后台线程写文件和控制台
+    标记了 deferred 的载荷日志连同参数一起入队，格式化也推迟到后台线程
+    """
+
+    def prepare(self, record):
+        if getattr(record, 'deferred', False):
+            return record
+        return super().prepare(record)
+
+
+class PayloadSummary:
+    """
+    延迟格式化的消息列表，只在日志真正输出时生成文本
+    构造时只复制列表本身，每条消息的内容按 max_chars 截断
+    """
+
+    def __init__(self, messages, max_chars=200):
+        self.messages = list(messages)
+        self.max_chars = max_chars
+
+    def __str__(self):
+        lines = []
+        for i, msg in enumerate(self.messages, 1):
+            content = str(msg.get('content', ''))
+            if self.max_chars and len(content) > self.max_chars:
+                content = f"{content[:self.max_chars]}...（共 {len(content)} 字）"
+            lines.append(f"{i}. {msg.get('role')}: {content}")
+        return "\n".join(lines)
+
 
 class LoggerManager:
     _instance = None
     _initialized = False
+    listener = None
+    file_handler = None
+    console_handler = None
+    # 载荷日志的采样比例和每条消息的截断长度
+    payload_sample_rate = 1.0
+    payload_max_chars = 200
 
     def __new__(cls):
         if cls._instance is None:
@@ -17,45 +153,82 @@ class LoggerManager:
             LoggerManager._initialized = True
 
     def setup_logger(self):
-        """设置日志记录器"""
-        # 创建logs目录（如果不存在）
-        logs_dir = "logs"
-        if not os.path.exists(logs_dir):
-            os.makedirs(logs_dir)
-
-        # 生成日志文件名（使用当前日期）
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        log_file = os.path.join(logs_dir, f"chatanywhere_{current_date}.log")
-
-        # 配置根日志记录器
-        logger = logging.getLogger()
-        logger.setLevel(logging.INFO)
+        """设置日志记录器，调用线程只负责入队，写文件、控制台和轮转压缩都在后台线程中进行"""
+        # 创建格式化器
+        formatter = logging.Formatter(
+            '[%(asctime)s] %(levelname)s: %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
 
         # 创建文件处理器
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler = CompressingFileHandler("logs")
         file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(formatter)
 
         # 创建控制台处理器
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(formatter)
 
-        # 创建格式化器
-        formatter = logging.Formatter(
-            '[%(asctime)s] %(levelname)s: %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(LoggerManager.stop)
 
-        # 设置格式化器
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
+        # 配置根日志记录器
+        logger = logging.getLogger()
+        logger.setLevel(logging.INFO)
+        logger.addHandler(DeferredQueueHandler(log_queue))
 
-        # 添加处理器到日志记录器
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        LoggerManager.listener = listener
+        LoggerManager.file_handler = file_handler
+        LoggerManager.console_handler = console_handler
 
         # 记录启动信息
         logging.info("=== ChatAnywhere 启动 ===")
-        logging.info(f"日志文件: {log_file}")
+        logging.info(f"日志文件: {file_handler.baseFilename}")
+
+    @classmethod
+    def configure(cls, config):
+        """
+        根据配置更新日志级别、轮转和载荷日志参数
+        :param config: 配置快照，读取 log_level、log_max_bytes、log_backup_count、
+                       log_payload_sample_rate、log_payload_max_chars
+        """
+        cls.get_logger()
+        level = logging.getLevelName(str(config.get('log_level', 'INFO')).upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+        logging.getLogger().setLevel(level)
+        cls.file_handler.setLevel(level)
+        cls.console_handler.setLevel(level)
+        cls.file_handler.max_bytes = int(config.get('log_max_bytes', 5 * 1024 * 1024) or 0)
+        cls.file_handler.backup_count = int(config.get('log_backup_count', 14) or 0)
+        cls.payload_sample_rate = float(config.get('log_payload_sample_rate', 1.0))
+        cls.payload_max_chars = int(config.get('log_payload_max_chars', 200) or 0)
+
+    @classmethod
+    def stop(cls):
+        """写完队列中剩余的日志并停止后台线程"""
+        if cls.listener is not None:
+            cls.listener.stop()
+            cls.listener = None
+
+    @classmethod
+    def log_payload(cls, label, messages):
+        """
+        在 DEBUG 级别记录请求的消息列表
+        未开启 DEBUG 或未被采样时不做任何格式化，开启时由后台线程格式化截断后的内容
+        :param label: 日志标题
+        :param messages: 消息列表
+        """
+        logger = cls.get_logger()
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        if cls.payload_sample_rate < 1.0 and random.random() >= cls.payload_sample_rate:
+            return
+        logger.debug("%s（%d 条消息）\n%s", label, len(messages), PayloadSummary(messages, cls.payload_max_chars),
+                     extra={'deferred': True})
 
     @staticmethod
     def get_logger():
@@ -1,51 +1,143 @@
-import tkinter as tk
-import keyboard
-import threading
 import time
-import logging
-from ollama_api import ChatSession as OllamaChatSession, OllamaAPI
-from oai_api import ChatSession as OAIChatSession
+# 从导入模块开始计时，不包括解释器本身的启动时间
+STARTUP_TIME = time.perf_counter()
+import argparse
+import queue
+import threading
+import keyboard
+from proxy_resolver import configure_resolver
+from resilience import configure_resilience
 from config_manager import ConfigManager
 from clipboard_manager import ClipboardManager
-from ui_manager import UIManager
 from logger_manager import LoggerManager
+from request_worker import RequestWorker, RequestCancelled
+from response_cache import ResponseCache
+from prompt_builder import build_system_message, compile_role_prompt
+from hedging import HedgedRequest, get_latency_tracker, get_hedge_delay
+from metrics import MetricsRegistry
+from role_session import RoleSession
+from ipc_server import CompletionServer
+from fanout import FanOut
+from chunking import ChunkedRunner, DEFAULT_REDUCE_PROMPT, split_text, stitch, stitch_stream, \
+    get_chunk_budget, get_input_budget, get_role_setting, should_chunk
+from history_manager import estimate_tokens
+# 后端模块（requests、httpx、ollama）和界面模块（tkinter）按需导入，不计入这里的导入耗时
+IMPORT_TIME = time.perf_counter() - STARTUP_TIME
 
 class SmartCopilot:
-    def __init__(self):
-        """初始化应用程序"""
+    def __init__(self, config_file='config.json', headless=False, bind_hotkeys=True, enable_ipc=None, ipc_port=None):
+        """
+        初始化应用程序
+        快捷键最先就绪；后端模块的导入和会话初始化作为第一个任务在工作线程中执行，
+        之后触发的热键请求排在它后面；设置窗口在第一次打开时才创建
+        :param config_file: 配置文件路径
+        :param headless: 不创建窗口，用于基准测试等没有界面的场景
+        :param bind_hotkeys: 是否注册全局快捷键
+        :param enable_ipc: 是否开启本地补全接口，为空时按配置 ipc_enabled
+        :param ipc_port: 本地补全接口端口，为空时按配置 ipc_port
+        """
         # 初始化日志系统
         self.logger = LoggerManager.get_logger()
         self.logger.info("启动智能写作助手")
+        self.startup_timings = {"import": IMPORT_TIME}
         
-        # 创建主窗口
-        self.root = tk.Tk()
-        self.root.title("智能写作助手")
+        # 主窗口和设置界面在 run() 和第一次打开设置时创建
+        self.headless = headless
+        self.root = None
+        self.ui_manager = None
+        # 其他线程通过该队列把界面操作交给主线程执行
+        self.ui_queue = queue.SimpleQueue()
+        self.exit_event = threading.Event()
         
         # 初始化配置管理器
-        self.config_manager = ConfigManager()
+        config_start = time.perf_counter()
+        self.config_manager = ConfigManager(config_file)
+        configure_resolver(self.config_manager.get_snapshot())
+        configure_resilience(self.config_manager.get_snapshot())
+        LoggerManager.configure(self.config_manager.get_snapshot())
+        self.startup_timings["config"] = time.perf_counter() - config_start
         
-        # 初始化UI管理器
-        self.ui_manager = UIManager(self.root, self.config_manager, self.on_config_save)
+        # API客户端和聊天会话由 setup_backend 在工作线程中初始化
+        self.api_client = None
+        self.chat_session = None
+        self.backend_ready = threading.Event()
         
-        # 初始化API客户端
-        self.setup_api_client()
+        # 确定性角色的回复缓存
+        self.response_cache = ResponseCache.from_config(self.config_manager.get_snapshot())
         
-        # 设置默认的聊天会话
-        self.setup_default_chat_session()
+        # 各阶段耗时统计
+        self.metrics = MetricsRegistry.from_config(self.config_manager.get_snapshot())
+        self.metrics.start()
+        
+        # 上一次完成的请求，供继续生成使用
+        self.last_request = None
+        
+        # 对冲请求使用的备用会话
+        self.hedge_session = None
+        self.hedge_session_key = None
+        
+        # 多角色结果窗口 (请求编号, FanOutPicker)，只在主线程中访问
+        self.fanout_picker = None
+        # 窗口中选中、等待粘贴的回复和目标窗口
+        self.fanout_choice = None
+        
+        # 启动后台请求执行器，第一个任务是初始化后端
+        self.request_worker = RequestWorker({
+            'setup': self.setup_backend,
+            'complete': self.handle_text_complete,
+            'continue': self.continue_output,
+            'clear': self.clear_history_with_notification,
+            'fanout': self.handle_fanout,
+            'fanout_paste': self.paste_fanout_choice,
+            'reconfigure': self.apply_config
+        }, on_finished=self.record_metrics,
+            # 取消热键只取消用户触发的请求，初始化和配置切换必须执行
+            cancellable_kinds=('complete', 'continue', 'fanout'))
+        self.request_worker.start()
+        self.request_worker.submit('setup')
         
         # 绑定快捷键
-        self.bind_shortcuts()
+        if bind_hotkeys:
+            self.bind_shortcuts()
+        self.startup_timings["hotkeys_ready"] = time.perf_counter() - STARTUP_TIME
+        
+        # 本地补全接口，在独立线程中处理请求，不经过热键请求队列
+        self.ipc_server = None
+        if enable_ipc if enable_ipc is not None else self.config_manager.get_snapshot().get('ipc_enabled', False):
+            self.ipc_server = CompletionServer.from_config(self, self.config_manager.get_snapshot(), port=ipc_port)
+            self.ipc_server.start()
+
+    def setup_backend(self, ctx=None):
+        """导入当前 api_type 对应的后端模块并初始化聊天会话，记录启动各阶段耗时"""
+        start = time.perf_counter()
+        try:
+            self.setup_api_client()
+            self.setup_default_chat_session()
+        finally:
+            self.backend_ready.set()
+        self.startup_timings["backend"] = time.perf_counter() - start
+        self.startup_timings["backend_ready"] = time.perf_counter() - STARTUP_TIME
         
-        self.last_response = ""  # 添加变量存储上一次的回复
+        api_type = self.config_manager.get_snapshot().api_type
+        for name, seconds in self.startup_timings.items():
+            self.metrics.observe(f"startup_{name}", seconds, backend=api_type)
+        self.logger.info(
+            "启动耗时 - " +
+            ", ".join(f"{name}: {seconds * 1000:.0f}ms" for name, seconds in self.startup_timings.items())
+        )
 
     def setup_api_client(self):
         """初始化API客户端"""
         try:
-            config = self.config_manager.get_config()
-            api_type = config.get('api_type', 'OpenAI兼容')
+            api_type = self.config_manager.get_snapshot().api_type
             
             if api_type == 'Ollama':
-                self.api_client = OllamaAPI(self.config_manager)
+                # 只在使用 Ollama 时导入 ollama 库
+                from ollama_api import OllamaAPI
+                
+                # 沿用已有实例，保留模型预热状态；客户端在服务地址变化时自动切换
+                if not isinstance(self.api_client, OllamaAPI):
+                    self.api_client = OllamaAPI(self.config_manager)
             else:  # OpenAI 或 OpenAI兼容模式
                 self.api_client = None  # OpenAI模式不需要专门的客户端
                 
@@ -55,15 +147,14 @@ class SmartCopilot:
     def setup_default_chat_session(self):
         """设置默认的聊天会话"""
         try:
-            config = self.config_manager.get_config()
-            current_role = config.get('current_role', '通用助手')
-            roles = config.get('roles', [])
-            current_role_config = next((role for role in roles if role['name'] == current_role), None)
+            config = self.config_manager.get_snapshot()
+            current_role = config.current_role
+            current_role_config = config.current_role_config
             
             if current_role_config:
-                api_type = config.get('api_type', 'OpenAI兼容')
-                model = config.get('model')
-                base_url = config.get('base_url')
+                api_type = config.api_type
+                model = config.model
+                base_url = config.base_url
                 
                 # 记录详细的配置信息
                 self.logger.info(f"当前配置 - API类型: {api_type}, 模型: {model}, 角色: {current_role}")
@@ -74,22 +165,30 @@ class SmartCopilot:
                         model=model,
                         system_prompt={
                             "role": "system",
-                            "content": current_role_config.get('input_prompt', ''),
-                            "input_prompt": current_role_config.get('input_prompt', ''),
-                            "output_prompt": current_role_config.get('output_prompt', '')
+                            "content": current_role_config.input_prompt,
+                            "input_prompt": current_role_config.input_prompt,
+                            "output_prompt": current_role_config.output_prompt
                         },
-                        keep_history=config.get('keep_history', True)
+                        keep_history=config.keep_history
                     )
                 else:  # OpenAI 或 OpenAI兼容模式
+                    from oai_api import ChatSession as OAIChatSession, get_proxy
+                    from http_transport import preconnect
+                    
                     self.chat_session = OAIChatSession(
-                        api_key=config.get('apikey'),
+                        api_key=config.apikey,
                         base_url=base_url,
                         model=model,
-                        system_prompt={
-                            "role": "system",
-                            "content": current_role_config.get('input_prompt', '')
-                        }
+                        system_prompt=build_system_message(current_role_config, config.language),
+                        http2=config.get('http2', False),
+                        keep_history=config.get('keep_history', True),
+                        context_budget=config.get('context_budget') or None,
+                        role_name=current_role,
+                        timeout=(float(config.get('connect_timeout', 5)), float(config.get('read_timeout', 30))),
+                        fallback_model=config.get('fallback_model') or None
                     )
+                    # 启动时预先建立连接，第一次热键不再等待握手
+                    preconnect(self.chat_session.base_url, proxies=get_proxy(), http2=config.get('http2', False))
                 self.logger.info(f"聊天会话已初始化完成")
             else:
                 self.logger.warning(f"未找到角色配置: {current_role}")
@@ -98,201 +197,653 @@ class SmartCopilot:
             self.logger.error(f"设置默认聊天会话失败: {str(e)}")
 
     def bind_shortcuts(self):
-        """绑定快捷键"""
+        """绑定快捷键，回调只把请求放入队列，不在键盘钩子线程中执行任何耗时操作"""
         try:
             self.logger.info("绑定快捷键")
-            keyboard.add_hotkey('ctrl+alt+\\', self.handle_text_complete)
-            keyboard.add_hotkey('ctrl+alt+/', self.continue_output)
-            keyboard.add_hotkey('ctrl+esc', self.clear_history_with_notification)
+            keyboard.add_hotkey('ctrl+alt+\\', lambda: self.request_worker.submit('complete'))
+            keyboard.add_hotkey('ctrl+alt+/', lambda: self.request_worker.submit('continue'))
+            keyboard.add_hotkey('ctrl+alt+backspace', self.request_worker.cancel_current)
+            keyboard.add_hotkey('ctrl+esc', lambda: self.request_worker.submit('clear'))
+            if not self.headless:
+                # 键盘钩子线程不能操作界面，交给主线程打开设置窗口
+                settings_hotkey = self.config_manager.get_snapshot().get('settings_hotkey', 'ctrl+alt+s')
+                keyboard.add_hotkey(settings_hotkey, lambda: self.ui_queue.put(self.open_settings))
+                # 多角色的结果需要在窗口中选择，没有界面时只能通过本地补全接口使用
+                fanout_hotkey = self.config_manager.get_snapshot().get('fanout_hotkey', 'ctrl+alt+m')
+                keyboard.add_hotkey(fanout_hotkey, lambda: self.request_worker.submit('fanout'))
             self.logger.info("快捷键绑定完成")
         except Exception as e:
             self.logger.error(f"绑定快捷键失败: {e}")
 
-    def handle_text_complete(self):
+    def handle_text_complete(self, ctx):
         """处理文本补全"""
         try:
             # 获取选中的文本
-            selected_text = ClipboardManager.get_selected_text()
-            if not selected_text:
+            ctx.selected_text = ClipboardManager.get_selected_text(timings=ctx.timings)
+            if not ctx.selected_text:
                 self.logger.warning("未选中文本")
                 return
+            ctx.cancel_token.raise_if_cancelled()
 
-            self.logger.info("开始文本补全")
-            # 获取配置
-            config = self.config_manager.get_config()
+            self.logger.info(f"开始文本补全 - 请求编号: {ctx.id}")
+            config = self.config_manager.get_snapshot()
+            role = config.current_role_config
+            system_prompt = compile_role_prompt(role, config.language)
+            if should_chunk(config, role, ctx.selected_text, config.model, system_prompt):
+                self.run_chunked(ctx, ctx.selected_text)
+            else:
+                self.run_request(ctx, ctx.selected_text)
+            self.logger.info("文本补全完成")
+            
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            self.logger.error(f"文本补全失败: {e}")
+
+    def record_metrics(self, ctx):
+        """请求结束后记录各阶段耗时，没有发出请求的操作不计入"""
+        if ctx.kind == 'clear' or ctx.role is None:
+            return
+        self.metrics.record_request(ctx)
+
+    @staticmethod
+    def record_backend_stats(ctx, stats):
+        """把会话记录的请求构建、网络、首字和生成耗时计入请求上下文"""
+        if not stats:
+            return
+        ctx.record('build', stats.get('build'))
+        ctx.record('network', stats.get('network'))
+        ctx.record('ttft', stats.get('ttft'))
+        if stats.get('total_time') is not None and stats.get('ttft') is not None:
+            ctx.record('generate', stats['total_time'] - stats['ttft'])
+
+    def run_request(self, ctx, user_input):
+        """按当前配置发送请求，并把回复输出到光标位置"""
+        # 获取配置快照
+        with ctx.stage('config'):
+            config = self.config_manager.get_snapshot()
             
             # 获取当前角色的配置
-            current_role = config.get('current_role', '通用助手')
-            roles = config.get('roles', [])
-            role = next((r for r in roles if r['name'] == current_role), None)
+            ctx.role = config.current_role
+            ctx.api_type = config.api_type
+            role = config.current_role_config
+        
+        # 使用角色配置，如果没有则使用全局配置
+        text_complete_number = role.max_tokens if role else config.text_complete_number
+        temperature = role.temperature if role else config.temperature
+
+        self.logger.info(f"发送聊天请求 - 角色: {ctx.role}, temperature: {temperature}, max_tokens: {text_complete_number}")
+
+        # 确定性角色先查询回复缓存
+        cache_key = None
+        chat_session = self.chat_session
+        if self.response_cache.applies(temperature):
+            role_prompt = compile_role_prompt(role, config.language)
+            cache_key = ResponseCache.make_key(
+                ctx.api_type, config.base_url, config.model, role_prompt,
+                {"temperature": float(temperature), "max_tokens": int(text_complete_number)},
+                user_input,
+                history=chat_session.message_history if chat_session else None
+            )
+            with ctx.stage('cache_lookup'):
+                cached = self.response_cache.get(cache_key)
+            self.logger.info(f"回复缓存{'命中' if cached is not None else '未命中'} - 统计: {self.response_cache.stats}")
+            if cached is not None:
+                with ctx.stage('paste'):
+                    ClipboardManager.write_text(cached)
+                # 命中时同样写入历史记录，保持对话连续
+                if chat_session:
+                    chat_session.add_to_history({"role": "user", "content": user_input})
+                    chat_session.add_to_history({"role": "assistant", "content": cached})
+                ctx.response = cached
+                self.last_request = ctx
+                return
+
+        # 调用API获取补全
+        if ctx.api_type == 'Ollama':
+            # num_ctx、num_predict 等参数由 OllamaAPI 按角色和请求大小规划
+            with ctx.stage('request'):
+                response = self.api_client.chat(user_input, cancel_token=ctx.cancel_token)
+            ctx.cancel_token.raise_if_cancelled()
+            ctx.error = self.api_client.last_error
+            if ctx.error is None:
+                self.record_backend_stats(ctx, self.api_client.last_stats)
+            # 输出到剪贴板，错误提示不写入用户的文档
+            if ctx.error is None:
+                with ctx.stage('paste'):
+                    ClipboardManager.write_text(response)
+            else:
+                self.notify("请求失败", response)
+        else:  # OpenAI 或 OpenAI兼容模式，流式模式在接收过程中粘贴
+            response = self.stream_to_cursor(
+                ctx,
+                user_input,
+                temperature=float(temperature),
+                max_tokens=int(text_complete_number)
+            )
+        
+        # 记录本次请求，供继续生成使用
+        with ctx.stage('post_process'):
+            ctx.response = response
+            self.last_request = ctx
+            
+            if cache_key is not None and ctx.error is None:
+                self.response_cache.put(cache_key, response)
+
+    def run_chunked(self, ctx, user_input):
+        """
+        超长的选中文本按段落和句子拆分，各段在有限并发下用当前角色同时处理，
+        按原文顺序拼接后粘贴；前面的段完成后就开始粘贴，开启 chunk_reduce 时再整合一次
+        """
+        with ctx.stage('config'):
+            config = self.config_manager.get_snapshot()
+            ctx.role = config.current_role
+            ctx.api_type = config.api_type
+            role = config.current_role_config
+            system_prompt = compile_role_prompt(role, config.language)
+            chunks = split_text(user_input, get_chunk_budget(config, role, config.model, system_prompt))
+        concurrency = max(1, int(get_role_setting(config, role, 'chunk_concurrency', 4)))
+        reduce = bool(get_role_setting(config, role, 'chunk_reduce', False))
+        self.logger.info(
+            f"分段处理 - 角色: {ctx.role}, 输入约 {estimate_tokens(user_input)} tokens, "
+            f"分为 {len(chunks)} 段, 并发: {concurrency}, 整合: {'是' if reduce else '否'}"
+        )
+        if config.api_type != 'Ollama':
+            from http_transport import set_pool_size
             
-            # 使用角色配置，如果没有则使用全局配置
-            text_complete_number = role.get('text_complete_number', config['text_complete_number']) if role else config['text_complete_number']
-            temperature = role.get('temperature', config['temperature']) if role else config['temperature']
+            set_pool_size(max(4, concurrency))
+        
+        # 每个线程使用自己的会话，各段互不影响，也不写入热键会话的历史记录
+        local = threading.local()
+        
+        def complete(chunk, cancel_token):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = self.create_role_session(ctx.role)
+            return ''.join(self.stream_completion(chunk, session, cancel_token=cancel_token))
+        
+        runner = ChunkedRunner(complete, concurrency)
+        try:
+            if not reduce:
+                with ctx.stage('request'):
+                    response = ClipboardManager.write_stream(
+                        stitch_stream(chunks, runner.map(chunks, ctx.cancel_token)), timings=ctx.timings
+                    )
+            else:
+                with ctx.stage('request'):
+                    mapped = stitch(chunks, runner.map(chunks, ctx.cancel_token))
+                prompt = (get_role_setting(config, role, 'chunk_reduce_prompt') or DEFAULT_REDUCE_PROMPT) + mapped
+                if estimate_tokens(prompt) > get_input_budget(config, role, config.model, system_prompt):
+                    # 整合后的输入仍然放不下时直接使用分段结果
+                    self.logger.warning("分段结果超出上下文长度，跳过整合")
+                    with ctx.stage('paste'):
+                        ClipboardManager.write_text(mapped)
+                    response = mapped
+                else:
+                    with ctx.stage('reduce'):
+                        response = ClipboardManager.write_stream(
+                            self.stream_completion(prompt, self.create_role_session(ctx.role),
+                                                   cancel_token=ctx.cancel_token),
+                            timings=ctx.timings
+                        )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            ctx.error = e
+            response = f"\n发生错误: {str(e)}"
+            self.logger.error(response)
+            self.notify("分段处理失败", str(e))
+        
+        ctx.response = response
+        # 分段处理的回复不在热键会话的历史记录中，无法接着生成
+        self.last_request = None
 
-            self.logger.info(f"发送聊天请求 - 角色: {current_role}, temperature: {temperature}, max_tokens: {text_complete_number}")
+    def get_hedge_session(self, config):
+        """
+        获取对冲请求使用的备用会话
+        备用后端取 api_configs 中 hedge_backend 指定的配置，与主会话共用系统提示词；
+        历史记录是主会话历史的副本，每次请求前重新复制，两路都不直接写入
+        """
+        backend = config.get('hedge_backend')
+        chat_session = self.chat_session
+        if not backend or backend == config.api_type or backend == 'Ollama':
+            return None
+        api_config = (config.get('api_configs') or {}).get(backend) or {}
+        if not api_config.get('base_url') or not api_config.get('model'):
+            self.logger.warning(f"对冲备用后端配置不完整: {backend}")
+            return None
 
-            # 调用API获取补全
-            api_type = config.get('api_type', 'OpenAI兼容')
+        key = (backend, api_config.get('base_url'), api_config.get('model'), api_config.get('apikey'), id(chat_session))
+        if self.hedge_session_key != key:
+            from oai_api import ChatSession as OAIChatSession, get_proxy
+            from http_transport import preconnect
             
-            if api_type == 'Ollama':
-                response = self.api_client.chat(
-                    selected_text,
-                    {
-                        "num_ctx": int(text_complete_number),
-                        "mirostat": 0,
-                        "mirostat_eta": float(temperature)
-                    }
-                )
-            else:  # OpenAI 或 OpenAI兼容模式
-                response = self.chat_session.chat(
-                    selected_text,
-                    temperature=float(temperature),
-                    max_tokens=int(text_complete_number)
-                )
+            self.hedge_session = OAIChatSession(
+                api_key=api_config.get('apikey'),
+                base_url=api_config.get('base_url'),
+                model=api_config.get('model'),
+                system_prompt=chat_session.system_prompt,
+                http2=config.get('http2', False),
+                keep_history=chat_session.keep_history,
+                role_name=chat_session.role_name,
+                timeout=chat_session.timeout
+            )
+            self.hedge_session_key = key
+            self.logger.info(f"对冲备用后端 - {backend}, 模型: {api_config.get('model')}")
+            preconnect(self.hedge_session.base_url, proxies=get_proxy(), http2=config.get('http2', False))
+        self.hedge_session.history.copy_from(chat_session.history)
+        return self.hedge_session
+
+    def stream_to_cursor(self, ctx, user_input, temperature, max_tokens):
+        """流式请求回复，并在接收过程中增量粘贴到光标位置"""
+        config = self.config_manager.get_snapshot()
+        chat_session = self.chat_session
+        tracker = get_latency_tracker(chat_session.base_url, chat_session.model)
+        hedge_session = self.get_hedge_session(config) if config.get('hedge_enabled', False) else None
+        try:
+            if hedge_session is None:
+                with ctx.stage('request'):
+                    response = ClipboardManager.write_stream(
+                        chat_session.stream_chat(
+                            user_input,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            cancel_token=ctx.cancel_token
+                        ),
+                        timings=ctx.timings
+                    )
+                # 未开启对冲时同样记录首字延迟，开启后可以直接按分位数计算等待时间
+                tracker.record(chat_session.last_stats["ttft"])
+                self.record_backend_stats(ctx, chat_session.last_stats)
+                return response
+
+            # 主后端超过首字延迟分位数仍无输出时，向备用后端发送同样的请求，采用先返回的一路
+            request = HedgedRequest(
+                (
+                    config.api_type,
+                    lambda token: chat_session.stream_chat(user_input, temperature, max_tokens, cancel_token=token,
+                                                           commit_history=False),
+                    tracker
+                ),
+                (
+                    config.get('hedge_backend'),
+                    lambda token: hedge_session.stream_chat(user_input, temperature, max_tokens, cancel_token=token,
+                                                            commit_history=False),
+                    get_latency_tracker(hedge_session.base_url, hedge_session.model)
+                ),
+                delay=get_hedge_delay(tracker, config)
+            )
+            with ctx.stage('request'):
+                response = ClipboardManager.write_stream(request.stream(ctx.cancel_token), timings=ctx.timings)
+            winner_session = chat_session if request.winner is request.primary else hedge_session
+            # 落败的一路可能在取消前也已完整结束，只写入胜出一路的这一轮对话
+            for message in winner_session.last_turn:
+                chat_session.add_to_history(message)
+            self.record_backend_stats(ctx, winner_session.last_stats)
+            return response
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            ctx.error = e
+            error_msg = f"\n发生错误: {str(e)}"
+            self.logger.error(error_msg)
+            # 已粘贴的部分回复保留，错误通过提示窗口显示，不接在回复后面粘贴
+            self.notify("请求失败", str(e))
+            return error_msg
+
+    def create_role_session(self, role_name=None, keep_history=False, timeout=30.0):
+        """
+        按角色配置创建独立会话，供本地补全接口等在热键以外的线程中使用
+        :param role_name: 角色名称，为空时使用当前角色
+        :param keep_history: 是否保持历史记录
+        :param timeout: 等待后端初始化完成的最长时间（秒）
+        """
+        if not self.backend_ready.wait(timeout):
+            raise TimeoutError("后端尚未初始化完成")
+        config = self.config_manager.get_snapshot()
+        role = config.get_role(role_name)
+        if role_name and role is None:
+            raise KeyError(f"未找到角色: {role_name}")
+        return RoleSession(config, role, keep_history=keep_history,
+                           ollama_api=self.api_client if config.api_type == 'Ollama' else None)
+
+    def stream_completion(self, text, session, temperature=None, max_tokens=None, cancel_token=None):
+        """
+        使用角色会话生成回复，逐块产出文本；确定性请求与热键请求共用回复缓存
+        在调用方线程中执行，不经过热键请求队列
+        :param session: RoleSession
+        """
+        config = self.config_manager.get_snapshot()
+        temperature = session.temperature if temperature is None else temperature
+        max_tokens = session.max_tokens if max_tokens is None else max_tokens
+        
+        cache_key = None
+        if self.response_cache.applies(temperature):
+            role = session.role
+            role_prompt = compile_role_prompt(role, config.language)
+            cache_key = ResponseCache.make_key(
+                config.api_type, config.base_url, config.model, role_prompt,
+                {"temperature": float(temperature), "max_tokens": int(max_tokens)},
+                text,
+                history=session.session.message_history or None
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                session.session.add_to_history({"role": "user", "content": text})
+                session.session.add_to_history({"role": "assistant", "content": cached})
+                yield cached
+                return
+        
+        parts = []
+        for chunk in session.stream(text, temperature, max_tokens, cancel_token=cancel_token):
+            parts.append(chunk)
+            yield chunk
+        if cache_key is not None:
+            self.response_cache.put(cache_key, ''.join(parts))
+
+    def get_fanout_roles(self, config):
+        """多角色请求默认使用的角色，配置 fanout_roles 为空时使用全部角色"""
+        names = config.get('fanout_roles') or [role.name for role in config.roles]
+        missing = [name for name in names if config.get_role(name) is None]
+        if missing:
+            self.logger.warning(f"多角色配置中的角色不存在，已跳过: {missing}")
+        return [name for name in names if name not in missing]
+
+    def fan_out(self, text, role_names=None, on_result=None, cancel_token=None, temperature=None, max_tokens=None):
+        """
+        把同一段文本同时发给多个角色，每个角色使用独立会话和自己的参数，等待全部完成
+        在调用方线程中执行，不经过热键请求队列
+        :param role_names: 角色名称列表，为空时按配置 fanout_roles
+        :param on_result: 每个角色完成时的回调，接收 FanOutResult
+        :param temperature: 为空时使用各角色的配置
+        :param max_tokens: 为空时使用各角色的配置
+        :return: 按角色顺序排列的 FanOutResult 列表
+        """
+        config = self.config_manager.get_snapshot()
+        role_names = list(role_names or self.get_fanout_roles(config))
+        sessions = [self.create_role_session(name) for name in role_names]
+        if config.api_type != 'Ollama':
+            from http_transport import set_pool_size
+            
+            # 各角色同时请求同一个服务，连接池至少要容纳全部角色
+            set_pool_size(max(4, len(sessions)))
+        fanout = FanOut(
+            sessions,
+            lambda user_input, session, token: ''.join(
+                self.stream_completion(user_input, session, temperature, max_tokens, cancel_token=token)
+            )
+        )
+        return fanout.run(text, on_result=on_result, cancel_token=cancel_token)
+
+    def handle_fanout(self, ctx):
+        """捕获选中文本，同时请求多个角色，回复到达后立即显示在选择窗口中"""
+        try:
+            fanout_hotkey = self.config_manager.get_snapshot().get('fanout_hotkey', 'ctrl+alt+m')
+            ctx.selected_text = ClipboardManager.get_selected_text(
+                hotkeys=tuple(fanout_hotkey.split('+')), timings=ctx.timings
+            )
+            if not ctx.selected_text:
+                self.logger.warning("未选中文本")
+                return
+            ctx.cancel_token.raise_if_cancelled()
             
-            # 更新最后的响应
-            self.last_response = response
+            config = self.config_manager.get_snapshot()
+            role_names = self.get_fanout_roles(config)
+            if not role_names:
+                self.logger.warning("没有可用于多角色请求的角色")
+                return
+            ctx.role = '+'.join(role_names)
+            ctx.api_type = config.api_type
+            self.logger.info(f"开始多角色请求 - 请求编号: {ctx.id}, 角色: {role_names}")
             
-            # 输出到剪贴板
-            ClipboardManager.write_text(response)
-            self.logger.info("文本补全完成")
+            # 记录目标窗口，选择结果后切换回来再粘贴
+            window = ClipboardManager.get_backend().get_foreground_window()
+            self.ui_queue.put(lambda: self.show_fanout_picker(ctx, role_names, window))
+            with ctx.stage('request'):
+                self.fan_out(
+                    ctx.selected_text,
+                    role_names,
+                    on_result=lambda result: self.ui_queue.put(lambda: self.update_fanout_picker(ctx, result)),
+                    cancel_token=ctx.cancel_token
+                )
+            # 选择结果或关闭窗口时会取消其余角色，这里不再按取消处理
+            self.logger.info("多角色请求完成")
             
+        except RequestCancelled:
+            raise
         except Exception as e:
-            self.logger.error(f"文本补全失败: {e}")
+            self.logger.error(f"多角色请求失败: {e}")
+
+    def show_fanout_picker(self, ctx, role_names, window):
+        """在主线程中创建多角色结果选择窗口"""
+        if self.root is None:
+            return
+        from ui_manager import FanOutPicker
+        
+        if self.fanout_picker is not None:
+            self.fanout_picker[1].close()
+        self.fanout_picker = (ctx.id, FanOutPicker(
+            self.root,
+            role_names,
+            # 选中一个结果后不再需要其他角色的回复
+            on_choose=lambda text: self.choose_fanout_result(ctx, text, window),
+            on_close=ctx.cancel
+        ))
 
-    def clear_history(self):
+    def update_fanout_picker(self, ctx, result):
+        """在主线程中把一个角色的回复显示到对应的选择窗口"""
+        if self.fanout_picker is not None and self.fanout_picker[0] == ctx.id:
+            self.fanout_picker[1].add_result(result)
+
+    def choose_fanout_result(self, ctx, text, window):
+        """取消其余未完成的角色，把选中的回复交给工作线程粘贴"""
+        ctx.cancel()
+        self.fanout_choice = (text, window)
+        self.request_worker.submit('fanout_paste')
+
+    def paste_fanout_choice(self, ctx):
+        """切换回触发时的窗口，粘贴选中的回复"""
+        choice, self.fanout_choice = self.fanout_choice, None
+        if choice is None:
+            return
+        text, window = choice
+        ClipboardManager.get_backend().activate_window(window)
+        with ctx.stage('paste'):
+            ClipboardManager.write_text(text)
+
+    def clear_history(self, ctx=None):
         """清除历史记录"""
         try:
             if hasattr(self, 'chat_session') and self.chat_session:
                 self.chat_session.clear_history()
+                self.last_request = None
                 self.logger.info("历史记录已清除")
             else:
                 self.logger.warning("没有活动的聊天会话")
         except Exception as e:
             self.logger.error(f"清除历史记录失败: {e}")
 
-    def clear_history_with_notification(self):
+    def clear_history_with_notification(self, ctx=None):
         """清除历史记录并通知用户"""
-        self.clear_history()
-        print("历史记录已清除")
+        self.clear_history(ctx)
+        self.notify("智能写作助手", "历史记录已清除")
+
+    def notify(self, title, message):
+        """
+        在屏幕角落显示提示，不抢占焦点，也不写入用户的文档
+        可以在任意线程调用；没有界面时只写日志，由调用方负责记录详细错误
+        """
+        self.logger.info(f"提示 - {title}: {message}")
+        if self.root is None:
+            return
 
-    def continue_output(self):
+        def show():
+            from ui_manager import Notification
+            
+            Notification(self.root, title, message)
+        self.ui_queue.put(show)
+
+    def continue_output(self, ctx):
         """继续输出功能"""
         try:
-            if not self.last_response:
+            last_request = self.last_request
+            if last_request is None or not last_request.response:
                 self.logger.warning("没有上一次的回复可以继续")
                 return
 
-            self.logger.info("开始继续生成")
-            # 构建继续输出的提示
-            continue_prompt = "请继续上文未完成的内容"
-            
-            # 获取配置
-            config = self.config_manager.get_config()
-            
-            # 获取当前角色的配置
-            current_role = config.get('current_role', '通用助手')
-            roles = config.get('roles', [])
-            role = next((r for r in roles if r['name'] == current_role), None)
-            
-            # 使用角色配置，如果没有则使用全局配置
-            text_complete_number = role.get('text_complete_number', config['text_complete_number']) if role else config['text_complete_number']
-            temperature = role.get('temperature', config['temperature']) if role else config['temperature']
+            self.logger.info(f"开始继续生成 - 请求编号: {ctx.id}, 继续请求: {last_request.id}")
 
-            self.logger.info(f"继续生成 - 角色: {current_role}, temperature: {temperature}, max_tokens: {text_complete_number}")
-
-            # 调用API继续生成
-            api_type = config.get('api_type', 'OpenAI兼容')
-            
-            if api_type == 'Ollama':
-                response = self.api_client.chat(
-                    continue_prompt,
-                    {
-                        "num_ctx": int(text_complete_number),
-                        "mirostat": 0,
-                        "mirostat_eta": float(temperature)
-                    }
-                )
-            else:  # OpenAI 或 OpenAI兼容模式
-                response = self.chat_session.chat(
-                    continue_prompt,
-                    temperature=float(temperature),
-                    max_tokens=int(text_complete_number)
-                )
-                
-            # 更新最后的响应
-            self.last_response = response
-            
-            # 输出到剪贴板
-            ClipboardManager.write_text(response)
+            # 缓存命中的回复没有经过 Ollama，会话中记录的不是这次回复时按普通请求继续
+            if (last_request.api_type == 'Ollama' and self.api_client is not None
+                    and self.api_client.can_continue()
+                    and self.api_client.chat_session.last_reply == last_request.response):
+                # Ollama 预填上一次的回复接着生成，提示词前缀不变，KV 缓存可以复用
+                ctx.role = last_request.role
+                ctx.api_type = last_request.api_type
+                with ctx.stage('request'):
+                    continuation = self.api_client.continue_chat(cancel_token=ctx.cancel_token)
+                ctx.cancel_token.raise_if_cancelled()
+                ctx.error = self.api_client.last_error
+                if ctx.error is None:
+                    self.record_backend_stats(ctx, self.api_client.last_stats)
+                    with ctx.stage('paste'):
+                        ClipboardManager.write_text(continuation)
+                else:
+                    self.notify("继续生成失败", continuation)
+                ctx.response = last_request.response + continuation if ctx.error is None else continuation
+                if ctx.error is None:
+                    self.last_request = ctx
+            else:
+                # 构建继续输出的提示
+                continue_prompt = "请继续上文未完成的内容"
+                self.run_request(ctx, continue_prompt)
             self.logger.info("继续生成完成")
             
+        except RequestCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"继续输出失败: {e}")
 
     def on_config_save(self, config):
-        """当配置保存时的回调函数"""
+        """
+        当配置保存时的回调函数，在界面线程中调用
+        只保存配置，会话和后端的切换交给工作线程在两个请求之间进行，不会替换正在使用的会话
+        """
         try:
             # 保存配置
             self.config_manager.save_config(config)
-            
-            # 更新API客户端配置
-            self.setup_api_client()
-            
-            # 获取当前角色的提示词
-            current_role = config.get('current_role', '通用助手')
-            roles = config.get('roles', [])
-            role = next((r for r in roles if r['name'] == current_role), None)
-            
-            if role:
-                # 获取角色的输入和输出提示词
-                input_prompt = role.get('input_prompt', '')
-                output_prompt = role.get('output_prompt', '')
-                
-                # 重新初始化聊天会话
-                api_type = config.get('api_type', 'OpenAI兼容')
-                
-                if api_type == 'Ollama':
-                    self.chat_session = self.api_client.set_chat_session(
-                        model=config.get('model'),
-                        system_prompt={
-                            "role": "system",
-                            "content": input_prompt,
-                            "input_prompt": input_prompt,
-                            "output_prompt": output_prompt
-                        },
-                        keep_history=config.get('keep_history', True)
-                    )
-                else:  # OpenAI 或 OpenAI兼容模式
-                    self.chat_session = OAIChatSession(
-                        api_key=config.get('apikey'),
-                        base_url=config.get('base_url'),
-                        model=config.get('model'),
-                        system_prompt={
-                            "role": "system",
-                            "content": input_prompt
-                        }
-                    )
-                self.logger.info(f"更新聊天会话配置 - 角色: {current_role}, 输入提示词: {input_prompt}, 输出提示词: {output_prompt}")
-            else:
-                self.logger.warning(f"未找到角色配置: {current_role}")
-                
+            # 连续保存时排队中的任务会被合并，执行时读取最新的配置，不能按时间窗口忽略
+            self.request_worker.submit('reconfigure', debounce=False)
             self.logger.info("配置保存完成")
             
         except Exception as e:
             self.logger.error(f"保存配置失败: {e}")
 
+    def apply_config(self, ctx=None):
+        """在工作线程中按最新配置更新代理、重试、日志、API客户端和聊天会话"""
+        config = self.config_manager.get_snapshot()
+        # 代理配置可能变化，重新解析；解析结果不变时连接池会被保留
+        configure_resolver(config)
+        configure_resilience(config)
+        LoggerManager.configure(config)
+        
+        # 更新API客户端配置，重新初始化聊天会话；连接池按 base_url 共享，只切换角色时沿用已有连接
+        self.setup_api_client()
+        self.setup_default_chat_session()
+        self.logger.info(f"已应用新配置 - 角色: {config.current_role}")
+
+    def open_settings(self):
+        """打开设置窗口，第一次打开时才导入界面模块并创建窗口，只能在主线程中调用"""
+        if self.root is None:
+            return
+        if self.ui_manager is None:
+            from ui_manager import UIManager
+            
+            start = time.perf_counter()
+            self.ui_manager = UIManager(self.root, self.config_manager, self.on_config_save)
+            self.logger.info(f"设置窗口已创建，耗时: {(time.perf_counter() - start) * 1000:.0f}ms")
+        self.root.deiconify()
+        self.root.lift()
+        self.root.focus_force()
+
+    def should_open_settings_on_start(self):
+        """配置要求或当前后端尚未配置时，启动后直接打开设置窗口"""
+        config = self.config_manager.get_snapshot()
+        if config.get('show_settings_on_start', False):
+            return True
+        if config.api_type == 'Ollama':
+            return not config.base_url
+        return not config.apikey or not config.base_url
+
+    def process_ui_queue(self):
+        """在主线程中执行其他线程提交的界面操作"""
+        while True:
+            try:
+                action = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                action()
+            except Exception as e:
+                self.logger.error(f"界面操作失败: {e}")
+        self.root.after(100, self.process_ui_queue)
+
     def run(self):
         """运行程序"""
         try:
             self.logger.info("启动主程序")
+            if self.headless:
+                # 没有界面时等待退出信号，定时醒来以便响应 Ctrl+C
+                while not self.exit_event.wait(0.5):
+                    pass
+                return
+            
+            import tkinter as tk
+            
+            self.root = tk.Tk()
+            self.root.title("智能写作助手")
+            self.root.withdraw()
+            if self.should_open_settings_on_start():
+                self.open_settings()
+            else:
+                settings_hotkey = self.config_manager.get_snapshot().get('settings_hotkey', 'ctrl+alt+s')
+                self.logger.info(f"已在后台运行，按 {settings_hotkey} 打开设置窗口")
+            self.root.after(100, self.process_ui_queue)
             self.root.mainloop()
+        except KeyboardInterrupt:
+            self.logger.info("收到中断信号")
         except Exception as e:
             self.logger.error(f"程序运行错误: {e}")
         finally:
-            self.logger.info("程序退出")
+            self.shutdown()
+
+    def shutdown(self):
+        """停止后台线程并保存状态"""
+        if self.ipc_server is not None:
+            self.ipc_server.stop()
+        self.request_worker.stop()
+        self.response_cache.close()
+        self.metrics.stop()
+        # 写入尚未落盘的配置修改
+        self.config_manager.flush()
+        self.logger.info("程序退出")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="智能写作助手")
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('--daemon', action='store_true', help='无界面后台运行，并开启本地补全接口')
+    parser.add_argument('--no-hotkeys', action='store_true', help='不注册全局快捷键')
+    parser.add_argument('--ipc-port', type=int, help='本地补全接口端口，覆盖配置 ipc_port')
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    app = SmartCopilot()
+    args = parse_args()
+    app = SmartCopilot(
+        args.config,
+        headless=args.daemon,
+        bind_hotkeys=not args.no_hotkeys,
+        enable_ipc=True if args.daemon or args.ipc_port is not None else None,
+        ipc_port=args.ipc_port
+    )
     app.run()
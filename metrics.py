@@ -0,0 +1,198 @@
+import json
+import os
+import tempfile
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger_manager import LoggerManager
+
+# 直方图分桶上限（秒），覆盖从剪贴板操作的几毫秒到长回复的几十秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    耗时直方图
+    分桶计数用于 Prometheus 输出，最近的样本用于计算 p50 / p95 / p99
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_samples=1000):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """最近样本的分位数，没有样本时返回 0"""
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6)
+        }
+
+
+def escape_label(value):
+    """转义 Prometheus 标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    热键请求各阶段耗时的统计
+    按 阶段、角色、后端 分组记录直方图，定期写入本地文件，可选在 localhost 上以 Prometheus 文本格式提供
+    """
+
+    def __init__(self, path='logs/metrics.json', dump_interval=60.0, port=0, enabled=True):
+        """
+        :param path: 定期写入的统计文件，为空时不写文件
+        :param dump_interval: 写入间隔（秒）
+        :param port: Prometheus 接口端口，0 表示不开启
+        :param enabled: 是否记录
+        """
+        self.path = path
+        self.dump_interval = dump_interval
+        self.port = port
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.logger = LoggerManager.get_logger()
+        self.stop_event = threading.Event()
+        self.dump_thread = None
+        self.server = None
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建统计"""
+        return cls(
+            path=config.get('metrics_path', 'logs/metrics.json'),
+            dump_interval=float(config.get('metrics_dump_interval', 60)),
+            port=int(config.get('metrics_port', 0) or 0),
+            enabled=config.get('metrics_enabled', True)
+        )
+
+    def observe(self, stage, seconds, role=None, backend=None):
+        """记录一个阶段的耗时"""
+        if not self.enabled or seconds is None:
+            return
+        key = (stage, role or '', backend or '')
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+            histogram.observe(seconds)
+
+    def record_request(self, ctx):
+        """记录一次请求的全部阶段耗时"""
+        for stage, seconds in ctx.timings.items():
+            self.observe(stage, seconds, ctx.role, ctx.api_type)
+        self.logger.info(
+            f"阶段耗时 - 请求编号: {ctx.id}, " +
+            ", ".join(f"{stage}: {seconds * 1000:.0f}ms" for stage, seconds in ctx.timings.items())
+        )
+
+    def snapshot(self):
+        """所有直方图的汇总"""
+        with self.lock:
+            return [
+                dict(stage=stage, role=role, backend=backend, **histogram.summary())
+                for (stage, role, backend), histogram in sorted(self.histograms.items())
+            ]
+
+    def to_prometheus(self):
+        """Prometheus 文本格式"""
+        lines = [
+            "# HELP smartanychat_stage_seconds Duration of each hotkey pipeline stage.",
+            "# TYPE smartanychat_stage_seconds histogram"
+        ]
+        with self.lock:
+            for (stage, role, backend), histogram in sorted(self.histograms.items()):
+                labels = f'stage="{escape_label(stage)}",role="{escape_label(role)}",backend="{escape_label(backend)}"'
+                cumulative = 0
+                for upper, count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'smartanychat_stage_seconds_bucket{{{labels},le="{upper}"}} {cumulative}')
+                lines.append(f'smartanychat_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'smartanychat_stage_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'smartanychat_stage_seconds_count{{{labels}}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        """把汇总写入统计文件，先写临时文件再替换，避免读到写了一半的文件"""
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.error(f"写入统计文件失败: {e}")
+
+    def _dump_loop(self):
+        while not self.stop_event.wait(self.dump_interval):
+            self.dump()
+
+    def start(self):
+        """启动定期写文件的线程和 Prometheus 接口"""
+        if not self.enabled:
+            return
+        if self.path and self.dump_thread is None:
+            self.dump_thread = threading.Thread(target=self._dump_loop, name="MetricsDump", daemon=True)
+            self.dump_thread.start()
+        if self.port and self.server is None:
+            registry = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = registry.to_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            try:
+                # 只监听本机地址
+                self.server = ThreadingHTTPServer(('127.0.0.1', self.port), MetricsHandler)
+                threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+                self.logger.info(f"Prometheus 统计接口: http://127.0.0.1:{self.port}/metrics")
+            except OSError as e:
+                self.logger.error(f"启动统计接口失败: {e}")
+                self.server = None
+
+    def stop(self):
+        """停止后台线程并写入最后一次统计"""
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.enabled:
+            self.dump()
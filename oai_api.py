@@ -1,29 +1,33 @@
-import requests
-import winreg
+import json
+import time
+from logger_manager import LoggerManager
+from http_transport import get_transport
+from proxy_resolver import get_resolver
+from request_worker import RequestCancelled
+from history_manager import HistoryWindow
+from prompt_builder import parse_usage, get_cache_stats
+from resilience import CircuitOpenError, get_breaker, send_with_retry
 
 def get_proxy():
-    try:
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Internet Settings") as key:
-            proxy_enable, _ = winreg.QueryValueEx(key, "ProxyEnable")
-            proxy_server, _ = winreg.QueryValueEx(key, "ProxyServer")
-            
-            if proxy_enable and proxy_server:
-                proxy_parts = proxy_server.split(":")
-                if len(proxy_parts) == 2:
-                    return {"http": f"http://{proxy_server}", "https": f"http://{proxy_server}"}
-    except WindowsError:
-        pass
-    return {"http": None, "https": None}
+    """获取代理设置，结果由全局代理解析器缓存"""
+    return get_resolver().get_requests_proxies()
 
 
 class ChatSession:
-    def __init__(self, api_key, base_url, model, system_prompt):
+    def __init__(self, api_key, base_url, model, system_prompt, http2=False, keep_history=True, context_budget=None,
+                 role_name=None, timeout=(5, 30), fallback_model=None):
         """
         初始化聊天会话
         :param api_key: API密钥
         :param base_url: API基础URL
         :param model: 使用的模型名称
-        :param system_prompt: 系统提示，用于设定AI角色
+        :param system_prompt: 系统提示，用于设定AI角色，通常由 prompt_builder.build_system_message 生成
+        :param http2: 是否使用 HTTP/2 连接池
+        :param keep_history: 是否保持历史记录
+        :param context_budget: 上下文 token 预算，为空时按模型的上下文长度
+        :param role_name: 角色名称，用于按角色统计提示词缓存命中率
+        :param timeout: (连接超时, 读取超时)，单位秒
+        :param fallback_model: 当前模型熔断时降级使用的模型
         """
         base_url = base_url.rstrip('/')
         if not '/v1/chat/completions' in base_url:
@@ -35,42 +39,71 @@ class ChatSession:
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
-        self.system_prompt = system_prompt
-        self.message_history = []
+        # 系统消息在会话内保持同一个对象，每次请求的前缀完全一致
+        self.system_prompt = {"role": "system", "content": system_prompt.get("content", "")}
+        self.role_name = role_name
+        self.http2 = http2
+        self.timeout = timeout
+        self.fallback_model = fallback_model
+        self.keep_history = keep_history
+        self.history = HistoryWindow(model=model, context_budget=context_budget)
+        self.last_prompt_tokens = 0
+        self.last_stats = None
+        # 最近一次正常结束的流式请求的 (提问, 回复)
+        self.last_turn = None
+        self.last_build_time = None
+        self.last_network_time = None
+        self.logger = LoggerManager.get_logger()
         
-    def get_full_context(self, user_message):
-        """构建完整的消息上下文"""
-        return [self.system_prompt] + self.message_history + [user_message]
+    @property
+    def message_history(self):
+        """全部历史消息"""
+        return self.history.messages
+
+    def get_full_context(self, user_message, max_tokens=0):
+        """构建完整的消息上下文，历史记录按 token 预算截取"""
+        history = self.history.select([self.system_prompt, user_message], reserve_tokens=max_tokens)
+        self.last_prompt_tokens = self.history.last_sent_tokens
+        if self.history.last_dropped_messages:
+            self.logger.info(f"历史记录超出预算，丢弃最早的 {self.history.last_dropped_messages} 条消息")
+        return [self.system_prompt] + history + [user_message]
         
     def add_to_history(self, message):
         """添加消息到历史记录"""
-        self.message_history.append(message)
+        if self.keep_history:
+            self.history.append(message)
         
     def clear_history(self):
         """清空历史记录"""
-        self.message_history = []
+        self.history.clear()
         
-    def chat(self, user_input, temperature=0.7, max_tokens=2000):
+    def get_transport(self):
+        """获取当前 base_url 的共享连接池"""
+        return get_transport(self.base_url, proxies=get_proxy(), http2=self.http2)
+
+    def send(self, headers, data, stream=False, cancel_token=None):
         """
-        发送消息并获取回复
-        :param user_input: 用户输入的消息
-        :param temperature: 温度参数，控制回复的随机性
-        :param max_tokens: 回复的最大token数量
+        发送请求，暂时性错误自动重试
+        当前模型熔断时，配置了降级模型则改用降级模型，否则直接失败
         """
-        if self.api_key is None:
-            print("api_key is None")
-            return None
+        breaker = get_breaker(self.base_url, data["model"])
+        # 每个请求只调用一次 allow()，获准的结果传给 send_with_retry
+        allowed = breaker.allow()
+        if not allowed and self.fallback_model and self.fallback_model != data["model"]:
+            self.logger.warning(f"模型 {data['model']} 已熔断，降级使用 {self.fallback_model}")
+            data = dict(data, model=self.fallback_model)
+            breaker = get_breaker(self.base_url, self.fallback_model)
+            allowed = breaker.allow()
+        if not allowed:
+            raise CircuitOpenError(f"后端暂时不可用，已熔断，{breaker.retry_in:.0f}s 后重试 - {breaker.name}")
+        return send_with_retry(
+            self.get_transport(), self.base_url, headers, data,
+            timeout=self.timeout, stream=stream, breaker=breaker, cancel_token=cancel_token, allowed=True
+        )
 
-        user_message = {"role": "user", "content": user_input}
-        message_context = self.get_full_context(user_message)
-
-        print("\n=== 当前对话记录 ===")
-        if not self.message_history:
-            print("新对话 或者 未开启记住历史对话")
-        for i, msg in enumerate(message_context, 1):
-            print(f"{i}. {msg['role']}: {msg['content']}")
-        print("==================\n")
-        
+    def build_request(self, user_message, temperature, max_tokens, stream):
+        """构建请求头和请求体"""
+        build_start = time.perf_counter()
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
@@ -78,30 +111,168 @@ class ChatSession:
 
         data = {
             "model": self.model,
-            "messages": message_context,
+            "messages": self.get_full_context(user_message, max_tokens),
             "temperature": temperature,
             "max_tokens": max_tokens,
-            "stream": False
+            "stream": stream
         }
+        if stream:
+            # 流式响应默认不带 usage，需要显式请求才能拿到缓存命中的 token 数
+            data["stream_options"] = {"include_usage": True}
+        self.last_build_time = time.perf_counter() - build_start
+        self.logger.info(f"本次请求上下文约 {self.last_prompt_tokens} tokens，历史消息 {len(data['messages']) - 2} 条")
+        return headers, data
+
+    def record_stats(self, start_time, first_token_time, end_time, completion_tokens, stream, usage=None):
+        """记录本次请求的首字延迟、生成速度和提示词缓存命中情况"""
+        ttft = (first_token_time or end_time) - start_time
+        generate_time = end_time - (first_token_time or start_time)
+        if generate_time <= 0:
+            generate_time = end_time - start_time
+        tokens_per_second = completion_tokens / generate_time if generate_time > 0 else 0.0
+
+        self.last_stats = {
+            "stream": stream,
+            "ttft": ttft,
+            "total_time": end_time - start_time,
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": tokens_per_second
+        }
+        self.last_stats["prompt_tokens"] = self.last_prompt_tokens
+        self.last_stats["build"] = self.last_build_time
+        self.last_stats["network"] = self.last_network_time
+        if usage:
+            parsed = parse_usage(usage)
+            if parsed["prompt_tokens"]:
+                self.last_stats["prompt_tokens"] = parsed["prompt_tokens"]
+            self.last_stats["cached_tokens"] = parsed["cached_tokens"]
+            get_cache_stats().record(self.role_name, parsed)
+        self.logger.info(
+            f"请求统计 - 模型: {self.model}, 流式: {stream}, 首字延迟: {ttft:.3f}s, "
+            f"总耗时: {end_time - start_time:.3f}s, tokens: {completion_tokens}, 速度: {tokens_per_second:.1f} tokens/s"
+        )
+
+    def stream_chat(self, user_input, temperature=0.7, max_tokens=2000, cancel_token=None, commit_history=True):
+        """
+        以流式方式发送消息，逐块产出回复文本
+        只有在流正常结束（收到 [DONE] 或 finish_reason）后才写入历史记录
+        :param user_input: 用户输入的消息
+        :param temperature: 温度参数，控制回复的随机性
+        :param max_tokens: 回复的最大token数量
+        :param cancel_token: 取消令牌，取消时关闭响应并抛出 RequestCancelled
+        :param commit_history: 是否写入历史记录；为 False 时只记录到 last_turn，由调用方决定是否写入
+        """
+        if self.api_key is None:
+            raise Exception("api_key is None")
+
+        user_message = {"role": "user", "content": user_input}
+        headers, data = self.build_request(user_message, temperature, max_tokens, stream=True)
+        LoggerManager.log_payload(f"当前对话记录 - 模型: {self.model}", data["messages"])
+
+        start_time = time.perf_counter()
+        first_token_time = None
+        chunk_count = 0
+        usage = None
+        finished = False
+        reply_parts = []
+
+        response = self.send(headers, data, stream=True, cancel_token=cancel_token)
+        # 连接、重试直到收到响应头的耗时
+        self.last_network_time = time.perf_counter() - start_time
+        if cancel_token is not None:
+            cancel_token.bind(response)
+        try:
+            if response.status_code != 200:
+                raise Exception(f"API请求错误: HTTP {response.status_code}\n{response.text}")
+
+            for line in response.iter_lines():
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    finished = True
+                    break
+
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices", []):
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                        chunk_count += 1
+                        reply_parts.append(content)
+                        yield content
+                    if choice.get("finish_reason"):
+                        finished = True
+        except RequestCancelled:
+            raise
+        except Exception:
+            # 取消时响应被关闭，读取会以连接错误的形式中断
+            if cancel_token is not None and cancel_token.cancelled:
+                raise RequestCancelled()
+            raise
+        finally:
+            if cancel_token is not None:
+                cancel_token.unbind(response)
+            response.close()
+
+        if not finished:
+            raise Exception("流式响应意外中断")
+
+        completion_tokens = (usage or {}).get("completion_tokens") or chunk_count
+        self.record_stats(start_time, first_token_time, time.perf_counter(),
+                          completion_tokens, stream=True, usage=usage)
+
+        self.last_turn = (user_message, {"role": "assistant", "content": "".join(reply_parts)})
+        if commit_history:
+            self.add_to_history(user_message)
+            self.add_to_history(self.last_turn[1])
+
+    def chat(self, user_input, temperature=0.7, max_tokens=2000, stream=False):
+        """
+        发送消息并获取回复
+        :param user_input: 用户输入的消息
+        :param temperature: 温度参数，控制回复的随机性
+        :param max_tokens: 回复的最大token数量
+        :param stream: 是否使用流式请求，完整回复在流结束后一次性返回
+        """
+        if self.api_key is None:
+            self.logger.error("api_key is None")
+            return None
+
+        if stream:
+            try:
+                return "".join(self.stream_chat(user_input, temperature, max_tokens))
+            except Exception as e:
+                error_msg = f"\n发生错误: {str(e)}"
+                self.logger.error(error_msg)
+                return error_msg
+
+        user_message = {"role": "user", "content": user_input}
+        headers, data = self.build_request(user_message, temperature, max_tokens, stream=False)
+        LoggerManager.log_payload(f"当前对话记录 - 模型: {self.model}", data["messages"])
 
         try:
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=data,
-                proxies=get_proxy(),
-                verify=True,
-                timeout=30
-            )
+            start_time = time.perf_counter()
+            response = self.send(headers, data)
+            self.last_network_time = time.perf_counter() - start_time
             
             if response.status_code != 200:
                 error_msg = f"API请求错误: HTTP {response.status_code}\n{response.text}"
-                print(error_msg)
+                self.logger.error(error_msg)
                 return error_msg
 
             response_data = response.json()
             if "choices" in response_data and len(response_data["choices"]) > 0:
                 ai_response = response_data["choices"][0]["message"]["content"]
+                end_time = time.perf_counter()
+                usage = response_data.get("usage") or {}
+                self.record_stats(start_time, end_time, end_time,
+                                  usage.get("completion_tokens", 0), stream=False, usage=usage)
                 
                 if not ai_response.startswith(("\n发生错误", "request error", "API请求错误")):
                     self.add_to_history(user_message)
@@ -113,5 +284,5 @@ class ChatSession:
 
         except Exception as e:
             error_msg = f"\n发生错误: {str(e)}"
-            print(error_msg)
+            self.logger.error(error_msg)
             return error_msg
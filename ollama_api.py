@@ -1,6 +1,32 @@
-import os
+import threading
+import time
 import ollama
 from logger_manager import LoggerManager
+from request_worker import RequestCancelled
+from history_manager import HistoryWindow, estimate_message_tokens
+from ollama_options import OllamaOptionsPlanner
+from prompt_builder import compile_system_prompt
+
+# 按 host 缓存的客户端，同一个 Ollama 服务复用连接，不同的服务可以同时使用
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_clients(host: str = None):
+    """
+    获取绑定到 host 的同步和异步客户端
+    :param host: Ollama 服务地址，为空时使用 ollama 库的默认地址
+    :return: (ollama.Client, ollama.AsyncClient)
+    """
+    host = (host or '').rstrip('/') or None
+    with _clients_lock:
+        clients = _clients.get(host)
+        if clients is None:
+            clients = (ollama.Client(host=host), ollama.AsyncClient(host=host))
+            _clients[host] = clients
+            LoggerManager.get_logger().info(f"创建 Ollama 客户端 - 地址: {host or '默认'}")
+        return clients
+
 
 class OllamaAPI:
     def __init__(self, config_manager):
@@ -10,13 +36,35 @@ class OllamaAPI:
         """
         self.config_manager = config_manager
         self.chat_session = None
+        self.last_error = None
+        self.last_stats = None
         self.system_prompt = {"role": "system", "content": "", "input_prompt": "", "output_prompt": ""}
         self.logger = LoggerManager.get_logger()
         
-        # 设置环境变量，尝试禁用 rate limit
-        os.environ['OLLAMA_ORIGINS'] = '*'  # 允许所有来源
-        if config_manager.get_config().get('base_url'):
-            os.environ['OLLAMA_HOST'] = config_manager.get_config().get('base_url')
+        # 按请求大小和机器资源规划 options
+        self.options_planner = OllamaOptionsPlanner()
+        
+        # 模型预热和空闲卸载
+        self.warm_lock = threading.Lock()
+        self.warming_models = set()
+        self.loaded_models = set()
+        self.last_used = time.monotonic()
+        self.idle_timer = None
+
+    @property
+    def host(self):
+        """当前配置的 Ollama 服务地址"""
+        return self.config_manager.get_snapshot().base_url or None
+
+    @property
+    def client(self):
+        """绑定到当前地址的同步客户端，地址变化时才会创建新的客户端"""
+        return get_clients(self.host)[0]
+
+    @property
+    def async_client(self):
+        """绑定到当前地址的异步客户端"""
+        return get_clients(self.host)[1]
 
     def set_chat_session(self, model: str = None, system_prompt: dict = None, keep_history: bool = True):
         """
@@ -26,29 +74,14 @@ class OllamaAPI:
         :param keep_history: 是否保持历史记录
         """
         try:
-            config = self.config_manager.get_config()
-            model = model or config.get('model', 'llama2')
-            language = config.get('language', 'chinese')
+            config = self.config_manager.get_snapshot()
+            model = model or config.model or 'llama2'
+            language = config.language
             
-            # 更新系统提示词
+            # 更新系统提示词，语言要求在构建消息时统一追加
             if system_prompt:
                 self.system_prompt = system_prompt
-                
-                # 添加语言设置到提示词中
-                language_prompt = ""
-                if language == 'chinese':
-                    language_prompt = "请用中文回复，保持简洁明了的表达。"
-                elif language == 'english':
-                    language_prompt = "Please reply in English, keep your response concise and clear."
-                else:
-                    language_prompt = f"Please reply in {language}, keep your response concise and clear."
-                
-                # 将语言设置添加到输出提示词的开头
-                if self.system_prompt.get("output_prompt"):
-                    self.system_prompt["output_prompt"] = language_prompt + "\n" + self.system_prompt["output_prompt"]
-                else:
-                    self.system_prompt["output_prompt"] = language_prompt
-            
+
             # 如果会话不存在或模型变更，创建新会话
             if not self.chat_session or self.chat_session.model != model:
                 self.logger.info(f"创建新的聊天会话 - 模型: {model}, 语言: {language}")
@@ -56,89 +89,390 @@ class OllamaAPI:
                     model=model,
                     keep_history=keep_history,
                     input_prompt=self.system_prompt.get("input_prompt", ""),
-                    output_prompt=self.system_prompt.get("output_prompt", "")
+                    output_prompt=self.system_prompt.get("output_prompt", ""),
+                    context_budget=config.get('context_budget') or None,
+                    client=self.client,
+                    language=language
                 )
             else:
                 self.logger.info(f"更新系统提示词 - 语言: {language}")
                 self.chat_session.input_prompt = self.system_prompt.get("input_prompt", "")
                 self.chat_session.output_prompt = self.system_prompt.get("output_prompt", "")
+                self.chat_session.language = language
+            
+            # 服务地址可能已变化，会话始终使用当前地址的客户端
+            self.chat_session.client = self.client
             
             # 仅在不保持历史记录时清空
+            self.chat_session.keep_history = keep_history
             if not keep_history and self.chat_session:
-                self.chat_session.history = []
+                self.chat_session.clear_history()
+            
+            # 模型或角色变化后在后台预热，第一次请求不再等待模型加载
+            self.warm_up(model)
+            
+            return self.chat_session
                 
         except Exception as e:
             self.logger.error(f"设置聊天会话失败: {e}")
             raise e
 
-    def chat(self, user_input: str, options: dict = None) -> str:
+    @property
+    def keep_alive(self):
+        """使用期间模型在 Ollama 中保持加载的时间"""
+        return self.config_manager.get_snapshot().get('ollama_keep_alive', '30m')
+
+    @property
+    def idle_unload_seconds(self):
+        """空闲多久后主动卸载模型，0 表示不主动卸载"""
+        return float(self.config_manager.get_snapshot().get('ollama_idle_unload', 1800))
+
+    def warm_up(self, model: str = None):
         """
-        发送聊天消息并获取回复
+        在后台线程中加载模型
+        :param model: 模型名称，默认为当前会话的模型
+        """
+        model = model or (self.chat_session.model if self.chat_session else None)
+        if not model:
+            return
+        with self.warm_lock:
+            if model in self.warming_models:
+                return
+            self.warming_models.add(model)
+        threading.Thread(target=self._warm_up, args=(model,), name="OllamaWarmUp", daemon=True).start()
+
+    def _warm_up(self, model: str):
+        """发送空提示词让 Ollama 加载模型"""
+        start_time = time.perf_counter()
+        try:
+            response = self.client.generate(
+                model=model,
+                prompt='',
+                options=self.options_planner.baseline_options(model),
+                keep_alive=self.keep_alive
+            )
+            load_duration = (response.get('load_duration') or 0) / 1e9
+            with self.warm_lock:
+                self.loaded_models.add(model)
+            self.logger.info(f"模型预热完成 - 模型: {model}, 加载耗时: {load_duration:.2f}s, 总耗时: {time.perf_counter() - start_time:.2f}s")
+            self.touch()
+        except Exception as e:
+            self.logger.warning(f"模型预热失败 - 模型: {model}, {e}")
+        finally:
+            with self.warm_lock:
+                self.warming_models.discard(model)
+
+    def touch(self):
+        """记录一次使用，重新计时空闲卸载"""
+        self.last_used = time.monotonic()
+        idle_seconds = self.idle_unload_seconds
+        with self.warm_lock:
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+            if idle_seconds > 0:
+                self.idle_timer = threading.Timer(idle_seconds, self.unload_idle_models)
+                self.idle_timer.daemon = True
+                self.idle_timer.start()
+
+    def unload_idle_models(self):
+        """长时间空闲后卸载模型，释放内存"""
+        with self.warm_lock:
+            models = list(self.loaded_models)
+            self.loaded_models.clear()
+            self.idle_timer = None
+        for model in models:
+            try:
+                self.client.generate(model=model, prompt='', keep_alive=0)
+                self.logger.info(f"空闲超过 {self.idle_unload_seconds:.0f}s，已卸载模型: {model}")
+            except Exception as e:
+                self.logger.warning(f"卸载模型失败 - 模型: {model}, {e}")
+
+    def log_load_status(self, model: str, response):
+        """记录本次请求的模型加载耗时和冷热状态"""
+        try:
+            load_duration = (response.get('load_duration') or 0) / 1e9
+        except Exception:
+            return
+        # 已加载的模型 load_duration 只有几毫秒
+        status = '冷启动' if load_duration > 0.5 else '已预热'
+        with self.warm_lock:
+            self.loaded_models.add(model)
+        self.logger.info(f"模型状态 - 模型: {model}, {status}, 加载耗时: {load_duration:.2f}s")
+
+    def prepare_chat(self, user_input: str, options: dict = None):
+        """
+        按当前角色准备请求
         :param user_input: 用户输入的消息
-        :param options: 参数字典，包含temperature和num_predict等参数
-        :return: AI的回复文本
+        :param options: 额外的参数，覆盖按角色和请求大小规划出的参数
+        :return: (模型名称, 消息列表, options)
         """
         if not self.chat_session:
             error_msg = "聊天会话未初始化"
             self.logger.error(error_msg)
             raise Exception(error_msg)
-            
+
         # 获取当前角色的参数
-        config = self.config_manager.get_config()
-        current_role = config.get('current_role', '通用助手')
-        roles = config.get('roles', [])
-        
+        config = self.config_manager.get_snapshot()
+        current_role = config.current_role
+
         # 查找当前角色的配置
-        role = next((r for r in roles if r['name'] == current_role), None)
+        role = config.get_role(current_role)
         if not role:
             self.logger.warning(f"未找到角色 {current_role} 的配置，使用默认配置")
-            role = next((r for r in roles if r['name'] == '通用助手'), {})
-            
+            role = config.get_role('通用助手')
+
         # 使用角色特定的参数，如果没有则使用默认值
-        temperature = role.get('temperature', config.get('temperature', 0.7))
-        max_tokens = role.get('max_tokens', config.get('max_tokens', 150))
-            
+        temperature = role.temperature if role else config.temperature
+        max_tokens = role.max_tokens if role else config.text_complete_number
+
         self.logger.info(f"发送聊天请求 - 角色: {current_role}, temperature: {temperature}, max_tokens: {max_tokens}")
-        
+
+        # 确保当前会话使用正确的角色提示词
+        if role:
+            self.chat_session.input_prompt = role.input_prompt
+            self.chat_session.output_prompt = role.output_prompt
+        self.chat_session.language = config.language
+
+        model = self.chat_session.model
+
+        # 通过会话构建消息，包含系统提示词和按模型上下文长度截取的历史记录
+        messages = self.chat_session.build_messages(
+            user_input,
+            reserve_tokens=int(max_tokens),
+            budget=self.options_planner.get_max_ctx(model)
+        )
+
+        # 按实际的提示词大小和输出预算规划参数，调用方提供的options优先
+        planned = self.options_planner.plan(model, self.chat_session.last_prompt_tokens, max_tokens, temperature)
+        options = dict(planned, **(options or {}))
+        self.logger.info(f"本次请求上下文约 {self.chat_session.last_prompt_tokens} tokens，消息数: {len(messages)}, 参数: {options}")
+        LoggerManager.log_payload(f"当前对话记录 - 模型: {model}", messages)
+        return model, messages, options
+
+    def error_reply(self, e: Exception) -> str:
+        """记录错误并转换为给用户看的提示，调用方据此判断返回的是错误提示而不是回复"""
+        self.last_error = e
+        error_msg = str(e).lower()
+        if "no such file or directory" in error_msg:
+            return "模型文件未找到。请确保已下载并安装所需的模型。\n\n解决方法：\n1. 运行 'ollama pull 模型名称' 下载模型\n2. 检查模型名称是否正确\n3. 确认模型文件存储位置是否正确"
+        elif "connection refused" in error_msg or "failed to connect" in error_msg:
+            return f"无法连接到Ollama服务（{self.host or 'http://localhost:11434'}）。\n\n可能的原因：\n1. Ollama服务未启动\n2. 服务端口被占用\n3. 服务异常退出\n\n解决方法：\n1. 重启Ollama服务\n2. 检查端口11434是否可用\n3. 查看Ollama服务日志"
+        elif "out of memory" in error_msg or "resource exhausted" in error_msg or "resource_exhausted" in error_msg:
+            return "系统资源不足。\n\n可能的原因：\n1. 内存不足\n2. GPU显存不足\n\n解决方法：\n1. 关闭其他占用资源的程序\n2. 调小模型参数（如context length）\n3. 使用资源需求较少的模型\n4. 如果使用GPU，尝试切换到CPU模式"
+        else:
+            self.logger.error(f"聊天请求失败: {e}")
+            return f"请求失败: {str(e)}\n\n建议：\n1. 检查系统资源使用情况\n2. 查看日志获取详细错误信息\n3. 重启应用后重试"
+
+    def chat(self, user_input: str, options: dict = None, cancel_token=None) -> str:
+        """
+        发送聊天消息并获取回复
+        :param user_input: 用户输入的消息
+        :param options: 额外的参数，覆盖按角色和请求大小规划出的参数
+        :param cancel_token: 取消令牌，提供时以流式方式请求，每个数据块之间检查是否已取消
+        :return: AI的回复文本
+        """
+        self.last_error = None
         try:
-            # 如果没有提供options，使用角色配置的参数
-            if options is None:
-                options = {
-                    "num_predict": int(max_tokens),  # 使用 max_tokens 作为输出长度限制
-                    "mirostat": 0,
-                    "mirostat_eta": float(temperature)
-                }
-            
-            # 确保当前会话使用正确的角色提示词
-            if role:
-                self.chat_session.input_prompt = role.get('input_prompt', '')
-                self.chat_session.output_prompt = role.get('output_prompt', '')
-            
+            build_start = time.perf_counter()
+            model, messages, options = self.prepare_chat(user_input, options)
+            build_time = time.perf_counter() - build_start
+
             try:
-                response = ollama.chat(
-                    model=self.chat_session.model,
-                    messages=[{"role": "user", "content": user_input}],
-                    options=options
-                )
-                return response['message']['content']
-                
+                reply_text = self.send(model, messages, options, cancel_token)
+                self.last_stats["build"] = build_time
+                self.chat_session.commit(user_input, reply_text)
+                self.chat_session.remember_reply(messages, reply_text, options)
+                return reply_text
+
+            except RequestCancelled:
+                raise
             except Exception as e:
-                error_msg = str(e).lower()
-                if "no such file or directory" in error_msg:
-                    return "模型文件未找到。请确保已下载并安装所需的模型。\n\n解决方法：\n1. 运行 'ollama pull 模型名称' 下载模型\n2. 检查模型名称是否正确\n3. 确认模型文件存储位置是否正确"
-                elif "connection refused" in error_msg:
-                    return "无法连接到Ollama服务。\n\n可能的原因：\n1. Ollama服务未启动\n2. 服务端口被占用\n3. 服务异常退出\n\n解决方法：\n1. 重启Ollama服务\n2. 检查端口11434是否可用\n3. 查看Ollama服务日志"
-                elif "out of memory" in error_msg or "resource exhausted" in error_msg or "resource_exhausted" in error_msg:
-                    return "系统资源不足。\n\n可能的原因：\n1. 内存不足\n2. GPU显存不足\n\n解决方法：\n1. 关闭其他占用资源的程序\n2. 调小模型参数（如context length）\n3. 使用资源需求较少的模型\n4. 如果使用GPU，尝试切换到CPU模式"
-                else:
-                    self.logger.error(f"聊天请求失败: {e}")
-                    return f"请求失败: {str(e)}\n\n建议：\n1. 检查系统资源使用情况\n2. 查看日志获取详细错误信息\n3. 重启应用后重试"
-            
+                return self.error_reply(e)
+
+        except RequestCancelled:
+            raise
         except Exception as e:
             error_msg = f"文本补全失败: {str(e)}"
             self.logger.error(error_msg)
             raise Exception(error_msg)
 
+    def send(self, model: str, messages: list, options: dict, cancel_token=None) -> str:
+        """
+        发送消息列表并返回回复文本
+        :param cancel_token: 取消令牌，提供时以流式方式请求，每个数据块之间检查是否已取消
+        """
+        client = self.client
+        start_time = time.perf_counter()
+        first_token_time = None
+        if cancel_token is None:
+            response = client.chat(
+                model=model,
+                messages=messages,
+                options=options,
+                keep_alive=self.keep_alive
+            )
+            reply_text = response['message']['content']
+            self.log_load_status(model, response)
+        else:
+            parts = []
+            stream = client.chat(
+                model=model,
+                messages=messages,
+                options=options,
+                keep_alive=self.keep_alive,
+                stream=True
+            )
+            try:
+                for chunk in stream:
+                    cancel_token.raise_if_cancelled()
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    parts.append(chunk['message']['content'])
+                    if chunk.get('done'):
+                        self.log_load_status(model, chunk)
+            finally:
+                stream.close()
+            reply_text = ''.join(parts)
+
+        end_time = time.perf_counter()
+        self.last_stats = {
+            "ttft": (first_token_time or end_time) - start_time,
+            "total_time": end_time - start_time
+        }
+        self.touch()
+        return reply_text
+
+    def stream_chat(self, session, user_input: str, temperature: float = 0.7, max_tokens: int = 2000,
+                    options: dict = None, cancel_token=None):
+        """
+        以流式方式向指定会话发送消息，逐块产出回复文本
+        不读写 self.chat_session 和 self.last_stats，可以在多个线程中对不同会话同时调用，
+        供 IPC、批处理等热键以外的调用方使用；回复完整结束后才写入会话的历史记录
+        :param session: ChatSession
+        :param options: 额外的参数，覆盖规划的参数
+        :param cancel_token: 取消令牌
+        """
+        model = session.model
+        session.client = self.client
+        messages = session.build_messages(
+            user_input,
+            reserve_tokens=int(max_tokens),
+            budget=self.options_planner.get_max_ctx(model)
+        )
+        planned = self.options_planner.plan(model, session.last_prompt_tokens, max_tokens, temperature)
+        options = dict(planned, **(options or {}))
+        LoggerManager.log_payload(f"当前对话记录 - 模型: {model}", messages)
+
+        start_time = time.perf_counter()
+        first_token_time = None
+        completion_tokens = None
+        parts = []
+        stream = session.client.chat(
+            model=model,
+            messages=messages,
+            options=options,
+            keep_alive=self.keep_alive,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                content = chunk['message']['content']
+                if content:
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    parts.append(content)
+                    yield content
+                if chunk.get('done'):
+                    completion_tokens = chunk.get('eval_count')
+                    self.log_load_status(model, chunk)
+        finally:
+            stream.close()
+
+        end_time = time.perf_counter()
+        reply_text = ''.join(parts)
+        session.last_stats = {
+            "ttft": (first_token_time or end_time) - start_time,
+            "total_time": end_time - start_time,
+            "completion_tokens": completion_tokens
+        }
+        session.commit(user_input, reply_text)
+        session.remember_reply(messages, reply_text, options)
+        self.touch()
+
+    def can_continue(self) -> bool:
+        """是否有可以继续生成的上一次回复"""
+        return bool(self.chat_session and self.chat_session.last_messages and self.chat_session.last_reply)
+
+    def continue_chat(self, options: dict = None, cancel_token=None) -> str:
+        """
+        继续生成上一次的回复
+        把上一次的请求原样发送，并把已生成的回复作为最后一条 assistant 消息预填，模型从回复末尾接着写。
+        提示词前缀与上一次完全一致，Ollama 可以复用已缓存的 KV，不需要重新处理整个提示词
+        :param options: 额外的参数，覆盖沿用的参数
+        :param cancel_token: 取消令牌
+        :return: 新生成的部分
+        """
+        self.last_error = None
+        session = self.chat_session
+        if not self.can_continue():
+            error_msg = "没有上一次的回复可以继续"
+            self.logger.error(error_msg)
+            raise Exception(error_msg)
+
+        model = session.model
+        messages = session.build_continue_messages()
+        last_options = session.last_options or {}
+
+        # 沿用上一次的输出长度和温度，num_ctx 按加上已生成内容后的长度重新规划
+        prompt_tokens = sum(estimate_message_tokens(message) for message in messages)
+        planned = self.options_planner.plan(
+            model,
+            prompt_tokens,
+            last_options.get('num_predict', 0),
+            last_options.get('temperature', 0.7)
+        )
+        options = dict(planned, **(options or {}))
+        self.logger.info(f"继续生成 - 模型: {model}, 上下文约 {prompt_tokens} tokens, 已生成 {len(session.last_reply)} 字符")
+
+        try:
+            continuation = self.send(model, messages, options, cancel_token)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            return self.error_reply(e)
+
+        session.extend_reply(continuation)
+        return continuation
+
+    async def achat(self, user_input: str, options: dict = None) -> str:
+        """
+        使用异步客户端发送聊天消息，供需要同时发出多个请求的场景使用
+        :param user_input: 用户输入的消息
+        :param options: 额外的参数，覆盖按角色和请求大小规划出的参数
+        :return: AI的回复文本
+        """
+        self.last_error = None
+        model, messages, options = self.prepare_chat(user_input, options)
+        try:
+            response = await self.async_client.chat(
+                model=model,
+                messages=messages,
+                options=options,
+                keep_alive=self.keep_alive
+            )
+            reply_text = response['message']['content']
+            self.log_load_status(model, response)
+        except Exception as e:
+            return self.error_reply(e)
+
+        self.touch()
+        self.chat_session.commit(user_input, reply_text)
+        self.chat_session.remember_reply(messages, reply_text, options)
+        return reply_text
+
     def clean_response(self, text):
         """清理API响应文本"""
         if not text:
@@ -168,21 +502,95 @@ class OllamaAPI:
         return text
 
 class ChatSession:
-    def __init__(self, model: str, keep_history: bool = True, input_prompt: str = None, output_prompt: str = None):
+    def __init__(self, model: str, keep_history: bool = True, input_prompt: str = None, output_prompt: str = None,
+                 context_budget: int = None, client=None, language: str = None):
         """
         初始化聊天会话
         :param model: 模型名称
         :param keep_history: 是否保持历史记录
         :param input_prompt: 输入提示词
         :param output_prompt: 输出提示词
+        :param context_budget: 上下文 token 预算，为空时按模型的上下文长度
+        :param client: ollama.Client 实例，为空时使用默认地址的客户端
+        :param language: 回复语言，追加在系统提示词末尾
         """
         self.model = model
+        self.client = client
         self.keep_history = keep_history
-        self.history = []
+        self.history = HistoryWindow(model=model, context_budget=context_budget)
         self.input_prompt = input_prompt
         self.output_prompt = output_prompt
+        self.language = language
+        self.last_prompt_tokens = 0
+        # 最近一次请求的消息、回复和参数，继续生成时作为前缀
+        self.last_messages = None
+        self.last_reply = ''
+        self.last_options = None
+        self.last_stats = None
         self.logger = LoggerManager.get_logger()
-        
+
+    @property
+    def message_history(self):
+        """全部历史消息"""
+        return self.history.messages
+
+    def add_to_history(self, message):
+        """添加消息到历史记录"""
+        if self.keep_history:
+            self.history.append(message)
+
+    def clear_history(self):
+        """清空历史记录"""
+        self.history.clear()
+        self.last_messages = None
+        self.last_reply = ''
+        self.last_options = None
+
+    def build_messages(self, user_input: str, reserve_tokens: int = 0, budget: int = None) -> list:
+        """
+        构建本次请求的消息列表
+        系统提示词与 OpenAI 兼容接口使用同样的编译结果，始终保留；历史记录按 token 预算从最早的轮次开始截取
+        :param user_input: 用户输入的消息
+        :param reserve_tokens: 为回复预留的 token 数
+        :param budget: 上下文 token 预算（通常为 num_ctx）
+        """
+        system_messages = []
+        system_content = compile_system_prompt(self.input_prompt, self.output_prompt, self.language)
+        if system_content:
+            system_messages.append({"role": "system", "content": system_content})
+        user_message = {"role": "user", "content": user_input}
+
+        history = self.history.select(system_messages + [user_message], reserve_tokens=reserve_tokens, budget=budget)
+        if not self.keep_history:
+            history = []
+        elif self.history.last_dropped_messages:
+            self.logger.info(f"历史记录超出预算，丢弃最早的 {self.history.last_dropped_messages} 条消息")
+        self.last_prompt_tokens = self.history.last_sent_tokens
+        return system_messages + history + [user_message]
+
+    def commit(self, user_input: str, reply_text: str):
+        """请求成功后把本轮对话写入历史记录"""
+        self.add_to_history({"role": "user", "content": user_input})
+        self.add_to_history({"role": "assistant", "content": reply_text})
+
+    def remember_reply(self, messages: list, reply_text: str, options: dict = None):
+        """记录最近一次请求的消息和回复，供继续生成使用"""
+        self.last_messages = list(messages)
+        self.last_reply = reply_text
+        self.last_options = options
+
+    def build_continue_messages(self) -> list:
+        """上一次的消息加上预填的 assistant 回复"""
+        return self.last_messages + [{"role": "assistant", "content": self.last_reply}]
+
+    def extend_reply(self, continuation: str):
+        """把继续生成的内容接到上一次的回复后面，历史记录中的回复一并更新"""
+        self.last_reply += continuation
+        if self.keep_history and self.history:
+            last_message = self.history.messages[-1]
+            if last_message.get('role') == 'assistant':
+                self.history.replace_last({"role": "assistant", "content": self.last_reply})
+
     def chat(self, user_input: str, options: dict = None) -> str:
         """
         发送消息并获取回复
@@ -191,18 +599,12 @@ class ChatSession:
         :return: AI的回复文本
         """
         try:
-            # 添加用户消息到历史记录
-            messages = []
-            if self.keep_history:
-                messages.extend(self.history)
-            messages.append({"role": "user", "content": user_input})
-            
-            # 如果是新对话，添加系统提示词
-            if not self.history:
-                if self.input_prompt:
-                    messages.insert(0, {"role": "system", "content": self.input_prompt})
-                if self.output_prompt:
-                    messages.insert(1, {"role": "system", "content": self.output_prompt})
+            options = options or {}
+            messages = self.build_messages(
+                user_input,
+                reserve_tokens=int(options.get('num_predict', 0) or 0),
+                budget=options.get('num_ctx')
+            )
             
             try:
                 # 准备参数
@@ -215,8 +617,9 @@ class ChatSession:
                 if options:
                     params["options"] = options
                 
-                self.logger.info(f"发送请求 - 模型: {self.model}, 参数: {params}")
-                response = ollama.chat(**params)
+                self.logger.info(f"发送请求 - 模型: {self.model}, 消息数: {len(messages)}, 上下文约 {self.last_prompt_tokens} tokens, 参数: {options}")
+                LoggerManager.log_payload(f"当前对话记录 - 模型: {self.model}", messages)
+                response = (self.client or get_clients()[0]).chat(**params)
                 
             except Exception as e:
                 error_str = str(e).lower()
@@ -226,11 +629,12 @@ class ChatSession:
                     self.logger.warning(f"模型未找到，尝试使用基础模型: {base_model}")
                     
                     params["model"] = base_model
-                    response = ollama.chat(**params)
+                    response = (self.client or get_clients()[0]).chat(**params)
                 else:
                     # 记录详细的错误信息
                     self.logger.error(f"Ollama API 错误: {str(e)}")
-                    self.logger.error(f"请求参数: {params}")
+                    self.logger.error(f"请求参数 - 模型: {params['model']}, 消息数: {len(messages)}, 参数: {options}")
+                    LoggerManager.log_payload("失败请求的消息", messages)
                     raise Exception(f"Ollama API 错误: {str(e)}")
 
             # 获取回复文本并确保是 UTF-8 编码
@@ -243,9 +647,8 @@ class ChatSession:
                 reply_text = ''.join(char for char in reply_text if ord(char) < 128)
                 self.logger.warning("回复包含无法编码的字符，已清理")
             
-            # 如果保持历史记录，添加回复到历史
-            if self.keep_history:
-                self.history.append({"role": "assistant", "content": reply_text})
+            # 如果保持历史记录，添加本轮对话到历史
+            self.commit(user_input, reply_text)
             
             return reply_text
             
@@ -0,0 +1,143 @@
+import ctypes
+import os
+import sys
+import threading
+from logger_manager import LoggerManager
+from history_manager import get_context_window
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# num_ctx 取值按 2 的幂分档，便于 Ollama 复用 KV 缓存的内存分配
+CONTEXT_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+def detect_physical_cores():
+    """检测物理核心数，Ollama 的 num_thread 按物理核心设置效果最好"""
+    if psutil is not None:
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    # 没有 psutil 时按每个物理核心两个逻辑线程估算
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def detect_available_memory():
+    """检测可用内存（字节），无法检测时返回 None"""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+
+    if sys.platform == 'win32':
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ('dwLength', ctypes.c_ulong),
+                ('dwMemoryLoad', ctypes.c_ulong),
+                ('ullTotalPhys', ctypes.c_ulonglong),
+                ('ullAvailPhys', ctypes.c_ulonglong),
+                ('ullTotalPageFile', ctypes.c_ulonglong),
+                ('ullAvailPageFile', ctypes.c_ulonglong),
+                ('ullTotalVirtual', ctypes.c_ulonglong),
+                ('ullAvailVirtual', ctypes.c_ulonglong),
+                ('sullAvailExtendedVirtual', ctypes.c_ulonglong),
+            ]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class OllamaOptionsPlanner:
+    """
+    根据请求大小和机器资源规划 Ollama 的 options
+    num_ctx 按提示词和历史记录的 token 估算加上输出预算分档，num_predict 取角色的输出长度，
+    num_thread / num_batch 按 CPU 核心数和可用内存确定。
+    num_ctx、num_thread、num_batch 变化都会让 Ollama 重新加载模型，
+    因此资源参数只在启动时检测一次，num_ctx 只在放不下时才增大
+    """
+
+    def __init__(self, min_ctx=CONTEXT_BUCKETS[0], max_ctx=None):
+        """
+        :param min_ctx: num_ctx 下限
+        :param max_ctx: num_ctx 上限，为空时使用模型的上下文长度
+        """
+        self.min_ctx = min_ctx
+        self.max_ctx = max_ctx
+        self.logger = LoggerManager.get_logger()
+        self.current_ctx = {}
+        # 热键、本地补全接口、分段和多角色请求会在不同线程中同时规划参数
+        self.lock = threading.Lock()
+
+        self.num_thread = detect_physical_cores()
+        available_memory = detect_available_memory()
+        gigabyte = 1024 ** 3
+        if available_memory is None or available_memory >= 8 * gigabyte:
+            self.num_batch = 512
+        elif available_memory >= 4 * gigabyte:
+            self.num_batch = 256
+        else:
+            self.num_batch = 128
+        memory_text = f"{available_memory / gigabyte:.1f}GB" if available_memory else "未知"
+        self.logger.info(f"Ollama 资源参数 - num_thread: {self.num_thread}, num_batch: {self.num_batch}, 可用内存: {memory_text}")
+
+    def get_max_ctx(self, model):
+        return self.max_ctx or get_context_window(model)
+
+    def bucket(self, tokens, model):
+        """把 token 数向上取整到分档，并限制在模型的上下文长度内"""
+        max_ctx = self.get_max_ctx(model)
+        for size in CONTEXT_BUCKETS:
+            if size >= tokens and size >= self.min_ctx:
+                return min(size, max_ctx)
+        return max_ctx
+
+    def baseline_options(self, model):
+        """预热时使用的参数，与随后请求的参数一致，避免第一次请求重新加载模型"""
+        with self.lock:
+            num_ctx = self.current_ctx.get(model)
+        return {
+            "num_ctx": num_ctx if num_ctx is not None else self.bucket(self.min_ctx, model),
+            "num_thread": self.num_thread,
+            "num_batch": self.num_batch
+        }
+
+    def plan(self, model, prompt_tokens, max_tokens, temperature):
+        """
+        规划本次请求的参数
+        :param model: 模型名称
+        :param prompt_tokens: 系统提示词、历史记录和用户消息的 token 估算
+        :param max_tokens: 角色的输出长度
+        :param temperature: 角色的温度
+        """
+        needed = int(prompt_tokens) + int(max_tokens)
+        num_ctx = self.bucket(needed, model)
+
+        # 当前的 num_ctx 已经放得下时继续使用，避免来回切换导致重新加载模型；
+        # 读取和更新在同一把锁内完成，并发请求不会基于过期的值互相覆盖
+        with self.lock:
+            current = self.current_ctx.get(model)
+            if current is not None and needed <= current <= num_ctx * 4:
+                num_ctx = current
+            self.current_ctx[model] = num_ctx
+        if current != num_ctx:
+            self.logger.info(f"调整 num_ctx - 模型: {model}, {current} -> {num_ctx}, 需要约 {needed} tokens")
+
+        return {
+            "num_ctx": num_ctx,
+            "num_predict": int(max_tokens),
+            "temperature": float(temperature),
+            "num_thread": self.num_thread,
+            "num_batch": self.num_batch
+        }
@@ -1,31 +1,24 @@
 from openai import OpenAI
 import httpx
-import winreg
+from proxy_resolver import get_resolver
+from history_manager import HistoryWindow
+from logger_manager import LoggerManager
 
 def get_proxy():
-    """获取Windows系统代理设置"""
-    try:
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Internet Settings") as key:
-            proxy_enable, _ = winreg.QueryValueEx(key, "ProxyEnable")
-            proxy_server, _ = winreg.QueryValueEx(key, "ProxyServer")
-            
-            if proxy_enable and proxy_server:
-                return {
-                    "http://": f"http://{proxy_server}",
-                    "https://": f"http://{proxy_server}"
-                }
-    except WindowsError:
-        pass
-    return None
+    """获取系统代理设置，结果由全局代理解析器缓存"""
+    return get_resolver().get_httpx_proxies()
 
 class ChatSession:
-    def __init__(self, api_key: str, base_url: str, model: str, system_prompt: dict):
+    def __init__(self, api_key: str, base_url: str, model: str, system_prompt: dict,
+                 keep_history: bool = True, context_budget: int = None):
         """
         初始化聊天会话
         :param api_key: OpenAI API密钥
         :param base_url: API基础URL
         :param model: 使用的模型
         :param system_prompt: 系统提示词，格式为{"role": "system", "content": "xxx"}
+        :param keep_history: 是否保持历史记录
+        :param context_budget: 上下文 token 预算，为空时按模型的上下文长度
         """
         http_client = httpx.Client(
             proxies=get_proxy(),
@@ -46,15 +39,23 @@ class ChatSession:
             http_client=http_client
         )
         
-        self.messages_history = []
+        self.keep_history = keep_history
+        self.history = HistoryWindow(model=model, context_budget=context_budget)
+        self.last_prompt_tokens = 0
+
+    @property
+    def messages_history(self):
+        """全部历史消息"""
+        return self.history.messages
 
     def add_to_history(self, message):
         """添加消息到历史记录"""
-        self.messages_history.append(message)
+        if self.keep_history:
+            self.history.append(message)
 
     def clear_history(self):  
         """清空历史记录"""      
-        self.messages_history = []
+        self.history.clear()
 
     def chat(self, user_input: str, temperature: float = 0.7, max_tokens: int = 2000) -> str:
         """
@@ -65,14 +66,12 @@ class ChatSession:
         :return: AI的回复文本
         """
         try:
-            messages = [self.system_prompt] + self.messages_history + [{"role": "user", "content": user_input}]
+            user_message = {"role": "user", "content": user_input}
+            history = self.history.select([self.system_prompt, user_message], reserve_tokens=max_tokens)
+            self.last_prompt_tokens = self.history.last_sent_tokens
+            messages = [self.system_prompt] + history + [user_message]
 
-            print("\n=== 当前对话记录 ===")
-            if not self.messages_history:
-                print("新对话 或者 未开启记住历史对话")
-            for i, msg in enumerate(messages, 1):
-                print(f"{i}. {msg['role']}: {msg['content']}")
-            print("==================\n")
+            LoggerManager.log_payload(f"当前对话记录 - 模型: {self.model}", messages)
             
             response = self.client.chat.completions.create(
                 model=self.model,
@@ -0,0 +1,118 @@
+import threading
+from functools import lru_cache
+from logger_manager import LoggerManager
+
+# 各语言的回复要求，放在系统提示词末尾
+LANGUAGE_PROMPTS = {
+    'chinese': "请用中文回复，保持简洁明了的表达。",
+    'english': "Please reply in English, keep your response concise and clear."
+}
+
+
+def get_language_prompt(language):
+    """获取语言对应的回复要求"""
+    if not language:
+        return ""
+    return LANGUAGE_PROMPTS.get(language, f"Please reply in {language}, keep your response concise and clear.")
+
+
+@lru_cache(maxsize=64)
+def compile_system_prompt(input_prompt, output_prompt, language):
+    """
+    把角色的输入提示词、输出提示词和语言要求编译为一段固定的系统提示词
+    两种后端使用同样的顺序和分隔符，同一角色每次得到完全相同的文本，便于服务端按前缀缓存
+    """
+    parts = [
+        (input_prompt or "").strip(),
+        (output_prompt or "").strip(),
+        get_language_prompt(language)
+    ]
+    return "\n\n".join(part for part in parts if part)
+
+
+def compile_role_prompt(role, language):
+    """
+    编译角色的系统提示词，没有角色时只包含语言要求
+    :param role: RoleConfig 或包含 input_prompt / output_prompt 的字典，可以为空
+    :param language: 回复语言
+    """
+    if not role:
+        return compile_system_prompt('', '', language)
+    return compile_system_prompt(role.get('input_prompt', ''), role.get('output_prompt', ''), language)
+
+
+def build_system_message(role, language):
+    """
+    构建角色的系统消息
+    :param role: RoleConfig 或包含 input_prompt / output_prompt 的字典，可以为空
+    :param language: 回复语言
+    """
+    return {"role": "system", "content": compile_role_prompt(role, language)}
+
+
+def parse_usage(usage):
+    """
+    解析 OpenAI 兼容接口返回的 usage
+    命中前缀缓存的 token 数在 prompt_tokens_details.cached_tokens 中，DeepSeek 使用 prompt_cache_hit_tokens
+    """
+    usage = usage or {}
+    details = usage.get('prompt_tokens_details') or {}
+    cached_tokens = details.get('cached_tokens')
+    if cached_tokens is None:
+        cached_tokens = usage.get('prompt_cache_hit_tokens', 0)
+    return {
+        "prompt_tokens": usage.get('prompt_tokens', 0) or 0,
+        "completion_tokens": usage.get('completion_tokens', 0) or 0,
+        "cached_tokens": cached_tokens or 0
+    }
+
+
+class PromptCacheStats:
+    """按角色统计服务端前缀缓存命中的提示词 token 比例"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.roles = {}
+        self.logger = LoggerManager.get_logger()
+
+    def record(self, role, usage):
+        """
+        记录一次请求的 usage
+        :param role: 角色名称
+        :param usage: parse_usage 的结果
+        """
+        role = role or '默认'
+        with self.lock:
+            stats = self.roles.setdefault(role, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            stats["requests"] += 1
+            stats["prompt_tokens"] += usage["prompt_tokens"]
+            stats["cached_tokens"] += usage["cached_tokens"]
+            ratio = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        self.logger.info(
+            f"提示词缓存 - 角色: {role}, 本次命中: {usage['cached_tokens']}/{usage['prompt_tokens']} tokens, "
+            f"累计命中率: {ratio:.1%}"
+        )
+
+    def ratio(self, role):
+        """角色的累计缓存命中率"""
+        with self.lock:
+            stats = self.roles.get(role or '默认')
+            if not stats or not stats["prompt_tokens"]:
+                return 0.0
+            return stats["cached_tokens"] / stats["prompt_tokens"]
+
+    def snapshot(self):
+        """所有角色的统计"""
+        with self.lock:
+            return {
+                role: dict(stats, ratio=stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0)
+                for role, stats in self.roles.items()
+            }
+
+
+_cache_stats = PromptCacheStats()
+
+
+def get_cache_stats():
+    """获取全局的提示词缓存统计"""
+    return _cache_stats
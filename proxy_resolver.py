@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from logger_manager import LoggerManager
+
+try:
+    import winreg
+except ImportError:  # 非 Windows 环境没有注册表
+    winreg = None
+
+
+def normalize_proxy(proxy_server):
+    """
+    规范化代理地址
+    支持 host:port、http://host:port 以及注册表中 http=host:port;https=host:port 的格式
+    """
+    if not proxy_server:
+        return None
+    proxy_server = proxy_server.strip()
+
+    if '=' in proxy_server:
+        entries = dict(
+            item.split('=', 1) for item in proxy_server.split(';') if '=' in item
+        )
+        proxy_server = entries.get('https') or entries.get('http')
+        if not proxy_server:
+            return None
+
+    if '://' not in proxy_server:
+        if len(proxy_server.split(':')) != 2:
+            return None
+        proxy_server = f"http://{proxy_server}"
+    return proxy_server
+
+
+class RegistryProxySource:
+    """从 Windows 注册表读取系统代理设置"""
+
+    name = 'registry'
+
+    def resolve(self):
+        if winreg is None:
+            return None
+        try:
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Internet Settings") as key:
+                proxy_enable, _ = winreg.QueryValueEx(key, "ProxyEnable")
+                proxy_server, _ = winreg.QueryValueEx(key, "ProxyServer")
+
+                if proxy_enable and proxy_server:
+                    return normalize_proxy(proxy_server)
+        except OSError:
+            pass
+        return None
+
+
+class EnvProxySource:
+    """从 HTTPS_PROXY / HTTP_PROXY 环境变量读取代理设置"""
+
+    name = 'env'
+
+    def __init__(self, environ=None):
+        self.environ = os.environ if environ is None else environ
+
+    def resolve(self):
+        for key in ('HTTPS_PROXY', 'https_proxy', 'HTTP_PROXY', 'http_proxy'):
+            proxy = normalize_proxy(self.environ.get(key))
+            if proxy:
+                return proxy
+        return None
+
+
+class StaticProxySource:
+    """使用配置文件中指定的代理地址"""
+
+    name = 'static'
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def resolve(self):
+        return normalize_proxy(self.proxy)
+
+
+class ProxyResolver:
+    """
+    代理解析器
+    按顺序查询各个代理来源，结果缓存 ttl 秒，配置变化时可主动失效
+    """
+
+    def __init__(self, sources=None, ttl=60.0):
+        """
+        :param sources: 代理来源列表，按优先级排列
+        :param ttl: 缓存时间（秒）
+        """
+        self.sources = sources if sources is not None else [RegistryProxySource()]
+        self.ttl = ttl
+        self.logger = LoggerManager.get_logger()
+        self.lock = threading.Lock()
+        self.cached_proxy = None
+        self.expires_at = 0.0
+
+    def resolve(self):
+        """获取当前代理地址，没有代理时返回 None"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.expires_at:
+                return self.cached_proxy
+
+            proxy = None
+            for source in self.sources:
+                try:
+                    proxy = source.resolve()
+                except Exception as e:
+                    self.logger.warning(f"读取代理设置失败 - 来源: {source.name}, {e}")
+                    proxy = None
+                if proxy:
+                    break
+
+            if proxy != self.cached_proxy:
+                self.logger.info(f"代理设置变化: {self.cached_proxy} -> {proxy}")
+            self.cached_proxy = proxy
+            self.expires_at = now + self.ttl
+            return proxy
+
+    def invalidate(self):
+        """使缓存失效，下次请求时重新读取"""
+        with self.lock:
+            self.expires_at = 0.0
+
+    def get_requests_proxies(self):
+        """requests 使用的代理格式"""
+        proxy = self.resolve()
+        return {"http": proxy, "https": proxy}
+
+    def get_httpx_proxies(self):
+        """httpx 使用的代理格式"""
+        proxy = self.resolve()
+        if not proxy:
+            return None
+        return {"http://": proxy, "https://": proxy}
+
+
+_resolver = ProxyResolver()
+
+
+def get_resolver():
+    """获取全局代理解析器"""
+    return _resolver
+
+
+def configure_resolver(config):
+    """
+    根据配置重建代理来源
+    config 中的 proxy 为静态代理地址，proxy_sources 为来源顺序，默认 static、registry、env
+    """
+    sources = []
+    for name in config.get('proxy_sources', ['static', 'registry', 'env']):
+        if name == 'static':
+            if config.get('proxy'):
+                sources.append(StaticProxySource(config.get('proxy')))
+        elif name == 'registry':
+            sources.append(RegistryProxySource())
+        elif name == 'env':
+            sources.append(EnvProxySource())
+    _resolver.sources = sources
+    _resolver.ttl = float(config.get('proxy_cache_ttl', 60.0))
+    _resolver.invalidate()
+    return _resolver
@@ -0,0 +1,215 @@
+import itertools
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logger_manager import LoggerManager
+
+
+class RequestCancelled(Exception):
+    """请求已被用户取消"""
+
+
+class CancelToken:
+    """
+    取消令牌
+    请求过程中把正在读取的响应绑定到令牌上，取消时直接关闭响应，中断阻塞中的网络读取
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._resources = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """取消请求并关闭已绑定的响应"""
+        with self._lock:
+            self._event.set()
+            resources = list(self._resources)
+        for resource in resources:
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+    def bind(self, resource):
+        """绑定需要在取消时关闭的资源，已取消时立即关闭"""
+        with self._lock:
+            self._resources.append(resource)
+            cancelled = self._event.is_set()
+        if cancelled:
+            resource.close()
+            raise RequestCancelled()
+
+    def unbind(self, resource):
+        """解除绑定"""
+        with self._lock:
+            if resource in self._resources:
+                self._resources.remove(resource)
+
+    def wait(self, timeout):
+        """等待最多 timeout 秒，期间被取消时立即返回 True"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled()
+
+
+class RequestContext:
+    """单次请求的上下文，代替在多个请求之间共享的可变字段"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind):
+        """
+        :param kind: 请求类型，例如 complete、continue
+        """
+        self.id = next(RequestContext._ids)
+        self.kind = kind
+        self.cancel_token = CancelToken()
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self.selected_text = None
+        self.role = None
+        self.api_type = None
+        self.response = None
+        self.error = None
+        # 各阶段耗时（秒），按执行顺序记录
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段的耗时，同名阶段多次执行时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """记录已测得的阶段耗时"""
+        if seconds is not None:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    @property
+    def cancelled(self):
+        return self.cancel_token.cancelled
+
+    def cancel(self):
+        self.cancel_token.cancel()
+
+
+class RequestWorker:
+    """
+    后台请求执行器
+    热键回调只负责把请求放入队列并立即返回，剪贴板捕获和网络请求都在工作线程中串行执行。
+    同类请求在排队期间或 coalesce_window 秒内重复触发时会被合并
+    """
+
+    def __init__(self, handlers, coalesce_window=0.3, on_finished=None, cancellable_kinds=None):
+        """
+        :param handlers: 请求类型到处理函数的映射，处理函数接收 RequestContext
+        :param coalesce_window: 同类请求的合并时间窗口（秒）
+        :param on_finished: 请求结束后的回调，接收 RequestContext
+        :param cancellable_kinds: 取消热键可以取消的请求类型，为空时全部可以取消
+        """
+        self.handlers = handlers
+        self.on_finished = on_finished
+        self.coalesce_window = coalesce_window
+        self.cancellable_kinds = frozenset(cancellable_kinds) if cancellable_kinds is not None else None
+        self.logger = LoggerManager.get_logger()
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_submitted = {}
+        self.current = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """启动工作线程"""
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="RequestWorker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止工作线程，取消正在执行的请求"""
+        self.running = False
+        self.cancel_current(all_kinds=True)
+        self.queue.put(None)
+
+    def submit(self, kind, debounce=True):
+        """
+        提交请求，不会阻塞调用线程
+        :param debounce: 是否忽略 coalesce_window 内的重复触发；排队中的同类请求总是合并
+        :return: 新的 RequestContext，被合并时返回 None
+        """
+        now = time.perf_counter()
+        with self.lock:
+            if kind in self.pending:
+                self.logger.info(f"请求已在队列中，合并本次触发 - 类型: {kind}")
+                return None
+            last = self.last_submitted.get(kind)
+            if debounce and last is not None and now - last < self.coalesce_window:
+                self.logger.info(f"重复触发，已忽略 - 类型: {kind}")
+                return None
+            ctx = RequestContext(kind)
+            self.pending[kind] = ctx
+            self.last_submitted[kind] = now
+        self.queue.put(ctx)
+        return ctx
+
+    def cancel_current(self, all_kinds=False):
+        """
+        取消正在执行和排队中的请求
+        :param all_kinds: 为 False 时只取消 cancellable_kinds 中的请求，配置切换等内部任务照常执行
+        """
+        with self.lock:
+            contexts = list(self.pending.values())
+            if self.current is not None:
+                contexts.append(self.current)
+        if not all_kinds and self.cancellable_kinds is not None:
+            contexts = [ctx for ctx in contexts if ctx.kind in self.cancellable_kinds]
+        for ctx in contexts:
+            ctx.cancel()
+        if contexts:
+            self.logger.info(f"已取消请求: {[ctx.id for ctx in contexts]}")
+
+    def _run(self):
+        while self.running:
+            ctx = self.queue.get()
+            if ctx is None:
+                break
+            with self.lock:
+                self.pending.pop(ctx.kind, None)
+                if ctx.cancelled:
+                    continue
+                self.current = ctx
+
+            ctx.started_at = time.perf_counter()
+            ctx.record('queue', ctx.started_at - ctx.submitted_at)
+            try:
+                self.handlers[ctx.kind](ctx)
+            except RequestCancelled:
+                self.logger.info(f"请求已取消 - 编号: {ctx.id}, 类型: {ctx.kind}")
+            except Exception as e:
+                ctx.error = e
+                self.logger.error(f"请求处理失败 - 编号: {ctx.id}, 类型: {ctx.kind}, {e}")
+            finally:
+                ctx.finished_at = time.perf_counter()
+                ctx.record('total', ctx.finished_at - ctx.submitted_at)
+                with self.lock:
+                    self.current = None
+                if self.on_finished is not None:
+                    try:
+                        self.on_finished(ctx)
+                    except Exception as e:
+                        self.logger.error(f"请求结束回调失败: {e}")
@@ -0,0 +1,284 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from logger_manager import LoggerManager
+from request_worker import RequestCancelled
+
+# 这些状态码通常是暂时性的，可以重试
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """后端连续失败，熔断期间直接失败，不再发送请求"""
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 响应头
+    :param value: 秒数或 HTTP 日期
+    :return: 需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """带随机抖动的指数退避重试策略"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, max_retry_after=10.0,
+                 retry_statuses=RETRY_STATUSES):
+        """
+        :param max_attempts: 最多尝试次数（包括第一次）
+        :param base_delay: 第一次重试的基础等待时间（秒）
+        :param max_delay: 单次等待时间上限（秒）
+        :param max_retry_after: Retry-After 超过该值时不再重试，避免一次按键长时间挂起
+        :param retry_statuses: 需要重试的状态码
+        """
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = tuple(retry_statuses)
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建重试策略"""
+        return cls(
+            max_attempts=int(config.get('retry_max_attempts', 3)),
+            base_delay=float(config.get('retry_base_delay', 0.5)),
+            max_delay=float(config.get('retry_max_delay', 8.0)),
+            max_retry_after=float(config.get('retry_max_retry_after', 10.0))
+        )
+
+    def get_delay(self, attempt, retry_after=None):
+        """
+        计算第 attempt 次失败后的等待时间
+        :param attempt: 已失败的次数，从 1 开始
+        :param retry_after: 服务端要求的等待时间（秒）
+        :return: 等待时间，返回 None 表示不应重试
+        """
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after + random.uniform(0, self.base_delay)
+        # full jitter：在 0 到指数上限之间随机，避免多个客户端同时重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    连续失败达到阈值后打开，恢复时间内直接拒绝请求；之后放行一个探测请求，成功则关闭，失败则继续熔断
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, recovery_time=30.0):
+        """
+        :param name: 后端名称，用于日志
+        :param failure_threshold: 连续失败多少次后熔断
+        :param recovery_time: 熔断持续时间（秒）
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+        self.logger = LoggerManager.get_logger()
+
+    def allow(self):
+        """判断是否允许发送请求"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            # 探测请求被取消等情况下没有结果时，过了恢复时间再放行一个探测请求
+            now = time.monotonic()
+            if now - self.opened_at >= self.recovery_time:
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                self.logger.info(f"熔断恢复期结束，发送探测请求 - 后端: {self.name}")
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.logger.info(f"后端已恢复 - {self.name}")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.logger.warning(f"后端连续失败 {self.failures} 次，熔断 {self.recovery_time:.0f}s - {self.name}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    @property
+    def retry_in(self):
+        """距离下一次探测还需等待的时间（秒）"""
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_time - (time.monotonic() - self.opened_at))
+
+
+class RateLimiter:
+    """令牌桶限流，平均每秒最多放行 rate 个请求，允许 burst 个请求的突发"""
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: 每秒请求数，0 表示不限制
+        :param burst: 令牌桶容量
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cancel_token=None):
+        """等待直到可以发送请求"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if cancel_token is not None:
+                if cancel_token.wait(wait):
+                    raise RequestCancelled()
+            else:
+                time.sleep(wait)
+
+
+_breakers = {}
+_limiters = {}
+_lock = threading.Lock()
+_settings = {
+    "policy": RetryPolicy(),
+    "failure_threshold": 5,
+    "recovery_time": 30.0
+}
+
+
+def get_breaker(base_url, model):
+    """获取后端的熔断器，按 origin 和模型区分，以便熔断时降级到同一服务上的其他模型"""
+    parts = urlsplit(base_url)
+    key = f"{parts.scheme}://{parts.netloc}|{model}"
+    with _lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key, _settings["failure_threshold"], _settings["recovery_time"])
+            _breakers[key] = breaker
+        return breaker
+
+
+def get_rate_limiter(base_url, rate, burst=1):
+    """获取后端的限流器，按 origin 区分，同一服务上的所有会话共享"""
+    parts = urlsplit(base_url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None or limiter.rate != float(rate) or limiter.burst != max(1, int(burst)):
+            limiter = RateLimiter(rate, burst)
+            _limiters[key] = limiter
+        return limiter
+
+
+def get_retry_policy():
+    """获取全局重试策略"""
+    return _settings["policy"]
+
+
+def configure_resilience(config):
+    """根据配置更新重试策略和熔断参数"""
+    with _lock:
+        _settings["policy"] = RetryPolicy.from_config(config)
+        _settings["failure_threshold"] = int(config.get('breaker_failure_threshold', 5))
+        _settings["recovery_time"] = float(config.get('breaker_recovery_time', 30.0))
+        for breaker in _breakers.values():
+            breaker.failure_threshold = _settings["failure_threshold"]
+            breaker.recovery_time = _settings["recovery_time"]
+
+
+def send_with_retry(transport, url, headers, payload, timeout, stream=False, policy=None, breaker=None,
+                    cancel_token=None, allowed=False):
+    """
+    发送请求，暂时性错误按策略重试
+    只在收到响应头之前重试，流式响应开始后不会重放。5xx 和连接错误计入熔断器，429 只重试不计入
+    :param allowed: 调用方已经通过 breaker.allow() 获准发送时为 True，第一次尝试不再重复检查；
+                    熔断恢复期结束后 allow() 只放行一次探测请求，重复检查会把这次机会用掉
+    :return: TransportResponse，重试用尽时返回最后一次的错误响应，由调用方按原有方式处理
+    """
+    # http_transport 会导入 requests 和 httpx，只有真正发送请求时才需要
+    from http_transport import TRANSPORT_ERRORS
+    
+    policy = policy or get_retry_policy()
+    logger = LoggerManager.get_logger()
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None and not (attempt == 1 and allowed) and not breaker.allow():
+            raise CircuitOpenError(f"后端暂时不可用，已熔断，{breaker.retry_in:.0f}s 后重试 - {breaker.name}")
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        retry_after = None
+        response = None
+        try:
+            response = transport.post(url, headers, payload, timeout=timeout, stream=stream)
+        except TRANSPORT_ERRORS as e:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise RequestCancelled()
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt >= policy.max_attempts:
+                raise
+            reason = f"{type(e).__name__}: {e}"
+        else:
+            status = response.status_code
+            if breaker is not None:
+                if status >= 500:
+                    breaker.record_failure()
+                elif status != 429:
+                    breaker.record_success()
+            if status not in policy.retry_statuses or attempt >= policy.max_attempts:
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            reason = f"HTTP {status}"
+
+        delay = policy.get_delay(attempt, retry_after)
+        if delay is None:
+            logger.warning(f"Retry-After 为 {retry_after:.0f}s，超过上限，不再重试")
+            return response
+        if response is not None:
+            response.close()
+        logger.warning(f"请求失败（{reason}），{delay:.2f}s 后进行第 {attempt + 1} 次尝试")
+        if cancel_token is not None:
+            if cancel_token.wait(delay):
+                raise RequestCancelled()
+        else:
+            time.sleep(delay)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from logger_manager import LoggerManager
+
+
+class ResponseCache:
+    """
+    确定性角色的回复缓存
+    内存中使用 LRU 淘汰，磁盘上使用 SQLite 持久化，重启后仍然有效。
+    只有温度不高于阈值的请求才会使用缓存
+    """
+
+    def __init__(self, db_path='cache/responses.sqlite3', max_entries=256, max_disk_entries=10000,
+                 temperature_threshold=0.0, enabled=True):
+        """
+        :param db_path: SQLite 数据库路径，为空时只使用内存缓存
+        :param max_entries: 内存中最多缓存的回复数量
+        :param max_disk_entries: 磁盘上最多保留的回复数量
+        :param temperature_threshold: 温度不高于该值时才使用缓存
+        :param enabled: 是否启用缓存
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.temperature_threshold = temperature_threshold
+        self.enabled = enabled
+        self.logger = LoggerManager.get_logger()
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.puts_since_prune = 0
+        self.conn = None
+
+        if enabled and db_path:
+            try:
+                db_dir = os.path.dirname(db_path)
+                if db_dir and not os.path.exists(db_dir):
+                    os.makedirs(db_dir)
+                self.conn = sqlite3.connect(db_path, check_same_thread=False)
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.logger.error(f"打开回复缓存数据库失败: {e}")
+                self.conn = None
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建缓存"""
+        return cls(
+            db_path=config.get('cache_path', 'cache/responses.sqlite3'),
+            max_entries=int(config.get('cache_max_entries', 256)),
+            temperature_threshold=float(config.get('cache_temperature_threshold', 0.0)),
+            enabled=config.get('cache_enabled', True)
+        )
+
+    def applies(self, temperature):
+        """判断当前请求是否可以使用缓存"""
+        return self.enabled and float(temperature) <= self.temperature_threshold
+
+    @staticmethod
+    def make_key(api_type, base_url, model, role_prompt, options, input_text, history=None):
+        """
+        计算缓存键
+        历史记录会影响回复，因此一并计入；没有历史记录的请求在不同会话之间共享缓存
+        """
+        role_hash = hashlib.sha256(role_prompt.encode('utf-8')).hexdigest()
+        payload = json.dumps(
+            [api_type, base_url, model, role_hash, options, input_text, history or []],
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """查询缓存，未命中时返回 None"""
+        with self.lock:
+            response = self.memory.get(key)
+            if response is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return response
+
+            if self.conn is not None:
+                try:
+                    row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    self.logger.error(f"读取回复缓存失败: {e}")
+                    row = None
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        """写入缓存"""
+        if not response:
+            return
+        with self.lock:
+            self._remember(key, response)
+            if self.conn is None:
+                return
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, time.time())
+                )
+                self.puts_since_prune += 1
+                if self.puts_since_prune >= 100:
+                    self.puts_since_prune = 0
+                    self.conn.execute(
+                        "DELETE FROM responses WHERE key NOT IN "
+                        "(SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)",
+                        (self.max_disk_entries,)
+                    )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.logger.error(f"写入回复缓存失败: {e}")
+
+    def _remember(self, key, response):
+        """写入内存 LRU"""
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                try:
+                    self.conn.execute("DELETE FROM responses")
+                    self.conn.commit()
+                except sqlite3.Error as e:
+                    self.logger.error(f"清空回复缓存失败: {e}")
+
+    @property
+    def stats(self):
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self.memory)
+        }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
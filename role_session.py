@@ -0,0 +1,85 @@
+from logger_manager import LoggerManager
+from prompt_builder import build_system_message
+
+
+class RoleSession:
+    """
+    按角色配置创建的独立会话，统一 OpenAI 兼容接口和 Ollama 的流式调用
+    与热键会话共用连接池和 Ollama 客户端，但有自己的历史记录，可以在其他线程中与热键请求同时使用
+    """
+
+    def __init__(self, config, role, keep_history=False, ollama_api=None):
+        """
+        :param config: 配置快照
+        :param role: RoleConfig，为空时只使用语言要求作为系统提示词
+        :param keep_history: 是否保持历史记录
+        :param ollama_api: Ollama 模式下使用的 OllamaAPI 实例，负责参数规划、模型保活和客户端
+        """
+        self.api_type = config.api_type
+        self.base_url = config.base_url
+        self.role = role
+        self.role_name = role.name if role else config.current_role
+        self.temperature = role.temperature if role else config.temperature
+        self.max_tokens = role.max_tokens if role else config.text_complete_number
+        self.ollama_api = ollama_api
+        self.logger = LoggerManager.get_logger()
+
+        if self.api_type == 'Ollama':
+            # 只在使用 Ollama 时导入 ollama 库
+            from ollama_api import ChatSession as OllamaChatSession
+
+            if ollama_api is None:
+                raise ValueError("Ollama 模式需要提供 OllamaAPI 实例")
+            self.session = OllamaChatSession(
+                model=config.model or 'llama2',
+                keep_history=keep_history,
+                input_prompt=role.input_prompt if role else '',
+                output_prompt=role.output_prompt if role else '',
+                context_budget=config.get('context_budget') or None,
+                client=ollama_api.client,
+                language=config.language
+            )
+        else:  # OpenAI 或 OpenAI兼容模式
+            from oai_api import ChatSession as OAIChatSession
+
+            self.session = OAIChatSession(
+                api_key=config.apikey,
+                base_url=config.base_url,
+                model=config.model,
+                system_prompt=build_system_message(role, config.language),
+                http2=config.get('http2', False),
+                keep_history=keep_history,
+                context_budget=config.get('context_budget') or None,
+                role_name=self.role_name,
+                timeout=(float(config.get('connect_timeout', 5)), float(config.get('read_timeout', 30))),
+                fallback_model=config.get('fallback_model') or None
+            )
+
+    @property
+    def model(self):
+        return self.session.model
+
+    @property
+    def last_stats(self):
+        """最近一次请求的首字延迟、总耗时等统计"""
+        return self.session.last_stats
+
+    def stream(self, user_input, temperature=None, max_tokens=None, cancel_token=None):
+        """
+        逐块产出回复文本
+        :param temperature: 为空时使用角色配置
+        :param max_tokens: 为空时使用角色配置
+        """
+        temperature = float(self.temperature if temperature is None else temperature)
+        max_tokens = int(self.max_tokens if max_tokens is None else max_tokens)
+        if self.api_type == 'Ollama':
+            return self.ollama_api.stream_chat(self.session, user_input, temperature, max_tokens,
+                                               cancel_token=cancel_token)
+        return self.session.stream_chat(user_input, temperature, max_tokens, cancel_token=cancel_token)
+
+    def complete(self, user_input, temperature=None, max_tokens=None, cancel_token=None):
+        """发送消息并返回完整回复"""
+        return ''.join(self.stream(user_input, temperature, max_tokens, cancel_token))
+
+    def clear_history(self):
+        self.session.clear_history()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmark.mock_servers import MockBehavior, MockOpenAIServer, MockOllamaServer
+
+
+@pytest.fixture(autouse=True, scope='session')
+def workdir(tmp_path_factory):
+    """日志等运行时文件写到临时目录，不污染仓库"""
+    old = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('work'))
+    yield
+    os.chdir(old)
+
+
+@pytest.fixture
+def openai_server():
+    with MockOpenAIServer(MockBehavior(ttft=0.0, token_rate=0, num_tokens=8)) as server:
+        yield server
+
+
+@pytest.fixture
+def ollama_server():
+    with MockOllamaServer(MockBehavior(ttft=0.0, token_rate=0, num_tokens=8)) as server:
+        yield server
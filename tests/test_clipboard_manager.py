@@ -0,0 +1,64 @@
+import time
+
+from benchmark.runner import BenchmarkApp
+from clipboard_manager import InMemoryClipboardBackend, StreamPasteSink
+
+
+def make_sink(backend, flush_interval=0.2):
+    return StreamPasteSink(backend, flush_chars=80, flush_interval=flush_interval, settle_delay=0)
+
+
+def test_first_chunk_pasted_immediately():
+    backend = InMemoryClipboardBackend(clipboard='原有内容')
+    with make_sink(backend, flush_interval=10) as sink:
+        sink.write("第")
+        # 不等待字数或时间阈值
+        assert backend.document == ["第"]
+        sink.write("一段")
+        assert backend.document == ["第"]
+    assert backend.document_text == "第一段"
+    assert backend.clipboard == '原有内容'
+
+
+def test_trailing_text_flushed_by_timer():
+    backend = InMemoryClipboardBackend()
+    sink = make_sink(backend)
+    sink.open()
+    sink.write("a")
+    sink.write("b")
+    sink.write("c")
+    assert backend.document == ["a"]
+
+    # 没有新的文本块到达，定时器也会粘贴缓冲中的文本
+    deadline = time.perf_counter() + 2
+    while backend.document_text != "abc":
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.01)
+    assert backend.paste_count == 2
+    sink.close()
+    assert backend.paste_count == 2
+
+
+def test_flush_chars_still_batches():
+    backend = InMemoryClipboardBackend()
+    with make_sink(backend, flush_interval=10) as sink:
+        sink.write("x")
+        for _ in range(100):
+            sink.write("y")
+    assert backend.document_text == "x" + "y" * 100
+    assert backend.paste_count == 3
+
+
+def test_stream_error_not_pasted_into_document(tmp_path, openai_server):
+    openai_server.behavior.num_tokens = 8
+    openai_server.behavior.abort_after = 4
+    bench = BenchmarkApp(str(tmp_path), 'openai', openai_server.base_url)
+    try:
+        assert bench.app.backend_ready.wait(10)
+        ctx, _, _ = bench.trigger()
+        assert ctx.error is not None
+        # 已粘贴的部分回复保留，错误提示不接在后面
+        assert bench.clipboard.document_text == openai_server.behavior.reply_text[:4]
+        assert bench.clipboard.clipboard == '用户原有的剪贴板内容'
+    finally:
+        bench.close()
@@ -0,0 +1,48 @@
+import json
+
+from config_manager import ConfigManager
+
+
+def settings_form(manager, **changes):
+    """设置窗口保存时只提交它管理的配置项"""
+    snapshot = manager.get_snapshot()
+    config = {
+        'apikey': snapshot.apikey,
+        'base_url': snapshot.base_url,
+        'model': snapshot.model,
+        'text_complete_number': snapshot.text_complete_number,
+        'temperature': snapshot.temperature,
+        'keep_history': snapshot.keep_history,
+        'api_type': snapshot.api_type,
+        'language': snapshot.language,
+        'roles': manager.get_config().get('roles', []),
+        'current_role': snapshot.current_role
+    }
+    config.update(changes)
+    return config
+
+
+def test_partial_save_keeps_other_keys(tmp_path):
+    path = tmp_path / "config.json"
+    manager = ConfigManager(str(path))
+    extra = {"proxy": "http://127.0.0.1:7890", "ipc_enabled": True, "hedge_enabled": True, "metrics_port": 9100}
+    config = manager.get_config()
+    config.update(extra)
+    manager.save_config(config, immediate=True)
+
+    manager.save_config(settings_form(manager, temperature=0.2), immediate=True)
+
+    snapshot = manager.get_snapshot()
+    assert snapshot.temperature == 0.2
+    saved = json.loads(path.read_text(encoding='utf-8'))
+    for key, value in extra.items():
+        assert snapshot.get(key) == value
+        assert saved[key] == value
+
+
+def test_partial_save_updates_current_api_config(tmp_path):
+    manager = ConfigManager(str(tmp_path / "config.json"))
+    manager.save_config(settings_form(manager, base_url="http://localhost:1234/v1", model="local"), immediate=True)
+    snapshot = manager.get_snapshot()
+    assert snapshot.base_url == "http://localhost:1234/v1" and snapshot.model == "local"
+    assert snapshot.get('api_configs')[snapshot.api_type]['model'] == "local"
@@ -0,0 +1,52 @@
+import time
+
+from benchmark.runner import BenchmarkApp
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def settings_form(app, role):
+    """设置窗口保存时提交的配置"""
+    snapshot = app.config_manager.get_snapshot()
+    config = snapshot.to_dict()
+    config.update(apikey=snapshot.apikey, base_url=snapshot.base_url, model=snapshot.model, current_role=role)
+    return config
+
+
+def test_config_save_applied_between_requests(tmp_path, openai_server):
+    openai_server.behavior.ttft = 0.3
+    bench = BenchmarkApp(str(tmp_path), 'openai', openai_server.base_url)
+    app = bench.app
+    try:
+        assert app.backend_ready.wait(10)
+        old_session = app.chat_session
+        ctx = app.request_worker.submit('complete')
+        wait_for(lambda: openai_server.request_count >= 1)
+
+        # 在界面线程保存配置时，请求仍在使用旧会话
+        app.on_config_save(settings_form(app, '代码专家'))
+        assert app.chat_session is old_session
+
+        wait_for(lambda: ctx.finished_at is not None)
+        assert ctx.error is None and ctx.role == '通用助手'
+        wait_for(lambda: app.chat_session is not old_session)
+        assert app.chat_session.role_name == '代码专家'
+    finally:
+        bench.close()
+
+
+def test_consecutive_saves_use_latest_config(tmp_path, openai_server):
+    bench = BenchmarkApp(str(tmp_path), 'openai', openai_server.base_url)
+    app = bench.app
+    try:
+        assert app.backend_ready.wait(10)
+        for role in ('代码专家', '文案写手'):
+            app.on_config_save(settings_form(app, role))
+        wait_for(lambda: app.chat_session.role_name == '文案写手')
+    finally:
+        bench.close()
@@ -0,0 +1,151 @@
+import threading
+
+import pytest
+
+from benchmark.mock_servers import MockBehavior, MockOpenAIServer
+from benchmark.runner import BenchmarkApp
+from hedging import HedgedRequest, LatencyTracker, get_hedge_delay, get_latency_tracker
+from request_worker import CancelToken, RequestCancelled
+
+
+class FakeBackend:
+    """
+    可控的流式后端
+    在 release 之前一直阻塞，期间被取消时记录下来；release 后出错或逐块产出回复
+    """
+
+    def __init__(self, name, chunks=('回', '复'), error=None):
+        self.name = name
+        self.chunks = chunks
+        self.error = error
+        self.tracker = LatencyTracker()
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+
+    def stream(self, token):
+        self.started.set()
+        while not self.release.wait(0.005):
+            if token.cancelled:
+                self.cancelled.set()
+                raise RequestCancelled()
+        if self.error is not None:
+            raise self.error
+        yield from self.chunks
+
+    @property
+    def leg(self):
+        return self.name, self.stream, self.tracker
+
+
+def test_primary_within_delay_never_hedges():
+    primary, secondary = FakeBackend('primary'), FakeBackend('secondary')
+    primary.release.set()
+    request = HedgedRequest(primary.leg, secondary.leg, delay=10)
+    assert ''.join(request.stream()) == '回复'
+    assert request.winner is request.primary
+    assert not secondary.started.is_set()
+    assert len(primary.tracker) == 1
+
+
+def test_hedge_winner_cancels_losing_leg():
+    primary = FakeBackend('primary')
+    secondary = FakeBackend('secondary', chunks=('备', '用'))
+    # 主后端一直没有首字，等待时间为 0 时立即发出对冲请求，备用后端先返回
+    secondary.release.set()
+    request = HedgedRequest(primary.leg, secondary.leg, delay=0)
+    assert ''.join(request.stream()) == '备用'
+    assert request.winner is request.secondary
+    assert primary.started.is_set()
+    assert primary.cancelled.wait(2)
+    assert request.primary.cancel_token.cancelled
+    assert not secondary.cancelled.is_set()
+    assert len(secondary.tracker) == 1
+    # 落败的主后端记录已等待的时间，作为首字延迟的下限
+    assert len(primary.tracker) == 1
+
+
+def test_primary_error_switches_to_secondary_without_waiting():
+    primary = FakeBackend('primary', error=ConnectionError('refused'))
+    secondary = FakeBackend('secondary', chunks=('备', '用'))
+    primary.release.set()
+    secondary.release.set()
+    request = HedgedRequest(primary.leg, secondary.leg, delay=60)
+    assert ''.join(request.stream()) == '备用'
+    assert request.winner is request.secondary
+
+
+def test_all_legs_failing_raises():
+    primary = FakeBackend('primary', error=ConnectionError('refused'))
+    secondary = FakeBackend('secondary', error=TimeoutError('timeout'))
+    primary.release.set()
+    secondary.release.set()
+    request = HedgedRequest(primary.leg, secondary.leg, delay=60)
+    with pytest.raises(Exception, match="所有后端请求均失败"):
+        list(request.stream())
+    assert request.winner is None
+
+
+def test_external_cancel_cancels_both_legs():
+    primary, secondary = FakeBackend('primary'), FakeBackend('secondary')
+    request = HedgedRequest(primary.leg, secondary.leg, delay=0)
+    cancel_token = CancelToken()
+    outcome = []
+
+    def consume():
+        try:
+            list(request.stream(cancel_token))
+        except RequestCancelled:
+            outcome.append('cancelled')
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    assert primary.started.wait(2) and secondary.started.wait(2)
+    cancel_token.cancel()
+    consumer.join(2)
+    assert outcome == ['cancelled']
+    assert primary.cancelled.wait(2) and secondary.cancelled.wait(2)
+
+
+def test_hedge_delay_from_percentile():
+    tracker = LatencyTracker()
+    config = {"hedge_min_samples": 10, "hedge_default_delay": 1.5, "hedge_min_delay": 0.3, "hedge_max_delay": 5.0}
+    assert get_hedge_delay(tracker, config) == 1.5
+    for i in range(1, 21):
+        tracker.record(i * 0.1)
+    assert get_hedge_delay(tracker, dict(config, hedge_percentile=0.5)) == pytest.approx(1.1)
+    assert get_hedge_delay(tracker, dict(config, hedge_percentile=0.99)) == 2.0
+    tracker.record(0.0)
+    assert get_hedge_delay(tracker, dict(config, hedge_percentile=0.0)) == 0.3
+
+
+def test_hedged_reply_written_to_history_once(tmp_path):
+    primary = MockBehavior(ttft=0.5, token_rate=0, num_tokens=2, reply_text="主")
+    secondary = MockBehavior(ttft=0.0, token_rate=0, num_tokens=2, reply_text="备")
+    with MockOpenAIServer(primary) as primary_server, MockOpenAIServer(secondary) as secondary_server:
+        bench = BenchmarkApp(str(tmp_path), 'openai', primary_server.base_url, overrides={
+            "keep_history": True,
+            "hedge_enabled": True,
+            "hedge_backend": "OpenAI兼容",
+            "hedge_default_delay": 0.05,
+            "hedge_min_delay": 0.05,
+            "api_configs": {
+                "OpenAI": {"apikey": "sk-test", "base_url": f"{primary_server.base_url}/v1", "model": "hedge-model"},
+                "OpenAI兼容": {"apikey": "sk-test", "base_url": f"{secondary_server.base_url}/v1",
+                             "model": "hedge-model"},
+                "Ollama": {"apikey": "", "base_url": "", "model": ""}
+            }
+        })
+        try:
+            assert bench.app.backend_ready.wait(10)
+            for _ in range(2):
+                ctx, _, _ = bench.trigger()
+                assert ctx.error is None and ctx.response == "备备"
+            session = bench.app.chat_session
+            assert [m["role"] for m in session.message_history] == ["user", "assistant"] * 2
+            assert [m["content"] for m in session.message_history[1::2]] == ["备备", "备备"]
+            # 备用会话的历史是副本，不与主会话共用
+            assert bench.app.hedge_session.history is not session.history
+            assert len(get_latency_tracker(session.base_url, session.model)) == 2
+        finally:
+            bench.close()
@@ -0,0 +1,67 @@
+from history_manager import HistoryWindow, estimate_tokens
+
+
+def add_turn(history, question, answer):
+    history.append({"role": "user", "content": question})
+    history.append({"role": "assistant", "content": answer})
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_storage_stays_within_budget():
+    history = HistoryWindow(context_budget=200)
+    for i in range(1000):
+        add_turn(history, f"问题{i}" * 5, f"回答{i}" * 5)
+    assert history.total_tokens <= 200
+    assert len(history) < 20
+    # 按轮次删除，第一条总是提问，最近一轮保留
+    assert history.messages[0]["role"] == "user"
+    assert history.messages[-1]["content"] == "回答999" * 5
+
+
+def test_storage_capped_by_message_count():
+    history = HistoryWindow(context_budget=1000000, max_messages=10)
+    for i in range(100):
+        add_turn(history, f"q{i}", f"a{i}")
+    assert len(history) == 10
+    assert history.messages[0]["content"] == "q95"
+    assert history.total_tokens == sum(tokens for _, tokens in history.entries)
+
+
+def test_latest_turn_kept_even_when_over_budget():
+    history = HistoryWindow(context_budget=10)
+    add_turn(history, "短", "短")
+    add_turn(history, "长" * 50, "长" * 50)
+    assert [m["content"] for m in history.messages] == ["长" * 50, "长" * 50]
+
+
+def test_replace_last_trims_and_keeps_counts():
+    history = HistoryWindow(context_budget=100)
+    add_turn(history, "问题", "回答")
+    add_turn(history, "问题二", "回答二")
+    history.replace_last({"role": "assistant", "content": "续写" * 40})
+    assert [m["content"] for m in history.messages] == ["问题二", "续写" * 40]
+    assert history.total_tokens == sum(tokens for _, tokens in history.entries)
+
+
+def test_select_drops_oldest_turns_for_request():
+    history = HistoryWindow(context_budget=1000)
+    for i in range(5):
+        add_turn(history, "问" * 20, "答" * 20)
+    selected = history.select([{"role": "user", "content": "新问题"}], reserve_tokens=900)
+    assert selected and selected[0]["role"] == "user"
+    assert history.last_dropped_messages == 10 - len(selected)
+    assert history.last_sent_tokens <= 1000 - 900
+    # select 只决定发送内容，不修改保存的历史
+    assert len(history) == 10
+
+
+def test_clear():
+    history = HistoryWindow(context_budget=100)
+    add_turn(history, "问题", "回答")
+    history.clear()
+    assert not history and history.total_tokens == 0 and history.user_messages == 0
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import http_transport
+from http_transport import get_transport, set_pool_size
+
+HEADERS = {"Content-Type": "application/json"}
+
+
+@pytest.fixture(autouse=True)
+def reset_transports():
+    http_transport._transports.clear()
+    yield
+    for transport in http_transport._transports.values():
+        transport.close()
+    http_transport._transports.clear()
+    set_pool_size(4)
+
+
+def payload(stream):
+    return {"model": "m", "messages": [{"role": "user", "content": "hi"}], "stream": stream}
+
+
+def chat_url(server):
+    return f"{server.base_url}/v1/chat/completions"
+
+
+def test_transport_shared_per_origin(openai_server):
+    first = get_transport(f"{openai_server.base_url}/v1")
+    assert get_transport(chat_url(openai_server)) is first
+
+
+def test_replaced_idle_transport_is_closed(openai_server):
+    old = get_transport(openai_server.base_url)
+    assert old.post(chat_url(openai_server), HEADERS, payload(False)).status_code == 200
+
+    set_pool_size(8)
+    new = get_transport(openai_server.base_url)
+    assert new is not old and new.pool_size == 8
+    assert old.closed
+
+
+def test_replaced_transport_waits_for_open_stream(openai_server):
+    old = get_transport(openai_server.base_url)
+    response = old.post(chat_url(openai_server), HEADERS, payload(True), stream=True)
+
+    get_transport(openai_server.base_url, proxies={"http": None, "https": "http://127.0.0.1:9"})
+    # 正在读取的流不会被打断
+    assert old.retired and not old.closed
+    lines = [line for line in response.iter_lines() if line]
+    assert lines[-1] == "data: [DONE]"
+    assert json.loads(lines[0][len("data: "):])["choices"][0]["delta"]["content"]
+
+    response.close()
+    assert old.closed
+    # 重复关闭不会重复释放
+    response.close()
+    assert old.active == 0
+
+
+def test_post_on_closed_transport_uses_current_one(openai_server):
+    old = get_transport(openai_server.base_url)
+    set_pool_size(8)
+    current = get_transport(openai_server.base_url)
+    assert old.closed
+
+    response = old.post(chat_url(openai_server), HEADERS, payload(False))
+    assert response.status_code == 200
+    assert current.warmed
@@ -0,0 +1,88 @@
+import http.client
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ipc_server import CompletionServer
+from request_worker import RequestCancelled
+
+
+class FakeApp:
+    """只提供补全接口用到的两个方法，输入 wait 时一直等到请求被取消"""
+
+    def __init__(self):
+        self.waiting = threading.Event()
+
+    def create_role_session(self, role_name=None, keep_history=False):
+        return SimpleNamespace(role_name=role_name or '通用助手', model='mock-model')
+
+    def stream_completion(self, text, session, temperature=None, max_tokens=None, cancel_token=None):
+        if text == 'wait':
+            yield '部分'
+            self.waiting.set()
+            cancel_token.wait(5)
+            raise RequestCancelled()
+        yield '回复'
+
+
+@pytest.fixture
+def server():
+    server = CompletionServer(FakeApp(), port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def connect(server):
+    host, port = server.httpd.server_address[:2]
+    return http.client.HTTPConnection(host, port, timeout=5)
+
+
+def post(conn, text, stream):
+    body = json.dumps({"text": text, "stream": stream})
+    conn.request('POST', '/v1/complete', body=body, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def stop_when_waiting(server):
+    def stop():
+        assert server.app.waiting.wait(5)
+        server.stop()
+    thread = threading.Thread(target=stop)
+    thread.start()
+    return thread
+
+
+def test_keep_alive_connection_reused(server):
+    conn = connect(server)
+    for _ in range(2):
+        status, body = post(conn, '你好', stream=False)
+        assert status == 200
+        assert json.loads(body)["text"] == '回复'
+    conn.close()
+
+
+def test_stop_answers_pending_request(server):
+    conn = connect(server)
+    stopper = stop_when_waiting(server)
+    # 服务停止时正在等待的非流式请求收到取消的响应，而不是一直挂起
+    status, body = post(conn, 'wait', stream=False)
+    stopper.join(5)
+    assert status == 503
+    assert json.loads(body) == {"error": "cancelled"}
+    assert not server.cancel_tokens
+    conn.close()
+
+
+def test_stop_ends_pending_stream(server):
+    conn = connect(server)
+    stopper = stop_when_waiting(server)
+    status, body = post(conn, 'wait', stream=True)
+    stopper.join(5)
+    assert status == 200
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert lines == [{"delta": "部分"}, {"error": "cancelled"}]
+    conn.close()
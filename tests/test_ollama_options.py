@@ -0,0 +1,33 @@
+import threading
+
+from ollama_options import OllamaOptionsPlanner
+
+
+def test_num_ctx_grows_only_when_needed():
+    planner = OllamaOptionsPlanner(max_ctx=32768)
+    assert planner.plan('m', 500, 500, 0.7)["num_ctx"] == 2048
+    assert planner.plan('m', 3000, 500, 0.7)["num_ctx"] == 4096
+    # 放得下时继续使用当前的 num_ctx，不缩小
+    assert planner.plan('m', 100, 100, 0.7)["num_ctx"] == 4096
+    assert planner.baseline_options('m')["num_ctx"] == 4096
+
+
+def test_concurrent_plans_keep_consistent_ctx():
+    planner = OllamaOptionsPlanner(max_ctx=32768)
+    sizes = [500, 3000, 7000, 1000] * 50
+    results = []
+    lock = threading.Lock()
+
+    def plan(needed):
+        options = planner.plan('m', needed, 0, 0.7)
+        with lock:
+            results.append((needed, options["num_ctx"]))
+
+    threads = [threading.Thread(target=plan, args=(needed,)) for needed in sizes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(num_ctx >= needed for needed, num_ctx in results)
+    # 增大到 8192 之后，较小的请求继续使用它，不会被基于旧值的规划覆盖
+    assert planner.current_ctx['m'] == 8192
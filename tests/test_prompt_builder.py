@@ -0,0 +1,19 @@
+from config_manager import ConfigManager
+from prompt_builder import LANGUAGE_PROMPTS, build_system_message, compile_role_prompt
+from role_session import RoleSession
+
+
+def test_missing_role_uses_language_instruction():
+    assert compile_role_prompt(None, 'chinese') == LANGUAGE_PROMPTS['chinese']
+    assert build_system_message(None, 'english') == {"role": "system", "content": LANGUAGE_PROMPTS['english']}
+
+
+def test_role_prompt_ends_with_language_instruction():
+    role = {"input_prompt": "你是编辑。", "output_prompt": "只输出改写结果。"}
+    assert compile_role_prompt(role, 'chinese') == "你是编辑。\n\n只输出改写结果。\n\n" + LANGUAGE_PROMPTS['chinese']
+
+
+def test_role_session_without_role(tmp_path):
+    snapshot = ConfigManager(str(tmp_path / "config.json")).get_snapshot()
+    session = RoleSession(snapshot, None)
+    assert session.session.system_prompt["content"] == LANGUAGE_PROMPTS[snapshot.language]
@@ -0,0 +1,59 @@
+import threading
+import time
+
+from request_worker import RequestWorker
+
+
+def make_worker():
+    started = threading.Event()
+    applied = []
+
+    def complete(ctx):
+        started.set()
+        # 一直阻塞到被取消
+        ctx.cancel_token.wait(5)
+        ctx.cancel_token.raise_if_cancelled()
+
+    worker = RequestWorker({
+        'complete': complete,
+        'continue': complete,
+        'reconfigure': lambda ctx: applied.append(ctx.id)
+    }, coalesce_window=0, cancellable_kinds=('complete', 'continue'))
+    worker.start()
+    return worker, started, applied
+
+
+def wait_finished(ctx):
+    for _ in range(500):
+        if ctx.finished_at is not None:
+            return
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_cancel_keeps_queued_reconfigure():
+    worker, started, applied = make_worker()
+    try:
+        running = worker.submit('complete')
+        assert started.wait(2)
+        queued = worker.submit('continue')
+        reconfigure = worker.submit('reconfigure', debounce=False)
+
+        worker.cancel_current()
+        wait_finished(reconfigure)
+        assert running.cancelled and queued.cancelled
+        assert not reconfigure.cancelled
+        assert applied == [reconfigure.id]
+    finally:
+        worker.stop()
+
+
+def test_stop_cancels_all_kinds():
+    worker, started, applied = make_worker()
+    running = worker.submit('complete')
+    assert started.wait(2)
+    reconfigure = worker.submit('reconfigure', debounce=False)
+    worker.stop()
+    wait_finished(running)
+    assert reconfigure.cancelled
+    assert applied == []
@@ -0,0 +1,191 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+import resilience
+from http_transport import get_transport
+from oai_api import ChatSession
+from resilience import (CircuitBreaker, CircuitOpenError, RateLimiter, RetryPolicy, configure_resilience,
+                        get_breaker, parse_retry_after, send_with_retry)
+
+SYSTEM_PROMPT = {"role": "system", "content": "test"}
+HEADERS = {"Content-Type": "application/json", "Authorization": "Bearer sk-test"}
+
+
+@pytest.fixture(autouse=True)
+def reset_resilience():
+    """每个用例使用新的熔断器和很短的重试等待"""
+    resilience._breakers.clear()
+    configure_resilience({
+        "retry_max_attempts": 3,
+        "retry_base_delay": 0.01,
+        "retry_max_delay": 0.05,
+        "retry_max_retry_after": 1.0,
+        "breaker_failure_threshold": 2,
+        "breaker_recovery_time": 0.2
+    })
+    yield
+    resilience._breakers.clear()
+    configure_resilience({})
+
+
+def chat_url(server):
+    return f"{server.base_url}/v1/chat/completions"
+
+
+def payload(model="main-model"):
+    return {"model": model, "messages": [{"role": "user", "content": "hi"}], "stream": False}
+
+
+def make_session(server, fallback_model=None):
+    return ChatSession(
+        api_key="sk-test",
+        base_url=f"{server.base_url}/v1",
+        model="main-model",
+        system_prompt=SYSTEM_PROMPT,
+        keep_history=False,
+        timeout=(2, 5),
+        fallback_model=fallback_model
+    )
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_retry_policy_rejects_long_retry_after():
+    policy = RetryPolicy(base_delay=0.5, max_delay=2.0, max_retry_after=5.0)
+    assert policy.get_delay(1, retry_after=10.0) is None
+    assert 3.0 <= policy.get_delay(1, retry_after=3.0) <= 3.5
+    assert all(0 <= policy.get_delay(attempt) <= 2.0 for attempt in range(1, 10))
+
+
+def test_retries_transient_errors_until_success(openai_server):
+    openai_server.behavior.fail_sequence = [503, 502]
+    response = send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                               timeout=(2, 5))
+    assert response.status_code == 200
+    assert openai_server.request_count == 3
+
+
+def test_returns_last_error_when_attempts_exhausted(openai_server):
+    openai_server.behavior.fail_sequence = [503, 503, 503, 503]
+    response = send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                               timeout=(2, 5))
+    assert response.status_code == 503
+    assert openai_server.request_count == 3
+
+
+def test_does_not_retry_client_errors(openai_server):
+    openai_server.behavior.fail_sequence = [400]
+    response = send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                               timeout=(2, 5))
+    assert response.status_code == 400
+    assert openai_server.request_count == 1
+
+
+def test_waits_for_retry_after(openai_server):
+    openai_server.behavior.fail_sequence = [429]
+    openai_server.behavior.retry_after = 0.3
+    start = time.perf_counter()
+    response = send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                               timeout=(2, 5))
+    assert response.status_code == 200
+    assert time.perf_counter() - start >= 0.3
+    assert openai_server.request_count == 2
+
+
+def test_gives_up_when_retry_after_too_long(openai_server):
+    openai_server.behavior.fail_sequence = [503]
+    openai_server.behavior.retry_after = 30
+    response = send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                               timeout=(2, 5))
+    assert response.status_code == 503
+    assert openai_server.request_count == 1
+
+
+def test_rate_limit_responses_do_not_open_breaker(openai_server):
+    openai_server.behavior.fail_sequence = [429, 429, 429]
+    breaker = get_breaker(openai_server.base_url, "main-model")
+    send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                    timeout=(2, 5), breaker=breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_after_consecutive_failures(openai_server):
+    openai_server.behavior.fail_sequence = [503, 503]
+    breaker = get_breaker(openai_server.base_url, "main-model")
+    send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                    timeout=(2, 5), policy=RetryPolicy(max_attempts=2, base_delay=0.01), breaker=breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        send_with_retry(get_transport(openai_server.base_url), chat_url(openai_server), HEADERS, payload(),
+                        timeout=(2, 5), breaker=breaker)
+    # 熔断期间不再发送请求
+    assert openai_server.request_count == 2
+
+
+def test_breaker_half_open_probe_closes_after_recovery(openai_server):
+    session = make_session(openai_server)
+    openai_server.behavior.fail_sequence = [503] * 2
+    # 第二次失败时熔断，第三次尝试不再发出
+    assert "熔断" in session.chat("hi")
+    assert openai_server.request_count == 2
+    breaker = get_breaker(session.base_url, "main-model")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert "熔断" in session.chat("hi")
+    requests_while_open = openai_server.request_count
+
+    time.sleep(0.25)
+    reply = session.chat("hi")
+    # 恢复期结束后探测请求必须真正发出，成功后熔断器关闭
+    assert openai_server.request_count == requests_while_open + 1
+    assert not reply.startswith(("\n发生错误", "API请求错误"))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_failed_probe_reopens(openai_server):
+    session = make_session(openai_server)
+    openai_server.behavior.fail_sequence = [503] * 2
+    session.chat("hi")
+    breaker = get_breaker(session.base_url, "main-model")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.25)
+    openai_server.behavior.fail_sequence = [503]
+    session.chat("hi")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_in > 0.1
+
+
+def test_fallback_model_used_while_primary_open(openai_server):
+    session = make_session(openai_server, fallback_model="fallback-model")
+    openai_server.behavior.fail_sequence = [503] * 2
+    session.chat("hi")
+    assert get_breaker(session.base_url, "main-model").state == CircuitBreaker.OPEN
+
+    reply = session.chat("hi")
+    assert not reply.startswith(("\n发生错误", "API请求错误"))
+    assert openai_server.models[-1] == "fallback-model"
+
+    # 恢复期结束后先用主模型探测，而不是继续降级
+    time.sleep(0.25)
+    session.chat("hi")
+    assert openai_server.models[-1] == "main-model"
+    assert get_breaker(session.base_url, "main-model").state == CircuitBreaker.CLOSED
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(rate=20, burst=1)
+    start = time.perf_counter()
+    for _ in range(5):
+        limiter.acquire()
+    # 第一个请求使用初始令牌，其余 4 个各等待约 50ms
+    assert time.perf_counter() - start >= 0.18
@@ -302,7 +302,10 @@ class UIManager:
 1. 快捷键
    Ctrl + Alt + \\ - 补全选中文本
    Ctrl + Alt + / - 继续生成内容
+   Ctrl + Alt + Backspace - 取消正在进行的生成
    Ctrl + Esc - 清除历史记录
+   Ctrl + Alt + S - 打开设置窗口
+   Ctrl + Alt + M - 多个角色同时生成，在弹出窗口中选择要粘贴的结果
 
 2. 基本操作
    - 选择文本后使用快捷键进行AI补全
@@ -567,3 +570,165 @@ class UIManager:
         if not selection:
             return "通用助手"
         return self.role_listbox.get(selection[0])
+
+
+class FanOutPicker:
+    """
+    多角色结果选择窗口
+    各角色的回复到达后立即显示，按数字键或回车选择一个结果粘贴，Esc 关闭并取消未完成的请求
+    只能在主线程中创建和更新
+    """
+
+    def __init__(self, root, role_names, on_choose, on_close):
+        """
+        :param root: 主窗口
+        :param role_names: 角色名称，按请求顺序排列
+        :param on_choose: 选择结果后的回调，接收回复文本
+        :param on_close: 未选择就关闭时的回调
+        """
+        self.role_names = list(role_names)
+        self.on_choose = on_choose
+        self.on_close = on_close
+        self.results = [None] * len(self.role_names)
+        self.closed = False
+
+        self.window = tk.Toplevel(root)
+        self.window.title("多角色结果 - 数字键或回车选择，Esc 关闭")
+        self.window.geometry("720x420")
+        self.window.attributes('-topmost', True)
+        self.window.grid_columnconfigure(1, weight=1)
+        self.window.grid_rowconfigure(0, weight=1)
+
+        # 左侧角色列表，右侧预览选中的回复
+        self.listbox = tk.Listbox(self.window, width=28, exportselection=False, font=('微软雅黑', 10))
+        self.listbox.grid(row=0, column=0, sticky=(tk.N, tk.S), padx=(10, 5), pady=10)
+        for i, name in enumerate(self.role_names):
+            self.listbox.insert(tk.END, self.format_item(i))
+        self.listbox.bind('<<ListboxSelect>>', lambda event: self.show_selected())
+
+        self.preview = scrolledtext.ScrolledText(self.window, wrap=tk.WORD, font=('微软雅黑', 10), state='disabled')
+        self.preview.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(5, 10), pady=10)
+
+        btn_frame = ttk.Frame(self.window)
+        btn_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=10, pady=(0, 10))
+        self.status_label = ttk.Label(btn_frame, text="等待回复…")
+        self.status_label.pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="关闭", command=self.close, width=10).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(btn_frame, text="粘贴", command=self.choose, width=10).pack(side=tk.RIGHT, padx=5)
+
+        self.window.bind('<Return>', lambda event: self.choose())
+        self.window.bind('<Escape>', lambda event: self.close())
+        self.window.bind('<Key>', self.on_key)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.window.focus_force()
+        self.listbox.focus_set()
+
+    def format_item(self, index):
+        name = self.role_names[index]
+        result = self.results[index]
+        if result is None:
+            return f"{index + 1}. {name} - 生成中…"
+        if not result.ok:
+            return f"{index + 1}. {name} - 失败"
+        return f"{index + 1}. {name} - {result.elapsed:.1f}s"
+
+    def add_result(self, result):
+        """显示一个角色的回复，第一个成功的回复自动选中"""
+        if self.closed:
+            return
+        self.results[result.index] = result
+        # 重写列表项会清除选中状态，先记下再恢复
+        selected = self.selected_index()
+        self.listbox.delete(result.index)
+        self.listbox.insert(result.index, self.format_item(result.index))
+        if selected is not None:
+            self.listbox.selection_set(selected)
+        elif result.ok:
+            self.listbox.selection_set(result.index)
+        self.show_selected()
+        done = sum(1 for r in self.results if r is not None)
+        self.status_label.config(text=f"已完成 {done}/{len(self.results)}")
+
+    def selected_index(self):
+        selection = self.listbox.curselection()
+        return selection[0] if selection else None
+
+    def show_selected(self):
+        index = self.selected_index()
+        if index is None:
+            return
+        result = self.results[index]
+        if result is None:
+            text = "生成中…"
+        elif result.ok:
+            text = result.text
+        else:
+            text = f"请求失败: {result.error}"
+        self.preview.configure(state='normal')
+        self.preview.delete('1.0', tk.END)
+        self.preview.insert(tk.END, text)
+        self.preview.configure(state='disabled')
+
+    def on_key(self, event):
+        if event.char and event.char.isdigit() and event.char != '0':
+            index = int(event.char) - 1
+            if index < len(self.results):
+                self.listbox.selection_clear(0, tk.END)
+                self.listbox.selection_set(index)
+                self.choose()
+
+    def choose(self):
+        """粘贴选中的回复，尚未完成或失败的回复不能选择"""
+        index = self.selected_index()
+        result = self.results[index] if index is not None else None
+        if result is None or not result.ok:
+            self.show_selected()
+            self.status_label.config(text="该角色的回复尚未完成或请求失败")
+            return
+        self.closed = True
+        self.window.destroy()
+        self.on_choose(result.text)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.window.destroy()
+        self.on_close()
+
+
+class Notification:
+    """
+    屏幕右下角的提示窗口
+    不获取焦点，不影响用户正在编辑的文档，显示一段时间后自动关闭
+    只能在主线程中创建
+    """
+
+    def __init__(self, root, title, message, duration=6.0):
+        """
+        :param root: 主窗口
+        :param title: 标题
+        :param message: 提示内容
+        :param duration: 显示时间（秒），点击窗口可以提前关闭
+        """
+        self.window = tk.Toplevel(root)
+        self.window.overrideredirect(True)
+        self.window.attributes('-topmost', True)
+
+        frame = ttk.Frame(self.window, padding=10, relief='solid', borderwidth=1)
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text=title, font=('微软雅黑', 10, 'bold')).pack(anchor=tk.W)
+        ttk.Label(frame, text=message, font=('微软雅黑', 9), wraplength=360, justify=tk.LEFT).pack(anchor=tk.W, pady=(5, 0))
+        for widget in (self.window, frame, *frame.winfo_children()):
+            widget.bind('<Button-1>', lambda event: self.close())
+
+        self.window.update_idletasks()
+        x = self.window.winfo_screenwidth() - self.window.winfo_reqwidth() - 20
+        y = self.window.winfo_screenheight() - self.window.winfo_reqheight() - 60
+        self.window.geometry(f"+{x}+{y}")
+        self.window.after(int(duration * 1000), self.close)
+
+    def close(self):
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None